@@ -0,0 +1,27 @@
+
+class AnalysisFile:
+    """
+    This class represents a file found for analysis.
+    An analysis file has a path and, if it is a frame of a video, the index and timestamp of that frame
+    """
+
+    def __init__(self, path, frame_index=None, timestamp=None):
+        self.__path = path
+        self.__frame_index = frame_index
+        self.__timestamp = timestamp
+
+    def get_path(self):
+        """:return: Returns this file's path"""
+        return self.__path
+
+    def get_frame_index(self):
+        """:return: Returns the index of the frame in the video, or None if this file is an image"""
+        return self.__frame_index
+
+    def get_timestamp(self):
+        """:return: Returns the time of the frame in the video in seconds, or None if this file is an image"""
+        return self.__timestamp
+
+    def is_video_frame(self):
+        """:return: Returns True if this file is a frame of a video, False otherwise"""
+        return self.__frame_index is not None
@@ -0,0 +1,110 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+class Compositor:
+    """
+    This class is responsible for drawing the overlays of a result over its image. Every overlay is blended in a single
+    pass over a buffer that is kept between calls, and only where the overlay draws something, instead of converting and
+    padding a copy of the whole image for each overlay.
+    Like the overlays (see Overlay), the image is at the top right corner of the largest layer
+    """
+
+    def __init__(self):
+        self.__local = threading.local()  # Buffers of each thread, kept between calls
+        self.__stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def compose(self, image, layers, out=None):
+        """
+        Draws layers over an image
+        :param image: BGR image
+        :param layers: BGRA images drawn over the image, in order. They may be larger than the image
+        :param out: Optional BGR image to draw into, as large as the largest of the image and the layers (it may be the
+        image itself if no layer is larger than it). If None, a new one is made
+        :return: Returns the BGR image with the layers drawn over it
+        """
+        start = time.perf_counter()
+        height = max([image.shape[0]] + [layer.shape[0] for layer in layers])
+        width = max([image.shape[1]] + [layer.shape[1] for layer in layers])
+        if out is None:
+            out = np.empty((height, width, 3), dtype="uint8")
+        elif out.shape != (height, width, 3):
+            raise ValueError("The output image is {0}, it should be {1}".format(out.shape, (height, width, 3)))
+
+        # The rest of the canvas is black, like the padding of the overlays
+        left = width - image.shape[1]
+        out[:, :left] = 0
+        out[image.shape[0]:, left:] = 0
+        if out is not image:
+            out[:image.shape[0], left:] = image
+
+        # Only the part of each layer that isn't transparent is blended, and the part of the canvas that any layer draws
+        # on is converted to float and back once for all of them
+        regions = []
+        for layer in layers:
+            x, y, w, h = cv2.boundingRect(layer[:, :, 3])
+            if w > 0 and h > 0:
+                regions.append((layer[y:y + h, x:x + w], width - layer.shape[1] + x, y))
+        pixels = 0
+        if len(regions) > 0:
+            x0 = min(x for region, x, y in regions)
+            y0 = min(y for region, x, y in regions)
+            x1 = max(x + region.shape[1] for region, x, y in regions)
+            y1 = max(y + region.shape[0] for region, x, y in regions)
+            canvas = self.__get_buffer("canvas", (y1 - y0, x1 - x0, 3))
+            np.copyto(canvas, out[y0:y1, x0:x1])
+            for region, x, y in regions:
+                h, w = region.shape[:2]
+                target = canvas[y - y0:y - y0 + h, x - x0:x - x0 + w]
+                alpha = self.__get_buffer("alpha", (h, w, 1))
+                difference = self.__get_buffer("difference", (h, w, 3))
+                # target += (layer - target) * alpha
+                np.multiply(region[:, :, 3:], np.float32(1 / 255), out=alpha)
+                np.subtract(region[:, :, :3], target, out=difference)
+                difference *= alpha
+                target += difference
+                pixels += h * w
+            np.copyto(out[y0:y1, x0:x1], canvas, casting="unsafe")
+
+        elapsed = time.perf_counter() - start
+        with self.__stats_lock:
+            self.__stats["calls"] += 1
+            self.__stats["time"] += elapsed
+            self.__stats["max_time"] = max(self.__stats["max_time"], elapsed)
+            self.__stats["last"] = {"time_ms": elapsed * 1000, "layers": len(layers), "size": (width, height),
+                                    "pixels_blended": pixels}
+        return out
+
+    def __get_buffer(self, name, shape):
+        """
+        :return: Returns a float32 array of the given shape, made from a buffer of the calling thread that only grows
+        """
+        size = int(np.prod(shape))
+        buffer = getattr(self.__local, name, None)
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size, dtype="float32")
+            setattr(self.__local, name, buffer)
+        return buffer[:size].reshape(shape)
+
+    def get_stats(self):
+        """
+        :return: Returns the number of images composed, the average and maximum time it took, and the time, number of
+        layers, size and pixels blended of the last one
+        """
+        with self.__stats_lock:
+            stats = self.__stats
+            return {"calls": stats["calls"],
+                    "avg_time_ms": stats["time"] / stats["calls"] * 1000 if stats["calls"] > 0 else 0,
+                    "max_time_ms": stats["max_time"] * 1000,
+                    "last": stats["last"]}
+
+    def reset_stats(self):
+        """
+        Resets the compositing statistics
+        """
+        with self.__stats_lock:
+            self.__stats = {"calls": 0, "time": 0, "max_time": 0, "last": None}
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import threading
+
+import cv2
+import numpy as np
+
+
+class DescriptorCache:
+    """
+    This class is responsible for keeping the keypoints and descriptors computed for the images for analysis on disk,
+    so that they don't have to be computed again when the same images are processed with another reference.
+    Each entry is stored as two .npy files (keypoints and descriptors) spread over shard directories, and a small
+    index maps each entry's key to its files
+    """
+
+    def __init__(self, directory="./cache/descriptors", save_every=500):
+        self.__directory = directory
+        self.__index_path = directory + "/index.json"
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__unsaved_entries = 0
+        self.__save_every = save_every  # Number of new entries after which the index is saved. None to never save it
+        self.__new_entries = {}  # Entries added since pop_new_entries was last called
+        self.__new_file_hashes = {}  # Files hashed since pop_new_entries was last called
+        try:
+            with open(self.__index_path, "r") as f:
+                index = json.load(f)
+            self.__entries = index["entries"]  # Entry key -> {"file": shard file name, "empty": bool}
+            self.__file_hashes = index["files"]  # Path -> [size, mtime, content hash]
+        except (OSError, ValueError, KeyError):
+            self.__entries = {}
+            self.__file_hashes = {}
+
+    def get(self, path, frame_index, method_key):
+        """
+        Looks for the keypoints and descriptors of an image
+        :param path: Path of the image (or video)
+        :param frame_index: Index of the frame if the path points to a video, None otherwise
+        :param method_key: Identifies the method and its parameters (see FeatureMatcher.get_method_key)
+        :return: Returns a tuple (keypoints, descriptors) if they are cached, else returns None
+        """
+        key = self.__get_key(path, frame_index, method_key)
+        with self.__lock:
+            entry = self.__entries.get(key) if key is not None else None
+            if entry is None:
+                self.__misses += 1
+                return None
+        try:
+            if entry["empty"]:
+                keypoints, descriptors = [], None
+            else:
+                base = self.__directory + "/" + entry["file"]
+                keypoints = DescriptorCache.array_to_keypoints(np.load(base + ".kp.npy"))
+                descriptors = np.load(base + ".des.npy")
+        except (OSError, ValueError):
+            with self.__lock:
+                self.__entries.pop(key, None)
+                self.__misses += 1
+            return None
+        with self.__lock:
+            self.__hits += 1
+        return keypoints, descriptors
+
+    def put(self, path, frame_index, method_key, keypoints, descriptors):
+        """
+        Stores the keypoints and descriptors of an image
+        :param path: Path of the image (or video)
+        :param frame_index: Index of the frame if the path points to a video, None otherwise
+        :param method_key: Identifies the method and its parameters (see FeatureMatcher.get_method_key)
+        :param keypoints: Keypoints of the image
+        :param descriptors: Descriptors of the image
+        """
+        key = self.__get_key(path, frame_index, method_key)
+        if key is None:
+            return
+        file = hashlib.sha1(key.encode()).hexdigest()
+        file = file[:2] + "/" + file  # Spread the entries over shard directories
+        empty = descriptors is None or len(keypoints) == 0
+        if not empty:
+            base = self.__directory + "/" + file
+            try:
+                os.makedirs(os.path.dirname(base), exist_ok=True)
+                np.save(base + ".kp.npy", DescriptorCache.keypoints_to_array(keypoints))
+                np.save(base + ".des.npy", np.ascontiguousarray(descriptors))
+            except OSError:
+                return
+        with self.__lock:
+            self.__entries[key] = {"file": file, "empty": empty}
+            self.__new_entries[key] = self.__entries[key]
+            self.__unsaved_entries += 1
+            save = self.__save_every is not None and self.__unsaved_entries >= self.__save_every
+        if save:
+            self.save()
+
+    def save(self):
+        """
+        Saves the index so that the cached entries can be used the next time the program runs
+        """
+        with self.__lock:
+            if self.__unsaved_entries == 0:
+                return
+            index = {"entries": dict(self.__entries), "files": dict(self.__file_hashes)}
+            self.__unsaved_entries = 0
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            with open(self.__index_path + ".tmp", "w") as f:
+                json.dump(index, f)
+            os.replace(self.__index_path + ".tmp", self.__index_path)
+        except OSError:
+            pass
+
+    def pop_new_entries(self):
+        """
+        Takes the entries added since the last call, e.g. so that a worker process can hand them to the main process.
+        The hits and misses counted since the last call are taken with them
+        :return: Returns a dictionary with the new entries, the hashes of their files and the number of hits and misses,
+        to be given to add_entries
+        """
+        with self.__lock:
+            new_entries = {"entries": self.__new_entries, "files": self.__new_file_hashes, "hits": self.__hits,
+                           "misses": self.__misses}
+            self.__new_entries = {}
+            self.__new_file_hashes = {}
+            self.__hits = 0
+            self.__misses = 0
+        return new_entries
+
+    def add_entries(self, new_entries):
+        """
+        Adds entries stored by another descriptor cache over the same directory
+        :param new_entries: New entries, as returned by pop_new_entries
+        """
+        with self.__lock:
+            self.__entries.update(new_entries["entries"])
+            self.__file_hashes.update(new_entries["files"])
+            self.__hits += new_entries["hits"]
+            self.__misses += new_entries["misses"]
+            self.__unsaved_entries += len(new_entries["entries"])
+            save = self.__save_every is not None and self.__unsaved_entries >= self.__save_every
+        if save:
+            self.save()
+
+    def get_directory(self):
+        """:return: Returns the directory the entries are stored in"""
+        return self.__directory
+
+    def get_stats(self):
+        """:return: Returns the number of cache hits and misses"""
+        with self.__lock:
+            return {"hits": self.__hits, "misses": self.__misses}
+
+    def reset_stats(self):
+        """
+        Resets the number of cache hits and misses
+        """
+        with self.__lock:
+            self.__hits = 0
+            self.__misses = 0
+
+    def __get_key(self, path, frame_index, method_key):
+        """
+        Builds the key of an entry from the content hash and modification time of the file, the frame and the method
+        :return: Returns the key, or None if the file can't be read
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        # Only hash the file again if it changed since it was last hashed
+        with self.__lock:
+            known = self.__file_hashes.get(path)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            content_hash = known[2]
+        else:
+            sha1 = hashlib.sha1()
+            try:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        sha1.update(chunk)
+            except OSError:
+                return None
+            content_hash = sha1.hexdigest()
+            with self.__lock:
+                self.__file_hashes[path] = [stat.st_size, stat.st_mtime_ns, content_hash]
+                self.__new_file_hashes[path] = self.__file_hashes[path]
+
+        return "{0}:{1}:{2}:{3}".format(content_hash, stat.st_mtime_ns, frame_index, method_key)
+
+    @staticmethod
+    def keypoints_to_array(keypoints):
+        """
+        Packs keypoints into an array, one row (x, y, size, angle, response, octave, class id) per keypoint
+        """
+        return np.array([[kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id]
+                         for kp in keypoints], dtype="float64").reshape(-1, 7)
+
+    @staticmethod
+    def array_to_keypoints(array):
+        """
+        Unpacks keypoints packed with keypoints_to_array
+        """
+        return [cv2.KeyPoint(float(x), float(y), float(size), float(angle), float(response), int(octave), int(class_id))
+                for x, y, size, angle, response, octave, class_id in array]
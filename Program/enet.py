@@ -1,5 +1,7 @@
 import cv2
 import numpy as np
+from overlay import Overlay
+from prepared_net import PreparedNet
 
 
 class ENet:
@@ -22,53 +24,68 @@ class ENet:
         self.__colors = np.array(self.__colors, dtype="uint8")
         self.__model_path = "./resources/models/enet_model/enet-model.net"
         self.__net = cv2.dnn.readNet(self.__model_path)
+        self.__prepared_net = PreparedNet(self.__net, (1, 3, 512, 1024))
 
     def get_class_labels(self):
         return self.__class_labels
 
     def detect(self, image, classes, use_cuda):
-        # Enable/Disable gpu processing
-        if use_cuda:
-            self.__net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-            self.__net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
-        else:
-            self.__net.setPreferableBackend(cv2.dnn.DNN_BACKEND_DEFAULT)
-            self.__net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
-
-        img = cv2.resize(image, (1024, 512))
-        blob = cv2.dnn.blobFromImage(img, 1 / 255.0, (1024, 512), 0,
-                                     swapRB=True, crop=False)
-        self.__net.setInput(blob)
-        output = self.__net.forward()
-        (number_classes, height, width) = output.shape[1:4]
+        return self.detect_batch([image], classes, use_cuda)[0]
+
+    def detect_batch(self, images, classes, use_cuda):
+        """
+        Segments several images
+        :param images: Images to process
+        :param classes: Labels of the classes to segment
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns a list with a tuple (information, images) for each image, like detect
+        """
+        outputs = self.forward_batch(images, use_cuda)
+        return [self.draw(image, output, classes) for image, output in zip(images, outputs)]
+
+    def prepare(self, use_cuda):
+        """
+        Sets up and warms up the network for the given backend, so that processing the first images isn't slower
+        :param use_cuda: True to use cuda, False otherwise
+        """
+        self.__prepared_net.prepare(use_cuda)
+
+    def forward_batch(self, images, use_cuda):
+        """
+        Runs several images through the network
+        :param images: Images to process
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns the output of the network for each image, to be drawn with draw
+        """
+        # The max unpooling layers of the network only take one image at a time in opencv, so the images can't go through
+        # the network together
+        outputs = []
+        for image in images:
+            img = cv2.resize(image, (1024, 512))
+            blob = cv2.dnn.blobFromImage(img, 1 / 255.0, (1024, 512), 0,
+                                         swapRB=True, crop=False)
+            outputs.append(self.__prepared_net.forward(blob, use_cuda)[0][0])
+        return outputs
+
+    def draw(self, image, output, classes):
+        """
+        Draws the segmentation of an image
+        :param image: Image that was processed
+        :param output: Output of the network for this image
+        :param classes: Labels of the classes to segment
+        :return: Returns the information regarding the image, and a set of overlays that depict the segmentation
+        """
+        (number_classes, height, width) = output.shape[0:3]
 
         # our output class ID map will be number_classes x height x width in
         # size, so we take the argmax to find the class label with the
         # largest probability for each and every (x, y)-coordinate in the
         # image
-        class_map = np.argmax(output[0], axis=0)
+        class_map = np.argmax(output, axis=0)
         for id in np.unique(class_map):
             if self.__class_labels[id] not in classes:
                 class_map = np.where(class_map == id, 0, class_map)
 
-        # given the class ID map, we can map each of the class IDs to its
-        # corresponding color
-        mask = self.__colors[class_map]
-
-        # resize the mask such that its dimensions match the original size
-        # of the input frame
-        mask = cv2.resize(mask, (img.shape[1], img.shape[0]),
-                          interpolation=cv2.INTER_NEAREST)
-
-        # perform a weighted combination of the input frame with the mask
-        # to form an output visualization
-        img_od_masks = ((0.3 * img) + (0.7 * mask)).astype("uint8")
-        min_height = 300
-        if image.shape[0] < min_height:
-            img_od_masks = cv2.resize(img_od_masks, (int(min_height / (image.shape[0] / image.shape[1])), min_height))
-        else:
-            img_od_masks = cv2.resize(img_od_masks, (image.shape[1], image.shape[0]))
-
         # Initialize the legend visualization
         num_classes = len(np.unique(class_map))
         row_height = 25
@@ -89,9 +106,13 @@ class ENet:
             cv2.rectangle(legend, (100, (i * row_height)), (150, (i * row_height) + row_height), tuple(color), -1)
             i += 1
 
-        legend = cv2.resize(legend, (int(legend.shape[1] / legend.shape[0] * img_od_masks.shape[0]), img_od_masks.shape[0]))
-        img_od_masks = np.concatenate((legend, img_od_masks), axis=1)
-        img_od_masks = np.c_[img_od_masks, np.full((img_od_masks.shape[0], img_od_masks.shape[1], 1), 255)]
+        # The legend is put on the left side of the image, as tall as it. The class ID map is kept at the resolution of
+        # the network and each class's color is blended with the image when the overlay is drawn
+        (H, W) = image.shape[:2]
+        legend_width = int(legend.shape[1] / legend.shape[0] * H)
+        img_od_masks = Overlay(legend_width + W, H)
+        img_od_masks.add_image(legend, (0, 0), (legend_width, H))
+        img_od_masks.add_label_map(class_map, self.__colors, (legend_width, 0), (W, H), 0.7)
 
         return {"detections": None, "num_classes": num_classes}, {"img_od_bounding_boxes": None,
                                                                          "img_od_class_labels": None,
@@ -1,6 +1,9 @@
 import cv2
 import numpy as np
 
+from overlay import Overlay
+from prepared_net import PreparedNet
+
 
 class ENet_MaskRCNN:
     """
@@ -20,6 +23,7 @@ class ENet_MaskRCNN:
                                        [0, 0, 230], [119, 11, 32]], dtype="uint8")
         self.__enet_model_path = "./resources/models/enet_model/enet-model.net"
         self.__enet_net = cv2.dnn.readNet(self.__enet_model_path)
+        self.__enet_prepared_net = PreparedNet(self.__enet_net, (1, 3, 512, 1024))
         self.__maskrcnn_class_labels = ['person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train',
                                         'truck', 'boat', 'traffic light', 'fire hydrant', 'street sign',
                                         'stop sign', 'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse',
@@ -38,6 +42,8 @@ class ENet_MaskRCNN:
         self.__maskrcnn_weights_path = "./resources/models/mask_rcnn_model/frozen_inference_graph.pb"
         self.__maskrcnn_config_path = "./resources/models/mask_rcnn_model/mask_rcnn_inception_v2_coco_2018_01_28.pbtxt"
         self.__maskrcnn_net = cv2.dnn.readNetFromTensorflow(self.__maskrcnn_weights_path, self.__maskrcnn_config_path)
+        self.__maskrcnn_prepared_net = PreparedNet(self.__maskrcnn_net, (1, 3, 480, 640),
+                                                   ["detection_out_final", "detection_masks"])
         self.__maskrcnn_confidence_threshold = 0.5
         self.__maskrcnn_mask_threshold = 0.7
 
@@ -152,28 +158,61 @@ class ENet_MaskRCNN:
                 classes_detected.append(self.__enet_class_labels[id])
         return output, classes_detected
 
-    def detect(self, img, classes, use_cuda):
-        # Enable/Disable gpu processing
-        if use_cuda:
-            self.__enet_net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-            self.__enet_net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
-            self.__maskrcnn_net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-            self.__maskrcnn_net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
-        else:
-            self.__enet_net.setPreferableBackend(cv2.dnn.DNN_BACKEND_DEFAULT)
-            self.__enet_net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
-            self.__maskrcnn_net.setPreferableBackend(cv2.dnn.DNN_BACKEND_DEFAULT)
-            self.__maskrcnn_net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
-
-        min_height = 300
-        if img.shape[0] < min_height:
-            image = cv2.resize(img, (int(min_height / (img.shape[0] / img.shape[1])), min_height))
-        else:
-            image = img
+    def detect_batch(self, imgs, classes, use_cuda):
+        """
+        Segments several images
+        :param imgs: Images to process
+        :param classes: Labels of the classes to segment
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns a list with a tuple (information, images) for each image, like detect
+        """
+        outputs = self.forward_batch(imgs, use_cuda)
+        return [self.draw(img, output, classes) for img, output in zip(imgs, outputs)]
 
-        blob = cv2.dnn.blobFromImage(image, 1 / 255.0, (1024, 512), 0, swapRB=True, crop=False)
-        self.__enet_net.setInput(blob)
-        output = self.__enet_net.forward()
+    def detect(self, img, classes, use_cuda):
+        return self.detect_batch([img], classes, use_cuda)[0]
+
+    def prepare(self, use_cuda):
+        """
+        Sets up and warms up both networks for the given backend, so that processing the first images isn't slower
+        :param use_cuda: True to use cuda, False otherwise
+        """
+        self.__enet_prepared_net.prepare(use_cuda)
+        self.__maskrcnn_prepared_net.prepare(use_cuda)
+
+    def forward_batch(self, imgs, use_cuda):
+        """
+        Runs several images through both networks. The images go through the networks one at a time, because ENet only
+        takes one image at a time and Mask R-CNN takes each image at its own size
+        :param imgs: Images to process
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns the outputs of the networks for each image, to be drawn with draw
+        """
+        outputs = []
+        for img in imgs:
+            min_height = 300
+            if img.shape[0] < min_height:
+                image = cv2.resize(img, (int(min_height / (img.shape[0] / img.shape[1])), min_height))
+            else:
+                image = img
+
+            blob = cv2.dnn.blobFromImage(image, 1 / 255.0, (1024, 512), 0, swapRB=True, crop=False)
+            output = self.__enet_prepared_net.forward(blob, use_cuda)[0]
+
+            blob = cv2.dnn.blobFromImage(image, swapRB=True, crop=False)
+            (boxes, masks) = self.__maskrcnn_prepared_net.forward(blob, use_cuda)
+            outputs.append((image, output, boxes, masks))
+        return outputs
+
+    def draw(self, img, outputs, classes):
+        """
+        Draws the segmentation of an image
+        :param img: Image that was processed
+        :param outputs: Outputs of the networks for this image
+        :param classes: Labels of the classes to segment
+        :return: Returns the information regarding the image, and a set of overlays that depict the segmentation
+        """
+        (image, output, boxes, masks) = outputs
 
         # infer the total number of classes along with the spatial
         # dimensions of the mask image via the shape of the output array
@@ -192,20 +231,30 @@ class ENet_MaskRCNN:
             elif self.__enet_class_labels[id] not in enet_classes_detected:
                 enet_classes_detected.append(self.__enet_class_labels[id])
 
-        ss_mask = self.__enet_colors[class_map]
+        # initialize the legend visualization
+        row_height = 25
+        legend = np.full(((len(enet_classes_detected) * row_height), 150, 3), 33, dtype="uint8")
 
-        # resize the mask such that its dimensions match the original size
-        # of the input frame
-        ss_mask = cv2.resize(ss_mask, (image.shape[1], image.shape[0]),
-                             interpolation=cv2.INTER_NEAREST)
+        # Draw the class name + color on the legend
+        i = 0
+        for label in sorted(enet_classes_detected):
+            id = self.__enet_class_labels.index(label)
+            color = [int(c) for c in self.__enet_colors[id]]
+            cv2.putText(legend, label, (5, (i * row_height) + 17), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (204, 204, 204), 1, cv2.LINE_AA)
+            cv2.rectangle(legend, (100, (i * row_height)), (150, (i * row_height) + row_height), tuple(color), -1)
+            i += 1
 
-        # perform a weighted combination of the input frame with the mask
-        # to form an output visualization
-        img_od_masks = ((0.3 * image) + (0.7 * ss_mask)).astype("uint8")
+        # The legend is put on the left side of the image, as tall as it. The class ID map is kept at the resolution of
+        # the network and each class's color is blended with the image when the overlay is drawn
+        (H, W) = img.shape[:2]
+        legend_width = int(H / (legend.shape[0] / legend.shape[1])) if legend.shape[0] > 0 else 0
+        img_od_masks = Overlay(legend_width + W, H)
+        if legend_width > 0:
+            img_od_masks.add_image(legend, (0, 0), (legend_width, H))
+        img_od_masks.add_label_map(class_map, self.__enet_colors, (legend_width, 0), (W, H), 0.7)
 
-        blob = cv2.dnn.blobFromImage(image, swapRB=True, crop=False)
-        self.__maskrcnn_net.setInput(blob)
-        (boxes, masks) = self.__maskrcnn_net.forward(["detection_out_final", "detection_masks"])
+        # Small images go through Mask R-CNN enlarged, so its detections are scaled back to the size of the image
+        scale = W / image.shape[1]
 
         # Loop over the detections
         maskrcnn_classes_detected = []
@@ -224,11 +273,12 @@ class ENet_MaskRCNN:
 
                 # Scale the bounding box coordinates back, relative to the size
                 # of the frame, and calculate the dimensions of the bounding box
-                (H, W) = image.shape[:2]
                 box = boxes[0, 0, i, 3:7] * np.array([W, H, W, H])
                 (startX, startY, endX, endY) = box.astype("int")
                 boxW = endX - startX
                 boxH = endY - startY
+                if boxW <= 0 or boxH <= 0:
+                    continue
 
                 # Get the segmentation mask
                 border = 4
@@ -239,67 +289,34 @@ class ENet_MaskRCNN:
                 mask_big = cv2.resize(mask, (boxW + border * 2, boxH + border * 2), interpolation=cv2.INTER_CUBIC)
                 mask_big = (mask_big > self.__maskrcnn_mask_threshold)
 
-                # Create an empty image with the specified size
-                aux = np.zeros((boxH + border * 2, boxW + border * 2, 4), dtype="uint8")
-                aux[mask_big != 0] = [255, 255, 255, 255]
+                # The outline is the part of the enlarged mask that is outside of the mask
+                outline = mask_big.astype("uint8") * 255
+                inside = cv2.copyMakeBorder(src=mask_small.astype("uint8"), top=border, bottom=border, left=border,
+                                            right=border, borderType=cv2.BORDER_CONSTANT, value=0)
+                outline[inside > 0] = 0
+                outline = cv2.resize(outline, (boxW, boxH), interpolation=cv2.INTER_CUBIC) > 0
 
-                roi = image[startY:endY, startX:endX, :]
-                roi = cv2.cvtColor(roi, cv2.COLOR_BGR2BGRA)
-                roi[mask_small == 0] = [0, 0, 0, 0]
-
-                top = int((aux.shape[0] - roi.shape[0]) / 2)
-                side = int((aux.shape[1] - roi.shape[1]) / 2)
-                roi = cv2.copyMakeBorder(src=roi, top=top, bottom=top,
-                                         left=side, right=side,
-                                         borderType=cv2.BORDER_CONSTANT, value=[0, 0, 0, 0])
-                m = roi[:, :, 3] > 0
-                aux[m] = [0, 0, 0, 0]
-                aux = cv2.resize(aux, (boxW, boxH), interpolation=cv2.INTER_CUBIC)
-                m = aux[:, :, 3] > 0
+                # Lighten the region under the mask and draw its outline in white. The tiles are a single white pixel
+                # stretched over the bounding box, with the masks of the bounding box
+                x = legend_width + startX
+                white = np.full((1, 1, 3), 255, dtype="uint8")
+                img_od_masks.add_image(white, (x, startY), (boxW, boxH), mask_small, 0.2)
+                img_od_masks.add_image(white, (x, startY), (boxW, boxH), outline)
 
-                # Get the region of the image that corresponds to the mask
-                img_od_masks = cv2.cvtColor(img_od_masks, cv2.COLOR_BGR2BGRA)
-                region = img_od_masks[startY:endY, startX:endX][mask_small]
-
-                # Blend this class's color with the region under the mask
-                color = np.array([[255, 255, 255, 255]])
-                blended = ((0.2 * color) + (0.8 * region)).astype("uint8")
-                img_od_masks[startY:endY, startX:endX, :][mask_small] = blended
-                img_od_masks[startY:endY, startX:endX, :][m] = aux[m]
                 text = "{0}: {1}%".format(class_name, round(confidence * 100, 1))
-                desired_text_height = img_od_masks.shape[0] * 0.02
+                desired_text_height = image.shape[0] * 0.02
                 font_size = 0.1
                 while cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_size, max(int(font_size * 3), 1))[0][1] < desired_text_height:
                     font_size += 0.1
                 font_size = round(font_size, 1)
                 thickness = max(int(font_size * 3), 1)
                 text_size = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_size, thickness)
-                text_w = text_size[0][0]
-                text_h = text_size[0][1]
-                text_x = int(startX - (text_w - (endX - startX)) / 2)
-                text_y = int(startY - 5)
-                cv2.rectangle(img_od_masks, (text_x, text_y - text_h), (text_x + text_w, text_y), (50, 50, 50, 255), -1)
-                cv2.putText(img_od_masks, text, (text_x, text_y), cv2.FONT_HERSHEY_SIMPLEX, font_size, (255, 255, 255, 255), thickness, cv2.LINE_AA)
-
-        # initialize the legend visualization
-        row_height = 25
-        legend = np.full(((len(enet_classes_detected) * row_height), 150, 3), 33, dtype="uint8")
-        legend = np.c_[legend, np.full((legend.shape[0], legend.shape[1], 1), 255)].astype("uint8")
-
-        # Draw the class name + color on the legend
-        i = 0
-        for label in sorted(enet_classes_detected):
-            id = self.__enet_class_labels.index(label)
-            color = [int(c) for c in self.__enet_colors[id]]
-            color.append(255)
-            cv2.putText(legend, label, (5, (i * row_height) + 17), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (204, 204, 204), 1, cv2.LINE_AA)
-            cv2.rectangle(legend, (100, (i * row_height)), (150, (i * row_height) + row_height), tuple(color), -1)
-            i += 1
-
-        legend = cv2.resize(legend, (int(img_od_masks.shape[0] / (legend.shape[0] / legend.shape[1])), img_od_masks.shape[0]))
-        if img_od_masks.shape[2] == 3:
-            img_od_masks = np.c_[img_od_masks, np.full((img_od_masks.shape[0], img_od_masks.shape[1], 1), 255)]
-        img_od_masks = np.concatenate((legend, img_od_masks), axis=1)
+                text_w = int(text_size[0][0] * scale)
+                text_h = int(text_size[0][1] * scale)
+                text_x = int(x - (text_w - (endX - startX)) / 2)
+                text_y = int(startY - 5 * scale)
+                img_od_masks.add_rectangle((text_x, text_y - text_h), (text_x + text_w, text_y), (50, 50, 50, 255), -1)
+                img_od_masks.add_text(text, (text_x, text_y), font_size * scale, (255, 255, 255, 255), thickness * scale, cv2.LINE_AA)
 
         return {"detections": None, "num_classes": len(np.unique(enet_classes_detected + maskrcnn_classes_detected))}, {"img_od_bounding_boxes": None,
                                                                                                               "img_od_class_labels": None,
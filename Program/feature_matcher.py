@@ -1,5 +1,9 @@
+import json
+import threading
+import time
 import cv2
 import numpy as np
+from overlay import Overlay
 
 
 class FeatureMatcher:
@@ -7,18 +11,41 @@ class FeatureMatcher:
     This class is responsible for image processing using the SIFT, SURF or ORB feature matching algorithms
     """
 
-    def __init__(self):
-        self.__sift = cv2.xfeatures2d.SIFT_create()
-        self.__surf = cv2.xfeatures2d.SURF_create()
-        self.__surf_cuda = cv2.cuda.SURF_CUDA_create(400)
-        self.__orb = cv2.ORB_create(nfeatures=100000)
-        self.__orb_cuda = cv2.cuda.ORB_create(nfeatures=100000)
-        self.__brisk = cv2.BRISK_create()
-        self.__akaze = cv2.AKAZE_create()
+    # Available matchers
+    MATCHER_BRUTE_FORCE = "brute_force"  # Exact, cross checked brute force matching
+    MATCHER_APPROXIMATE = "approximate"  # Approximate nearest neighbours (FLANN KD-tree or LSH) with a ratio test
+
+    def __init__(self, descriptor_cache=None, matcher=MATCHER_BRUTE_FORCE, use_cuda=True):
+        """
+        :param descriptor_cache: Optional descriptor cache for the images for analysis
+        :param matcher: Matcher used without cuda (MATCHER_BRUTE_FORCE or MATCHER_APPROXIMATE)
+        :param use_cuda: False to leave out the cuda detectors (e.g. in processes that only match without cuda)
+        """
+        # Parameters the feature detectors are created with. They are part of the descriptor cache keys
+        self.__detector_params = {"SIFT": {}, "SURF": {}, "ORB": {"nfeatures": 100000}, "BRISK": {}, "AKAZE": {}}
+        self.__sift = cv2.xfeatures2d.SIFT_create(**self.__detector_params["SIFT"])
+        self.__surf = cv2.xfeatures2d.SURF_create(**self.__detector_params["SURF"])
+        self.__surf_cuda = cv2.cuda.SURF_CUDA_create(400) if use_cuda else None
+        self.__orb = cv2.ORB_create(**self.__detector_params["ORB"])
+        self.__orb_cuda = cv2.cuda.ORB_create(nfeatures=100000) if use_cuda else None
+        self.__brisk = cv2.BRISK_create(**self.__detector_params["BRISK"])
+        self.__akaze = cv2.AKAZE_create(**self.__detector_params["AKAZE"])
+        self.__descriptor_cache = descriptor_cache  # Keypoints/descriptors of analysis images computed in earlier runs
         self.__brute_force_matcher_l2 = cv2.BFMatcher(cv2.NORM_L2, crossCheck=True)
         self.__brute_force_matcher_hamming = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
         self.__num_matches = 30  # Minimum number of matches that have to be found to be considered relevant
 
+        # Approximate matching. The index is built over the reference descriptors once and queried with each image
+        self.__matcher = matcher
+        self.__flann_kdtree_params = dict(algorithm=1, trees=5)  # For float descriptors (SIFT, SURF)
+        self.__flann_lsh_params = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)  # For binary ones
+        self.__flann_search_params = dict(checks=50)
+        self.__ratio = 0.75  # Lowe's ratio test threshold
+        self.__flann_references = threading.local()  # (Reference descriptors, trained FLANN matcher) of each thread
+        self.__recall_sample_every = 20  # Also match exactly every n images to estimate the recall of the approximation
+        self.__stats_lock = threading.Lock()
+        self.reset_matcher_stats()
+
     def compute_keypoints_descriptors(self, img, method, use_cuda):
         """
         Computes the keypoints and descriptors of the image passed as a parameter
@@ -51,6 +78,50 @@ class FeatureMatcher:
             # Calculate keypoints and descriptors
             return method.detectAndCompute(img_gray, None)
 
+    def get_method_key(self, active_method):
+        """
+        Identifies a feature detection/extraction method and the parameters it is used with
+        :param active_method: Method to be used for feature/descriptor detection/extraction
+        :return: Returns a string that changes whenever the keypoints/descriptors computed would change
+        """
+        name = active_method.get_name()
+        return "{0}:{1}:{2}".format(name, json.dumps(self.__detector_params.get(name, {}), sort_keys=True),
+                                    cv2.__version__)
+
+    def get_cache_stats(self):
+        """:return: Returns the descriptor cache hits and misses, or None if there is no descriptor cache"""
+        if self.__descriptor_cache is None:
+            return None
+        return self.__descriptor_cache.get_stats()
+
+    def save_cache(self):
+        """
+        Saves the descriptor cache index, if there is a descriptor cache
+        """
+        if self.__descriptor_cache is not None:
+            self.__descriptor_cache.save()
+
+    def get_matcher_stats(self):
+        """
+        :return: Returns the matcher in use, the number of images matched and the average time it took, and, for the
+        approximate matcher, the recall and speedup measured against exact matching on a sample of the images
+        """
+        with self.__stats_lock:
+            stats = self.__matcher_stats
+            return {"matcher": self.__matcher,
+                    "calls": stats["calls"],
+                    "avg_time_ms": stats["time"] / stats["calls"] * 1000 if stats["calls"] > 0 else 0,
+                    "sampled_recall": stats["sampled_found"] / stats["sampled_exact"] if stats["sampled_exact"] > 0 else None,
+                    "sampled_speedup": stats["sampled_exact_time"] / stats["sampled_time"] if stats["sampled_time"] > 0 else None}
+
+    def reset_matcher_stats(self):
+        """
+        Resets the matcher statistics
+        """
+        with self.__stats_lock:
+            self.__matcher_stats = {"calls": 0, "time": 0, "sampled_exact": 0, "sampled_found": 0,
+                                    "sampled_time": 0, "sampled_exact_time": 0}
+
     def process_matches(self, descriptors_1, descriptors_2, matcher):
         """
         Matches the descriptors passed as parameters
@@ -59,7 +130,77 @@ class FeatureMatcher:
         :param matcher: Matcher to be used (depends on feature extraction method)
         :return: Returns the matches found
         """
-        return matcher.match(descriptors_1, descriptors_2)
+        if descriptors_2 is None or len(descriptors_2) == 0:
+            return []
+        start = time.perf_counter()
+        matches = matcher.match(descriptors_1, descriptors_2)
+        with self.__stats_lock:
+            self.__matcher_stats["calls"] += 1
+            self.__matcher_stats["time"] += time.perf_counter() - start
+        return matches
+
+    def process_matches_approximate(self, descriptors_ref, descriptors_analysis, binary):
+        """
+        Matches the descriptors passed as parameters using approximate nearest neighbours and a ratio test
+        :param descriptors_ref: Reference descriptors (the FLANN index is built over them)
+        :param descriptors_analysis: Analysis image descriptors
+        :param binary: True if the descriptors are binary (ORB, BRISK, AKAZE), False otherwise (SIFT, SURF)
+        :return: Returns the matches found, with queryIdx indexing the reference and trainIdx the analysis descriptors
+        """
+        if descriptors_analysis is None or len(descriptors_analysis) == 0:
+            return []
+
+        # Build the index over the reference descriptors only when the reference changes
+        flann_reference = getattr(self.__flann_references, "reference", None)
+        if flann_reference is None or flann_reference[0] is not descriptors_ref:
+            index_params = self.__flann_lsh_params if binary else self.__flann_kdtree_params
+            flann = cv2.FlannBasedMatcher(index_params, self.__flann_search_params)
+            flann.add([descriptors_ref])
+            flann.train()
+            flann_reference = (descriptors_ref, flann)
+            self.__flann_references.reference = flann_reference
+
+        start = time.perf_counter()
+        matches = self.__ratio_test(flann_reference[1].knnMatch(descriptors_analysis, k=2))
+        elapsed = time.perf_counter() - start
+
+        with self.__stats_lock:
+            self.__matcher_stats["calls"] += 1
+            self.__matcher_stats["time"] += elapsed
+            sample = self.__matcher_stats["calls"] % self.__recall_sample_every == 1
+
+        # Every few images, also match exactly to measure how much the approximation loses and how much faster it is
+        if sample:
+            start = time.perf_counter()
+            exact_matcher = cv2.BFMatcher(cv2.NORM_HAMMING if binary else cv2.NORM_L2)
+            exact = self.__ratio_test(exact_matcher.knnMatch(descriptors_analysis, descriptors_ref, k=2))
+            exact_time = time.perf_counter() - start
+            found = set((m.queryIdx, m.trainIdx) for m in matches)
+            with self.__stats_lock:
+                self.__matcher_stats["sampled_exact"] += len(exact)
+                self.__matcher_stats["sampled_found"] += sum(1 for m in exact if (m.queryIdx, m.trainIdx) in found)
+                self.__matcher_stats["sampled_time"] += elapsed
+                self.__matcher_stats["sampled_exact_time"] += exact_time
+
+        return matches
+
+    def __ratio_test(self, knn_matches):
+        """
+        Keeps the matches that are clearly better than the second best candidate, and only the best match for each
+        reference descriptor (like cross checking, this keeps the number of matches below the number of descriptors)
+        :param knn_matches: For each analysis descriptor, its two nearest reference descriptors
+        :return: Returns the matches kept, with queryIdx indexing the reference and trainIdx the analysis descriptors
+        """
+        best = {}
+        for candidates in knn_matches:
+            if len(candidates) == 0:
+                continue
+            m = candidates[0]
+            if len(candidates) > 1 and m.distance >= self.__ratio * candidates[1].distance:
+                continue
+            if m.trainIdx not in best or m.distance < best[m.trainIdx].distance:
+                best[m.trainIdx] = m
+        return [cv2.DMatch(m.trainIdx, m.queryIdx, m.distance) for m in best.values()]
 
     def process_reference(self, img_ref, active_method, use_cuda):
         active_method = active_method.get_name()
@@ -84,7 +225,51 @@ class FeatureMatcher:
 
         return self.compute_keypoints_descriptors(img_ref, method, use_cuda)
 
-    def process_result(self, img_ref, kp_ref, desc_ref, img_analysis, active_method, use_cuda):
+    def compute_analysis_descriptors(self, active_method, source, load_img):
+        """
+        Obtains the keypoints and descriptors of an image for analysis (without cuda), from the descriptor cache if
+        possible, so that the image only has to be decoded if they were never computed
+        :param active_method: Method to be used for feature/descriptor detection/extraction
+        :param source: Tuple (path, frame index) the analysis image is read from
+        :param load_img: Function that decodes the image for analysis, called only if it is needed
+        :return: Returns the keypoints and descriptors of the image, or None if the image can't be decoded
+        """
+        method_key = self.get_method_key(active_method)
+        active_method = active_method.get_name()
+        if "SIFT" in active_method:
+            method = self.__sift
+        elif "SURF" in active_method:
+            method = self.__surf
+        elif "ORB" in active_method:
+            method = self.__orb
+        elif "BRISK" in active_method:
+            method = self.__brisk
+        elif "AKAZE" in active_method:
+            method = self.__akaze
+        else:
+            return None
+        return self.__get_analysis_keypoints_descriptors(load_img, method, method_key, source)
+
+    def __get_analysis_keypoints_descriptors(self, load_img, method, method_key, source):
+        """
+        Looks for the keypoints and descriptors of an image for analysis in the descriptor cache, else computes them
+        (without cuda) and adds them to the cache
+        :return: Returns the keypoints and descriptors, or None if the image had to be decoded and couldn't be
+        """
+        use_cache = self.__descriptor_cache is not None and source is not None
+        if use_cache:
+            cached = self.__descriptor_cache.get(source[0], source[1], method_key)
+            if cached is not None:
+                return cached
+        img = load_img()
+        if img is None:
+            return None
+        keypoints, descriptors = self.compute_keypoints_descriptors(img, method, False)
+        if use_cache:
+            self.__descriptor_cache.put(source[0], source[1], method_key, keypoints, descriptors)
+        return keypoints, descriptors
+
+    def process_result(self, img_ref, kp_ref, desc_ref, img_analysis, active_method, use_cuda, source=None):
         """
         Looks for the reference image in the analysis image by detecting keypoints and descriptors and matching them,
         obtaining relevant information and images depicting the features found
@@ -94,18 +279,33 @@ class FeatureMatcher:
         :param img_analysis: Image for analysis
         :param active_method: Method to be used for feature/descriptor detection/extraction (SIFT, SURF or ORB)
         :param use_cuda: True to use cuda, False otherwise
-        :return: Returns the information regarding the analysis image, and a set of images that depict the features found
+        :param source: Tuple (path, frame index) the analysis image was read from. If given, the keypoints and
+        descriptors are looked up in (and added to) the descriptor cache
+        :return: Returns the information regarding the analysis image, and a set of overlays that depict the features
+        found
         """
+        found = self.match_result(desc_ref, img_analysis, active_method, use_cuda, source)
+        if found is None:
+            return
+        kp_analysis, desc_analysis, matches = found
+        return self.draw_result(img_ref, kp_ref, img_analysis.shape, kp_analysis, desc_analysis, matches)
 
-        # Images that will portray the features found
-        img_fm_bounding_box = np.zeros((img_analysis.shape[0], img_analysis.shape[1], 4), dtype="uint8")
-        img_fm_circle_prediction = np.zeros((img_analysis.shape[0], img_analysis.shape[1], 4), dtype="uint8")
-        img_fm_keypoints = np.zeros((img_analysis.shape[0], img_analysis.shape[1], 4), dtype="uint8")
-        img_fm_matches = np.zeros((img_analysis.shape[0], img_analysis.shape[1], 4), dtype="uint8")
+    def match_result(self, desc_ref, img_analysis, active_method, use_cuda, source=None):
+        """
+        Detects the keypoints and descriptors of an analysis image and matches them with the reference's
+        :param desc_ref: Pre processed reference descriptors
+        :param img_analysis: Image for analysis
+        :param active_method: Method to be used for feature/descriptor detection/extraction (SIFT, SURF or ORB)
+        :param use_cuda: True to use cuda, False otherwise
+        :param source: Tuple (path, frame index) the analysis image was read from. If given, the keypoints and
+        descriptors are looked up in (and added to) the descriptor cache
+        :return: Returns a tuple (keypoints, descriptors, matches) of the analysis image
+        """
 
         # Method and matcher to use
         method = None
         matcher = None
+        method_key = self.get_method_key(active_method)
         active_method = active_method.get_name()
 
         if use_cuda and ("SURF" not in active_method and "ORB" not in active_method):
@@ -118,6 +318,7 @@ class FeatureMatcher:
                 method = self.__orb_cuda
                 matcher = cv2.cuda_DescriptorMatcher.createBFMatcher(cv2.NORM_HAMMING)
         else:
+            binary = not ("SIFT" in active_method or "SURF" in active_method)
             if "SIFT" in active_method or "SURF" in active_method:
                 matcher = self.__brute_force_matcher_l2
                 if "SIFT" in active_method:
@@ -139,64 +340,79 @@ class FeatureMatcher:
                 img_analysis, method, use_cuda)
             matches = self.process_matches(desc_ref, desc_analysis_cuda, matcher)
         else:
-            kp_analysis, desc_analysis = self.compute_keypoints_descriptors(img_analysis, method, use_cuda)
-            matches = self.process_matches(desc_ref, desc_analysis, matcher)
+            kp_analysis, desc_analysis = self.__get_analysis_keypoints_descriptors(lambda: img_analysis, method,
+                                                                                   method_key, source)
+            if self.__matcher == FeatureMatcher.MATCHER_APPROXIMATE:
+                matches = self.process_matches_approximate(desc_ref, desc_analysis, binary)
+            else:
+                matches = self.process_matches(desc_ref, desc_analysis, matcher)
+        return kp_analysis, desc_analysis, matches
+
+    def draw_result(self, img_ref, kp_ref, img_shape, kp_analysis, desc_analysis, matches):
+        """
+        Draws the features found in an analysis image
+        :param img_ref: Reference image
+        :param kp_ref: Pre processed reference keypoints
+        :param img_shape: Shape of the image for analysis
+        :param kp_analysis: Keypoints of the analysis image
+        :param desc_analysis: Descriptors of the analysis image
+        :param matches: Matches between the reference and the analysis image (see match_result)
+        :return: Returns the information regarding the analysis image, and a set of overlays that depict the features
+        found
+        """
+
+        # Overlays that will portray the features found
+        (H, W) = img_shape[:2]
+        img_fm_bounding_box = Overlay(W, H)
+        img_fm_circle_prediction = Overlay(W, H)
+        img_fm_keypoints = Overlay(W, H)
+        img_fm_matches = Overlay(W, H)
 
-        # Some of the images that portray the features found rely on the number of matches found. If enough matches were
-        # found, this result is relevant and we can create those images
+        # Some of the overlays that portray the features found rely on the number of matches found. If enough matches
+        # were found, this result is relevant and we can draw them
         if len(matches) >= self.__num_matches:
             # Sort matches by distance
             matches = sorted(matches, key=lambda x: x.distance)
 
-            # Draw matches
-            img_fm_matches = cv2.drawMatches(img1=img_ref,
-                                             keypoints1=kp_ref,
-                                             img2=img_fm_matches,
-                                             keypoints2=kp_analysis,
-                                             matches1to2=matches,
-                                             outImg=None,
-                                             flags=2)
-
-            # Draw bounding box
-            # good_matches = matches[:self.__num_matches]  # Consider only the best matches so that the outline is more accurate
+            # Draw matches, with the reference on the left side, each with a random color
+            h, w = img_ref.shape[:2]
             good_matches = matches
             src_pts = np.float32([kp_ref[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
             dst_pts = np.float32([kp_analysis[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
+            img_fm_matches = Overlay(w + W, max(h, H))
+            img_fm_matches.add_image(img_ref, (0, 0))
+            colors = np.c_[np.random.randint(0, 256, (len(good_matches), 3)), np.full(len(good_matches), 255)]
+            img_fm_matches.add_lines(src_pts, dst_pts + np.float32([w, 0]), colors)
+
+            # Draw bounding box
+            # good_matches = matches[:self.__num_matches]  # Consider only the best matches so that the outline is more accurate
             M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-            h, w = img_ref.shape[:2]
             pts = np.float32([[0, 0], [0, h - 1], [w - 1, h - 1], [w - 1, 0]]).reshape(-1, 1, 2)
             dst = cv2.perspectiveTransform(pts, M)
-            value = img_analysis.shape[1] * img_analysis.shape[0]
+            value = W * H
             thickness = int(round(np.interp(value, [40000, 4000000], [1, 10])))
-            img_fm_bounding_box = cv2.polylines(img_fm_bounding_box, [np.int32(dst)], True, (0, 255, 0, 255), thickness,
-                                                cv2.LINE_AA)  # Draw bounding box in green
+            img_fm_bounding_box.add_polygon(dst, (0, 255, 0, 255), thickness)  # Draw bounding box in green
 
             # Calculate average point to draw circle guess
-            avg_point = [0, 0]
-            for match in good_matches:
-                avg_point[0] += kp_analysis[match.trainIdx].pt[0]
-                avg_point[1] += kp_analysis[match.trainIdx].pt[1]
-            avg_point[0] = int(avg_point[0] / len(good_matches))
-            avg_point[1] = int(avg_point[1] / len(good_matches))
+            avg_point = dst_pts.reshape(-1, 2).mean(axis=0).astype("int")
 
             # Draw circle guess
             radius = int(round(np.interp(value, [40000, 4000000], [5, 100])))
-            cv2.circle(img_fm_circle_prediction, tuple(avg_point), radius, (0, 255, 255, 255), -1)
-
-            """# Offset the keypoints by the width of the reference image that is added on the left side
-            offset_kp2 = []
-            for kp in kp_analysis:
-                offset_kp2.append(cv2.KeyPoint(kp.pt[0] + w, kp.pt[1], kp.size, kp.response, kp.octave, kp.class_id))
-
-            # Draw offset keypoints
-            img_fm_offset_keypoints = cv2.drawKeypoints(img_fm_offset_keypoints, offset_kp2, None,
-                                                        color=(0, 0, 255))  # Draw keypoints"""
+            img_fm_circle_prediction.add_circle(avg_point, radius, (0, 255, 255, 255), -1)
 
         # Draw keypoints only
-        if len(kp_analysis) >= 0:
-            img_fm_keypoints = cv2.drawKeypoints(img_fm_keypoints, kp_analysis, None, color=(0, 0, 255, 255))
+        points = np.float32([kp.pt for kp in kp_analysis]).reshape(-1, 2)
+        img_fm_keypoints.add_keypoints(points, (0, 0, 255, 255))
+
+        # The keypoints and matches are kept as arrays, and the descriptors only as their number
+        info = {"relevance": 0,
+                "keypoints": points,
+                "keypoint_sizes": np.float32([kp.size for kp in kp_analysis]),
+                "num_descriptors": 0 if desc_analysis is None else len(desc_analysis),
+                "matches": np.int32([(m.queryIdx, m.trainIdx) for m in matches]).reshape(-1, 2),
+                "match_distances": np.float32([m.distance for m in matches])}
 
         # Return information and images
-        return {"relevance": 0, "keypoints": kp_analysis, "descriptors": desc_analysis, "matches": matches}, \
+        return info, \
                {"img_fm_bounding_box": img_fm_bounding_box, "img_fm_circle_prediction": img_fm_circle_prediction,
                 "img_fm_keypoints": img_fm_keypoints, "img_fm_matches": img_fm_matches}
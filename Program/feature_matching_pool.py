@@ -0,0 +1,125 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from descriptor_cache import DescriptorCache
+from feature_matcher import FeatureMatcher
+from file_manager import FileManager
+from thumbnail_pyramid import ThumbnailPyramid
+
+
+class FeatureMatchingPool:
+    """
+    This class is responsible for matching the reference against the images for analysis in several processes, so that
+    feature matching can use every core. The images are split into shards of consecutive images, each matched by one
+    process. The reference descriptors are sent to each process once, when it starts, and the processes send back only
+    what is needed to draw and build the results (image shape, keypoints, descriptors and matches as arrays, and the
+    thumbnail pyramid of the image).
+    The processes are spawned rather than forked, since forking the GUI's process while its other threads hold locks
+    (Qt, OpenCV, the results manager's) can leave the processes deadlocked
+    """
+
+    def __init__(self, num_processes, shard_size=8, descriptor_cache=None, matcher=FeatureMatcher.MATCHER_BRUTE_FORCE):
+        self.__num_processes = num_processes
+        self.__shard_size = shard_size  # Number of consecutive images matched by a process at a time
+        self.__descriptor_cache = descriptor_cache  # The processes read and add to the same cache directory
+        self.__matcher = matcher
+
+    def run(self, active_method, descriptors, sources):
+        """
+        Matches the reference against the images for analysis. Stops early if the calling thread's stop flag is set.
+        If an image can't be matched, the exception is raised here
+        :param active_method: Method to be used for feature/descriptor detection/extraction
+        :param descriptors: Reference descriptors
+        :param sources: Tuples (path, frame index, stored image) of the images for analysis. The stored image is None if
+        the image is decoded from the path, else it is the path of a copy of the image or the image itself
+        :return: Yields a tuple (position in sources, image shape, (keypoints, descriptors, matches), thumbnail pyramid)
+        for each image that could be decoded, in order
+        """
+        thread = threading.currentThread()
+        shards = [list(range(i, min(i + self.__shard_size, len(sources))))
+                  for i in range(0, len(sources), self.__shard_size)]
+        cache_directory = None
+        if self.__descriptor_cache is not None:
+            self.__descriptor_cache.save()  # So that the processes see the entries added so far
+            cache_directory = self.__descriptor_cache.get_directory()
+
+        initargs = (active_method, descriptors, self.__matcher, cache_directory)
+        with ProcessPoolExecutor(max_workers=self.__num_processes, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_process, initargs=initargs) as pool:
+            pending = []
+            next_shard = 0
+            try:
+                while next_shard < len(shards) or len(pending) > 0:
+                    if getattr(thread, "stop", False):
+                        return
+                    # Keep a bounded number of shards waiting to be matched
+                    while next_shard < len(shards) and len(pending) < self.__num_processes * 2:
+                        shard = shards[next_shard]
+                        pending.append((shard, pool.submit(_match_shard, [sources[i] for i in shard])))
+                        next_shard += 1
+                    shard, future = pending.pop(0)
+                    summaries, new_entries = future.result()
+                    if self.__descriptor_cache is not None:
+                        self.__descriptor_cache.add_entries(new_entries)
+                    for i, summary in zip(shard, summaries):
+                        if summary is None:
+                            continue
+                        shape, kp_array, desc, match_indexes, match_distances, thumbnails = summary
+                        matches = [cv2.DMatch(int(q), int(t), float(d))
+                                   for (q, t), d in zip(match_indexes, match_distances)]
+                        yield i, shape, (DescriptorCache.array_to_keypoints(kp_array), desc, matches), thumbnails
+            finally:
+                for shard, future in pending:
+                    future.cancel()
+
+
+# State of each matching process, set when the process starts
+_process = {}
+
+
+def _init_process(active_method, descriptors, matcher, cache_directory):
+    cv2.setNumThreads(1)  # Each process uses a single core
+    # The index is only saved by the main process, which is handed the new entries after each shard
+    descriptor_cache = DescriptorCache(cache_directory, save_every=None) if cache_directory is not None else None
+    # The processes only match without cuda, so they don't set up a cuda context each
+    _process["feature_matcher"] = FeatureMatcher(descriptor_cache=descriptor_cache, matcher=matcher, use_cuda=False)
+    _process["descriptor_cache"] = descriptor_cache
+    _process["file_manager"] = FileManager([], decode_workers=1)
+    _process["active_method"] = active_method
+    _process["descriptors"] = descriptors
+
+
+def _match_shard(sources):
+    """
+    Matches the reference against a shard of images for analysis
+    :param sources: Tuples (path, frame index, stored image) of the images
+    :return: Returns a tuple (summaries, new descriptor cache entries). The summary of each image is a tuple (shape,
+    keypoints array, descriptors, matches indexes, matches distances, thumbnail pyramid), or None if the image couldn't
+    be decoded
+    """
+    file_manager = _process["file_manager"]
+    summaries = []
+    for path, frame_index, img in sources:
+        if img is None:
+            img = file_manager.open_analysis_image(path, frame_index)
+        elif type(img) is str:
+            img = file_manager.open_image_file(img)
+        if img is None:
+            summaries.append(None)
+            continue
+        kp, desc, matches = _process["feature_matcher"].match_result(_process["descriptors"], img,
+                                                                     _process["active_method"], False,
+                                                                     (path, frame_index))
+        match_indexes = np.array([(m.queryIdx, m.trainIdx) for m in matches], dtype="int32").reshape(-1, 2)
+        match_distances = np.array([m.distance for m in matches], dtype="float32")
+        summaries.append((img.shape, DescriptorCache.keypoints_to_array(kp), desc, match_indexes, match_distances,
+                          ThumbnailPyramid(img)))
+
+    new_entries = {"entries": {}, "files": {}, "hits": 0, "misses": 0}
+    if _process["descriptor_cache"] is not None:
+        new_entries = _process["descriptor_cache"].pop_new_entries()
+    return summaries, new_entries
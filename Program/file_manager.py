@@ -1,12 +1,31 @@
 import glob
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 
+from analysis_file import AnalysisFile
+
 class FileManager:
     """
     Manages the opening of reference and analysis files
     """
-    def __init__(self, accepted_formats):
+
+    # Ways of choosing which frames of a video are analysed
+    VIDEO_SAMPLING_ALL = "all"  # Every frame
+    VIDEO_SAMPLING_STRIDE = "stride"  # One frame every n frames
+    VIDEO_SAMPLING_INTERVAL = "interval"  # One frame every n seconds
+    VIDEO_SAMPLING_KEYFRAMES = "keyframes"  # Only the key frames
+
+    def __init__(self, accepted_formats, decode_workers=None, video_sampling=VIDEO_SAMPLING_ALL, video_sampling_step=1):
         self.__formats = accepted_formats
+        self.__video_formats = ["mp4", "mkv"]
+        self.__video_sampling = video_sampling
+        self.__video_sampling_step = video_sampling_step  # Number of frames (stride) or seconds (interval)
+        self.__max_frames_grabbed = 30  # Frames skipped by grabbing instead of seeking when reading a video forward
+        self.__videos = threading.local()  # Last video opened by each thread, so that consecutive frames are read in order
+        self.__decode_workers = decode_workers or os.cpu_count() or 1  # Number of threads used to decode images
+        self.__video_chunk_size = 4  # Consecutive frames of a video decoded by the same thread
 
     def open_reference_file(self, path):
         """
@@ -29,9 +48,10 @@ class FileManager:
 
     def open_analysis_files(self, path):
         """
-        Tries to read the files in the given directory path into opencv images
+        Looks for the files in the given directory path that can be analysed, without decoding them.
+        Images and video frames are only decoded when needed (see open_analysis_image)
         :param path: Path of the directory
-        :return: Returns a tuple (image, path) if successful, else returns None
+        :return: Returns a list of analysis files sorted by path if successful, else returns None
         """
 
         files = []  # List of files found
@@ -39,40 +59,104 @@ class FileManager:
         # For each of the accepted formats, look for files of the same format
         for f in self.__formats:
             file_paths = glob.glob(path + "/*." + f)
-            # For each file found, try reading it into an opencv image
+            # For each file found, check if it can be read
             for p in file_paths:
                 p = p.replace('\\', '/')
-                if f == "mp4" or f == "mkv":
+                if f in self.__video_formats:
                     video = cv2.VideoCapture(p)
-                    while True:
-                        success, frame = video.read()
-                        if not success:
-                            break
-                        files.append((frame, p))
+                    fps = video.get(cv2.CAP_PROP_FPS)
+                    frame_indexes = self.__sample_video_frames(p, video, fps)
+                    video.release()
+                    for i in frame_indexes:
+                        files.append(AnalysisFile(p, i, i / fps if fps > 0 else None))
                 else:
                     try:
-                        img = cv2.imread(p, cv2.IMREAD_COLOR)
+                        readable = cv2.haveImageReader(p)
                     except:
                         continue
-                    if img is None:
+                    if not readable:
                         continue
-                    files.append((img, p))
-
-        """file_paths = glob.glob(path + "/*.*")
-        for file in file_paths:
-            if ".mp4" in file or ".avi" in file or ".mkv" in file:
-                video = cv2.VideoCapture(file)
-                success, image = video.read()
-                while success:
-                    files.append((image, file))
-                    success, image = video.read()"""
+                    files.append(AnalysisFile(p))
 
         # If files were found then return the list, else return None
         if len(files) > 0:
-            return sorted(files, key=lambda r: r[1])
+            return sorted(files, key=lambda r: (r.get_path(), r.get_frame_index() or 0))
         else:
             return None
 
+    def iter_analysis_images(self, files, process=None):
+        """
+        Decodes the given analysis files as they are needed, using the decoding threads
+        :param files: Analysis files to decode
+        :param process: Optional function (image, file) -> value, applied to each image in the decoding threads
+        :return: Yields tuples (image, file), in the same order as the files. The image is None if the file couldn't be
+        decoded. If a process function was given, yields tuples (value, file) instead
+        """
+
+        def decode(file):
+            img = self.open_analysis_image(file.get_path(), file.get_frame_index())
+            if process is not None:
+                return process(img, file)
+            return img
+
+        return self.decode_in_order(files, decode, lambda f: f.get_path() if f.is_video_frame() else None)
+
+    def decode_in_order(self, items, decode, group_key=None):
+        """
+        Decodes items in parallel while keeping their order. Only a few items are decoded ahead of the consumer so that
+        memory use stays bounded. Stops early if the calling thread's stop flag is set
+        :param items: Items to decode
+        :param decode: Function item -> value, called in the decoding threads
+        :param group_key: Optional function item -> key. Consecutive items with the same key (other than None) are
+        decoded in order by the same thread, e.g. frames of the same video
+        :return: Yields tuples (value, item), in the same order as the items
+        """
+
+        thread = threading.currentThread()
+
+        # Split the items into tasks. Consecutive frames of a video go together so that they are read without seeking
+        tasks = []
+        for item in items:
+            key = group_key(item) if group_key is not None else None
+            if key is not None and len(tasks) > 0 and tasks[-1][0] == key and len(tasks[-1][1]) < self.__video_chunk_size:
+                tasks[-1][1].append(item)
+            else:
+                tasks.append((key, [item]))
+
+        def run(task_items):
+            return [(decode(item), item) for item in task_items]
+
+        with ThreadPoolExecutor(max_workers=self.__decode_workers) as pool:
+            pending = []
+            next_task = 0
+            try:
+                while next_task < len(tasks) or len(pending) > 0:
+                    if getattr(thread, "stop", False):
+                        return
+                    # Keep a bounded number of tasks decoding ahead of the consumer
+                    while next_task < len(tasks) and len(pending) < self.__decode_workers * 2:
+                        pending.append(pool.submit(run, tasks[next_task][1]))
+                        next_task += 1
+                    for value in pending.pop(0).result():
+                        yield value
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def open_analysis_image(self, path, frame_index=None):
+        """
+        Tries to read an analysis image or a frame of an analysis video into an opencv image
+        :param path: Path of the image or video
+        :param frame_index: Index of the frame if the path points to a video, None otherwise
+        :return: Returns the image if successful, else returns None
+        """
+        if frame_index is None:
+            try:
+                return cv2.imread(path, cv2.IMREAD_COLOR)
+            except:
+                return None
+        return self.__read_video_frame(path, frame_index)
+
     def open_image_file(self, path):
         try:
             img = cv2.imread(path, cv2.IMREAD_UNCHANGED)  # Try reading into an opencv image
@@ -83,3 +167,100 @@ class FileManager:
     def get_accepted_formats(self):
         """:return: Returns the accepted formats"""
         return self.__formats
+
+    def __sample_video_frames(self, path, video, fps):
+        """
+        Chooses which frames of a video will be analysed, according to the video sampling mode
+        :param path: Path of the video
+        :param video: Opened cv2.VideoCapture
+        :param fps: Frame rate of the video
+        :return: Returns the sorted list of indexes of the chosen frames
+        """
+        if self.__video_sampling == FileManager.VIDEO_SAMPLING_KEYFRAMES:
+            keyframes = self.__list_video_keyframes(path)
+            if keyframes is not None:
+                return keyframes
+            # Key frames can't be told apart with this backend, fall back to one frame per second
+            step = max(int(round(fps)), 1)
+        elif self.__video_sampling == FileManager.VIDEO_SAMPLING_STRIDE:
+            step = max(int(self.__video_sampling_step), 1)
+        elif self.__video_sampling == FileManager.VIDEO_SAMPLING_INTERVAL and fps > 0 and self.__video_sampling_step > 0:
+            num_frames = self.__count_video_frames(video)
+            frame_indexes = []
+            position = 0.0
+            while int(round(position)) < num_frames:
+                if len(frame_indexes) == 0 or frame_indexes[-1] != int(round(position)):
+                    frame_indexes.append(int(round(position)))
+                position += self.__video_sampling_step * fps
+            return frame_indexes
+        else:
+            step = 1
+        return list(range(0, self.__count_video_frames(video), step))
+
+    def __list_video_keyframes(self, path):
+        """
+        Finds the key frames of a video by reading its packets without decoding them
+        :param path: Path of the video
+        :return: Returns the list of indexes of the key frames, or None if they can't be found
+        """
+        if not hasattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME"):
+            return None
+        try:
+            video = cv2.VideoCapture(path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+        except:
+            return None
+        if not video.isOpened():
+            return None
+        keyframes = []
+        i = 0
+        while video.grab():
+            if video.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(i)
+            i += 1
+        video.release()
+        if len(keyframes) == 0:
+            return None
+        return keyframes
+
+    def __count_video_frames(self, video):
+        """
+        Counts the frames of a video. Uses the frame count in the container when available, else grabs every frame
+        :param video: Opened cv2.VideoCapture
+        :return: Returns the number of frames
+        """
+        num_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        if num_frames > 0:
+            return num_frames
+        num_frames = 0
+        while video.grab():
+            num_frames += 1
+        return num_frames
+
+    def __read_video_frame(self, path, frame_index):
+        """
+        Reads a single frame of a video. The video is kept open so that reading the following frames doesn't need a seek
+        :param path: Path of the video
+        :param frame_index: Index of the frame
+        :return: Returns the frame if successful, else returns None
+        """
+        if getattr(self.__videos, "path", None) != path:
+            if getattr(self.__videos, "capture", None) is not None:
+                self.__videos.capture.release()
+            self.__videos.capture = cv2.VideoCapture(path)
+            self.__videos.path = path
+            self.__videos.next_index = 0
+
+        # Grab (without converting) the frames in between if the frame is a little ahead, else seek to it
+        video = self.__videos.capture
+        skip = frame_index - self.__videos.next_index
+        if 0 < skip <= self.__max_frames_grabbed and self.__videos.next_index >= 0:
+            for i in range(skip):
+                video.grab()
+        elif skip != 0:
+            video.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        success, frame = video.read()
+        if not success:
+            self.__videos.next_index = -1  # Position is unknown, seek on the next read
+            return None
+        self.__videos.next_index = frame_index + 1
+        return frame
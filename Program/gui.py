@@ -1,13 +1,19 @@
 import cv2
 import PIL.Image as pil
 import numpy as np
-from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5 import QtCore, QtGui, QtWidgets, sip
 import threading
 import base64
 import random
 
 from PyQt5.QtCore import pyqtSignal, QThread
 
+from compositor import Compositor
+from image_cache import ImageCache
+from qimage_bridge import QImageBridge
+from render_pool import RenderPool
+from result_tile import ResultTile
+
 QtWidgets.QApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling, True)
 
 
@@ -25,6 +31,12 @@ class SSVII_GUI(object):
     DISPLAY_OD_BOUNDING_BOXES = True
     DISPLAY_OD_CLASSES = True
     DISPLAY_OD_MASKS = True
+    # Layers drawn over the results, in the order they are drawn: (ResultsManager getter, display mode that shows it)
+    FM_LAYERS = (("get_img_fm_matches", "DISPLAY_FM_MATCHES"), ("get_img_fm_keypoints", "DISPLAY_FM_KEYPOINTS"),
+                 ("get_img_fm_circle_prediction", "DISPLAY_FM_CIRCLE_PREDICTION"),
+                 ("get_img_fm_bounding_box", "DISPLAY_FM_BOUNDING_BOX"))
+    OD_LAYERS = (("get_img_od_masks", "DISPLAY_OD_MASKS"), ("get_img_od_bounding_boxes", "DISPLAY_OD_BOUNDING_BOXES"),
+                 ("get_img_od_class_labels", "DISPLAY_OD_CLASSES"))
 
     # These hold the two possible result display layouts (single result - normal ; all results - advanced)
     RESULTS_MODE_SINGLE = 0
@@ -53,6 +65,23 @@ class SSVII_GUI(object):
     MAIN_WINDOW_WIDTH = 941 #925
     MAIN_WINDOW_HEIGHT = 810 #750
 
+    # Tiles within this fraction of the view's size around it (only above/below it in the grids) are loaded before they
+    # come into view
+    TILE_PREFETCH_MARGIN = 0.5
+    # Tiles further than this many times the view's size from it (only above/below it in the grids) go back to being
+    # placeholders
+    TILE_KEEP_MARGIN = 3
+    # Threads drawing the images of the results views, and seconds spent showing the images they drew before letting the
+    # GUI handle other events
+    RENDER_THREADS = 2
+    RENDER_FRAME_BUDGET = 0.03
+    # Only this many of the most relevant results grow along the spiral, the rest are shown at the starting size
+    SPIRAL_GROWING_TILES = 85
+    # Resolution, relative to their size, of the placeholders of the tiles of the pile and spiral, which can be large
+    FREE_TILE_PLACEHOLDER_DETAIL = 1 / 16
+    # Bytes of tooltips (with their images) of the results kept to be shown again
+    TOOLTIP_CACHE_BYTES = 16 * 1024 ** 2
+
     RESULT_MODES_AVAILABLE = ("Single", "Grid 1", "Grid 2", "Pile", "Spiral")
     SORT_MODES_AVAILABLE = {"Feature Matching": ["Relevance", "Kps/Des", "Matches", "Filename"], "Object Detection": ["Avg. Confidence", "Detections", "Filename"]}
     # endregion
@@ -69,6 +98,12 @@ class SSVII_GUI(object):
         self.current_results_mode = SSVII_GUI.RESULTS_MODE_SINGLE  # Current layout mode
         self.current_method_mode = SSVII_GUI.FEATURE_MATCHING_MODE
         self.current_graphics_view_scale_step = 0
+        self.loaded_tiles = set()  # Tiles of the grids whose images are loaded
+        self.tooltip_cache = ImageCache(SSVII_GUI.TOOLTIP_CACHE_BYTES)  # Tooltips built when the tiles were hovered
+        self.compositor = Compositor()  # Draws the overlays of the results over their images
+        # Draws the images of the results views in the background
+        self.render_pool = RenderPool(SSVII_GUI.RENDER_THREADS, SSVII_GUI.RENDER_FRAME_BUDGET)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.render_pool.close)
         #self.current_sort_mode = SSVII_GUI.SORT_MODE_RELEVANCE
         self.main_window = None  # Main window reference
 
@@ -264,6 +299,15 @@ class SSVII_GUI(object):
         self.checkbox_disk.setToolTip("Use the disk to store processing data. Results in slower overall\nprocessing speed and interface responsiveness, but makes it\npossible to process larger quantities of images or even video,\ndepending on available disk space.")
         self.checkbox_disk.setStyleSheet("QToolTip { background-color: rgb(40, 40, 40); color: #cccccc; border: black solid 1px }")
         self.checkbox_disk.stateChanged.connect(self.on_checkbox_disk_changed)
+        self.label_disk_migration = QtWidgets.QLabel(self.groupbox_file_selection)
+        self.label_disk_migration.setGeometry(QtCore.QRect(230, 185, 50, 16))
+        font = QtGui.QFont()
+        font.setPointSize(8)
+        font.setItalic(True)
+        self.label_disk_migration.setFont(font)
+        self.label_disk_migration.setObjectName("label_disk_migration")
+        self.label_disk_migration.setToolTip("Images and results still being moved to the new storage")
+        self.label_disk_migration.setStyleSheet("QLabel {color: #cccccc; background-color: transparent} QToolTip { background-color: rgb(40, 40, 40); color: #cccccc; border: black solid 1px }")
         # endregion
 
         # region Feature Matching Reference and Region Selection
@@ -386,6 +430,7 @@ class SSVII_GUI(object):
                                                                  QScrollBar::add-page:vertical, QScrollBar::sub-page:vertical { background: none; }
                                                                  """)
         self.graphics_view_fm.setVerticalScrollBar(self.scroll_bar_graphics_view_fm)
+        self.scroll_bar_graphics_view_fm.valueChanged.connect(lambda value: self.load_visible_tiles(self.graphics_view_fm))
         """self.graphics_view_fm_grid_2_scene = QtWidgets.QGraphicsScene()
         self.graphics_view_fm_grid_2 = QtWidgets.QGraphicsView(self.graphics_view_fm_grid_2_scene,
                                                                self.groupbox_fm_advanced_results)
@@ -1007,6 +1052,7 @@ class SSVII_GUI(object):
                                                          QScrollBar::add-page:vertical, QScrollBar::sub-page:vertical { background: none; }
                                                          """)
         self.graphics_view_od.setVerticalScrollBar(self.scroll_bar_graphics_view_od)
+        self.scroll_bar_graphics_view_od.valueChanged.connect(lambda value: self.load_visible_tiles(self.graphics_view_od))
         """self.graphics_view_od_grid_2_scene = QtWidgets.QGraphicsScene()
         self.graphics_view_od_grid_2 = QtWidgets.QGraphicsView(self.graphics_view_od_grid_2_scene, self.groupbox_od_advanced_results)
         self.graphics_view_od_grid_2.setGeometry(0, 0, 897, 481)
@@ -1113,22 +1159,16 @@ class SSVII_GUI(object):
         Updates the reference image and relevant information displayed
         """
 
-        # Get the reference original image in RGB
+        # Get the reference original image
         reference = self.ref_manager.get_reference()
-        ref_img_original = cv2.cvtColor(reference.get_img_original(), cv2.COLOR_BGR2RGB)
+        ref_img_original = reference.get_img_original()
         img = self.resize_img(ref_img_original, self.label_reference_img.width(), self.label_reference_img.height())
 
-        # Create QImage from cv2 reference img
-        qimg = QtGui.QImage(img.data,
-                            img.shape[1],
-                            img.shape[0],
-                            QtGui.QImage.Format_RGB888)
-
-        # Create pixmap from QImage and scale it to fit the QLabel while keeping the aspect ratio
-        pixmap = QtGui.QPixmap.fromImage(qimg).scaled(self.label_reference_img.width(),
-                                                      self.label_reference_img.height(),
-                                                      QtCore.Qt.KeepAspectRatio,
-                                                      QtCore.Qt.SmoothTransformation)
+        # Create pixmap from the cv2 reference img and scale it to fit the QLabel while keeping the aspect ratio
+        pixmap = QImageBridge.to_pixmap(img).scaled(self.label_reference_img.width(),
+                                                    self.label_reference_img.height(),
+                                                    QtCore.Qt.KeepAspectRatio,
+                                                    QtCore.Qt.SmoothTransformation)
 
         # Update image QLabel
         self.label_reference_img.setPixmap(pixmap)
@@ -1142,7 +1182,6 @@ class SSVII_GUI(object):
             img_height = int(img_width / ratio)
 
         resized = self.resize_img(ref_img_original, img_width, img_height)
-        resized = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
 
         import base64
         path = reference.get_path()
@@ -1171,31 +1210,29 @@ class SSVII_GUI(object):
         result = self.res_manager.get_result_at_index(self.current_result_index)
         label = None
 
-        # Update image QLabel
-        # Get the result image that corresponds to the current mode
-        img = self.get_result_img(result)
-        if img is None:
-            return
-
         # Get the label to update
         if self.current_method_mode == SSVII_GUI.FEATURE_MATCHING_MODE:
             label = self.label_result_img
         elif self.current_method_mode == SSVII_GUI.OBJECT_DETECTION_MODE:
             label = self.label_od_result_img
 
-        # If we have an image then we can display it
-        img = cv2.cvtColor(img, cv2.COLOR_BGRA2RGB)  # QLabel works with RGB
-        img = self.resize_img(img, label.width(), label.height())
+        # Update image QLabel when the result image that corresponds to the current mode is drawn. The layers are
+        # chosen now, and the image is dropped if they changed meanwhile (the result is updated again then)
+        visible = self.get_visible_layers()
 
-        image = QtGui.QImage(img, img.shape[1], img.shape[0], img.shape[1] * 3, QtGui.QImage.Format_RGB888)
-        label.setPixmap(QtGui.QPixmap(image))
+        def show(qimg):
+            if qimg is not None and visible == self.get_visible_layers():
+                label.setPixmap(QtGui.QPixmap.fromImage(qimg))
+        width, height = label.width(), label.height()
+        self.render_pool.submit(label, label, lambda: self.render_result_image(result, width, height, 30, visible),
+                                show)
 
         # Update the other GUI elements
         if self.current_method_mode == SSVII_GUI.FEATURE_MATCHING_MODE:
             self.label_result_relevance.setText("{0}%".format(round(self.res_manager.get_relevance(result), 2)))
-            self.label_result_num_keypoints.setText(str(len(self.res_manager.get_keypoints(result))))
-            self.label_result_num_descriptors.setText(str(len(self.res_manager.get_descriptors(result))))
-            self.label_result_num_matches.setText(str(len(self.res_manager.get_matches(result))))
+            self.label_result_num_keypoints.setText(str(self.res_manager.get_num_keypoints(result)))
+            self.label_result_num_descriptors.setText(str(self.res_manager.get_num_descriptors(result)))
+            self.label_result_num_matches.setText(str(self.res_manager.get_num_matches(result)))
             self.label_result_filename.setText(self.res_manager.get_original_path(result))
             self.label_result_filename.setToolTip(self.res_manager.get_original_path(result))
         elif self.current_method_mode == SSVII_GUI.OBJECT_DETECTION_MODE and self.current_results_mode == SSVII_GUI.RESULTS_MODE_SINGLE:
@@ -1205,6 +1242,267 @@ class SSVII_GUI(object):
             self.label_od_filename.setText(str(self.res_manager.get_original_path(result)))
             self.label_od_filename.setToolTip(self.res_manager.get_original_path(result))
 
+    def load_visible_tiles(self, graphics_view):
+        """
+        Requests the images of the tiles of a results view that are in view, or close to it, and aren't loaded. In the
+        pile and spiral, the images are drawn at the resolution the view shows them at (see get_tile_detail), and drawn
+        again when it changes (e.g. when zooming in)
+        :param graphics_view: Results view
+        """
+        scene = graphics_view.scene()
+        if scene is None:
+            return  # The view is being deleted, e.g. while the window is being closed
+        free = self.current_results_mode == SSVII_GUI.RESULTS_MODE_PILE or \
+            self.current_results_mode == SSVII_GUI.RESULTS_MODE_SPIRAL
+        detail = self.get_tile_detail(graphics_view) if free else 1.0
+        # The grids only scroll vertically, the pile and spiral can be moved around
+        visible = graphics_view.mapToScene(graphics_view.viewport().rect()).boundingRect()
+        margin_x = visible.width() * SSVII_GUI.TILE_PREFETCH_MARGIN if free else 0
+        margin_y = visible.height() * SSVII_GUI.TILE_PREFETCH_MARGIN
+        nearby = visible.adjusted(-margin_x, -margin_y, margin_x, margin_y)
+
+        # Release the images of the tiles that are far out of view
+        margin_x = visible.width() * SSVII_GUI.TILE_KEEP_MARGIN if free else 0
+        margin_y = visible.height() * SSVII_GUI.TILE_KEEP_MARGIN
+        kept = visible.adjusted(-margin_x, -margin_y, margin_x, margin_y)
+        for item in list(self.loaded_tiles):
+            if sip.isdeleted(item):
+                # Deleted with their scene, e.g. while the window is being closed
+                self.loaded_tiles.discard(item)
+            elif item.scene() is scene and not item.sceneBoundingRect().intersects(kept):
+                self.render_pool.cancel(scene, item)  # Not drawn if it is still waiting
+                item.unload()
+                self.loaded_tiles.discard(item)
+
+        # The tiles in view are loaded first. The scene's index finds them without going through every tile
+        in_view = []
+        close = []
+        for item in scene.items(nearby):
+            if not isinstance(item, ResultTile):
+                continue
+            if item.get_state() == ResultTile.STATE_PLACEHOLDER or (free and item.get_detail() != detail):
+                (in_view if item.sceneBoundingRect().intersects(visible) else close).append(item)
+        in_view.sort(key=lambda item: (item.y(), item.x()))
+        close.sort(key=lambda item: (item.y(), item.x()))
+        # The newest requests are drawn first
+        for item in reversed(in_view + close):
+            if free:
+                self.request_result_image(item, self.get_free_tile_fill(), detail)
+            else:
+                self.request_tile(item)
+
+    def get_free_tile_fill(self):
+        """:return: Returns how the images of the tiles of the pile and spiral are fitted in them (see resize_img)"""
+        return -1 if self.current_results_mode == SSVII_GUI.RESULTS_MODE_PILE else 30
+
+    def get_tile_detail(self, graphics_view):
+        """
+        :param graphics_view: Results view
+        :return: Returns the resolution, relative to their size, the tiles of a view are drawn at: the power of two
+        closest to the view's scale that isn't lower than it, up to 1 (e.g. 0.25 while a zoomed out spiral shows its
+        tiles at 0.2 of their size)
+        """
+        scale = graphics_view.transform().m11()
+        if scale >= 1:
+            return 1.0
+        return 2.0 ** np.ceil(np.log2(scale))
+
+    def discard_tiles(self, scene):
+        """
+        Forgets the tiles of a scene that are loaded or waiting to be drawn (e.g. before they are deleted)
+        :param scene: Scene of a results view
+        """
+        self.render_pool.cancel(scene)
+        self.loaded_tiles = set(item for item in self.loaded_tiles if item.scene() is not scene)
+
+    def request_tile(self, item):
+        """
+        Requests the image of a tile's result to the render pool, which is loaded into the tile when it is drawn. Only
+        the visible layers, and the ones the tile already has, are drawn, the rest are drawn when they are shown
+        :param item: Tile
+        """
+        item.set_queued()
+        result = self.res_manager.get_result_by_id(item.get_result_id())
+        width, height = item.get_size()
+        drawn = set(self.get_visible_layers()) | item.get_drawn_layers()
+        layers = [(name, display) for name, display in self.get_layers() if name in drawn]
+        self.render_pool.submit(item.scene(), item, lambda: self.render_tile(result, width, height, layers),
+                                lambda stacks: self.show_tile(item, stacks, drawn))
+
+    def show_tile(self, item, stacks, drawn):
+        """
+        Loads the image of a result into its tile, as a stack with the layers drawn, so that changing the display mode
+        only shows/hides them
+        :param item: Tile
+        :param stacks: Stacks drawn by render_tile
+        :param drawn: Names of the layers drawn
+        """
+        if sip.isdeleted(item) or item.get_state() != ResultTile.STATE_QUEUED:
+            return
+        self.loaded_tiles.add(item)
+        if stacks is None:
+            item.set_image(ResultTile.get_placeholder(*item.get_size()))
+            return
+        stacks = [(QtGui.QPixmap.fromImage(base),
+                   [(name, QtGui.QPixmap.fromImage(layer), position) for name, layer, position in layers])
+                  for base, layers in stacks]
+        item.set_layers(stacks, self.get_visible_layers(), drawn)
+        # Layers shown while the tile was being drawn are drawn now
+        if not set(self.get_visible_layers()) <= drawn:
+            self.request_tile(item)
+
+    def render_tile(self, result, label_w, label_h, layers):
+        """
+        Draws the image of a result's tile and each of its layers. Called by the render pool, in the background
+        :param result: Result
+        :param label_w: Width of the tile
+        :param label_h: Height of the tile
+        :param layers: Layers to draw (see FM_LAYERS and OD_LAYERS)
+        :return: Returns the stacks of the tile (see ResultTile.set_layers), with QImages instead of pixmaps, or None if
+        the image of the result can't be decoded
+        """
+        size = self.get_result_size(result)
+        if size is None:
+            return None
+
+        layers = [(name, getattr(self.res_manager, name)(result)) for name, display in layers]
+        layers = [(name, overlay) for name, overlay in layers if overlay is not None and not overlay.is_empty()]
+        # The original image is smaller while a layer larger than it is shown
+        arrangements = [[(name, overlay) for name, overlay in layers if overlay.get_size() == size]]
+        if len(arrangements[0]) < len(layers):
+            arrangements.append(layers)
+
+        stacks = []
+        for arrangement in arrangements:
+            canvas_w = max([size[0]] + [overlay.get_size()[0] for name, overlay in arrangement])
+            canvas_h = max([size[1]] + [overlay.get_size()[1] for name, overlay in arrangement])
+            scale = min(label_w / canvas_w, label_h / canvas_h)
+            # Everything is at the top right corner of the canvas, which is centered in the tile
+            right = int((label_w + canvas_w * scale) / 2)
+            top = int((label_h - canvas_h * scale) / 2)
+
+            img = self.get_scaled_original(result, scale)
+            if img is None:
+                return None
+            base = np.full((label_h, label_w, 3), ResultTile.PLACEHOLDER_COLOR[::-1], dtype="uint8")
+            x = max(right - img.shape[1], 0)
+            h = min(img.shape[0], label_h - top)
+            base[top:top + h, x:right] = img[:h, img.shape[1] - (right - x):]
+            base = QImageBridge.to_qimage(base)
+
+            images = []
+            for name, overlay in arrangement:
+                layer = overlay.render(scale)
+                images.append((name, QImageBridge.to_qimage(layer), (right - layer.shape[1], top)))
+            stacks.append((base, images))
+        return stacks
+
+    def request_result_image(self, item, fill=30, detail=1.0, recenter=False):
+        """
+        Requests the image of a tile's result, with the current display modes, to the render pool. It replaces the
+        tile's image when it is drawn, unless the tile was unloaded meanwhile
+        :param item: Tile of the pile or spiral
+        :param fill: See resize_img
+        :param detail: Resolution of the image relative to the tile's size (see get_tile_detail)
+        :param recenter: True to keep the center of the tile's image instead of its top left corner (e.g. after resizing
+        the tile)
+        """
+        item.set_queued(detail)
+        self.loaded_tiles.add(item)
+        result = self.res_manager.get_result_by_id(item.get_result_id())
+        width, height = [max(int(size * detail), 1) for size in item.get_size()]
+        # The display modes are the ones of when the image is requested, not of when it is drawn
+        visible = self.get_visible_layers()
+        self.render_pool.submit(item.scene(), item,
+                                lambda: self.render_result_image(result, width, height, fill, visible),
+                                lambda qimg: self.show_result_image(item, qimg, detail, recenter, fill, visible))
+
+    def render_result_image(self, result, width, height, fill=30, visible=None):
+        """
+        Draws the image of a result. Called by the render pool, in the background
+        :param visible: Names of the layers to draw. If None, the ones of the current display modes
+        :return: Returns the QImage, or None if the image of the result can't be decoded
+        """
+        img = self.get_result_img(result, width, height, visible)
+        if img is None:
+            return None
+        return QImageBridge.to_qimage(self.resize_img(img, width, height, fill))
+
+    def show_result_image(self, item, qimg, detail=1.0, recenter=False, fill=30, visible=None):
+        """
+        Replaces the image of a tile. If the display modes changed since it was requested, it is requested again instead
+        :param item: Tile
+        :param qimg: Image drawn by render_result_image
+        :param detail: See request_result_image
+        :param recenter: See request_result_image
+        :param fill: See request_result_image
+        :param visible: Names of the layers drawn
+        """
+        if sip.isdeleted(item) or item.get_state() == ResultTile.STATE_PLACEHOLDER:
+            return
+        if visible != self.get_visible_layers() or fill != self.get_free_tile_fill():
+            self.request_result_image(item, self.get_free_tile_fill(), detail, recenter)
+            return
+        if qimg is None:
+            return
+        pixmap = QtGui.QPixmap.fromImage(qimg)
+        if recenter:
+            shown = item.sceneBoundingRect()
+            offset_x = pixmap.width() / detail - shown.width()
+            offset_y = pixmap.height() / detail - shown.height()
+            item.setPos(item.x() - offset_x / 2, item.y() - offset_y / 2)
+        item.set_image(pixmap, detail)
+
+    def get_layers(self):
+        """:return: Returns the layers of the results of the current method mode (see FM_LAYERS and OD_LAYERS)"""
+        if self.current_method_mode == SSVII_GUI.FEATURE_MATCHING_MODE:
+            return SSVII_GUI.FM_LAYERS
+        return SSVII_GUI.OD_LAYERS
+
+    def get_visible_layers(self):
+        """:return: Returns the names of the layers shown by the current display modes"""
+        return [name for name, display in self.get_layers() if getattr(SSVII_GUI, display)]
+
+    def get_result_tooltip(self, result_id):
+        """
+        Builds the tooltip of a result's tile (its information and a larger image of it). Called when the tile is
+        hovered, and kept in a cache so that hovering the same tile again doesn't build it again
+        :param result_id: Id of the result
+        :return: Returns the tooltip, in HTML
+        """
+        # The image of the tooltip depends on what is displayed
+        key = ("tooltip", result_id, self.current_method_mode, SSVII_GUI.DISPLAY_FM_BOUNDING_BOX,
+               SSVII_GUI.DISPLAY_FM_CIRCLE_PREDICTION, SSVII_GUI.DISPLAY_FM_KEYPOINTS, SSVII_GUI.DISPLAY_FM_MATCHES,
+               SSVII_GUI.DISPLAY_OD_BOUNDING_BOXES, SSVII_GUI.DISPLAY_OD_CLASSES, SSVII_GUI.DISPLAY_OD_MASKS)
+        tooltip = self.tooltip_cache.get(key)
+        if tooltip is not None:
+            return tooltip
+        result = self.res_manager.get_result_by_id(result_id)
+        if result is None:
+            return ""
+
+        img = self.get_result_img(result, int(SSVII_GUI.MAIN_WINDOW_WIDTH * 0.5), int(SSVII_GUI.MAIN_WINDOW_HEIGHT * 0.5))
+        img_tag = ""
+        if img is not None:
+            _, im_arr = cv2.imencode(".jpg", img)
+            img_tag = '<img src="data:image/jpeg;base64,{0}"></>'.format(base64.b64encode(im_arr.tobytes()).decode())
+
+        tooltip = ""
+        if self.current_method_mode == SSVII_GUI.FEATURE_MATCHING_MODE:
+            tooltip = str(
+                '<h3 style="color: #cccccc">Relevance: {0}%</><h3 style="color: #cccccc">Keypoints/Descriptors: {1}</><h3 style="color: #cccccc">Matches: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(
+                round(self.res_manager.get_relevance(result), 2), self.res_manager.get_num_keypoints(result),
+                self.res_manager.get_num_matches(result), self.res_manager.get_original_path(result), img_tag)
+        elif self.current_method_mode == SSVII_GUI.OBJECT_DETECTION_MODE:
+            tooltip = str(
+                '<h3 style="color: #cccccc">Avg. Confidence: {0}%</><h3 style="color: #cccccc">Number of Classes: {1}</><h3 style="color: #cccccc">Number of Detections: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(
+                round(self.res_manager.get_avg_confidence(result), 2),
+                self.res_manager.get_num_classes(result),
+                self.res_manager.get_num_detections(result), self.res_manager.get_original_path(result),
+                img_tag)
+        self.tooltip_cache.put(key, tooltip, len(tooltip))
+        return tooltip
+
     def animate_results(self):
         if SSVII_GUI.ANIMATE_RESULTS_MODE:
             self.on_button_next_result()
@@ -1240,63 +1538,31 @@ class SSVII_GUI(object):
         if len(results) == 0:
             return
 
-        if not rebuild:
-            if self.current_results_mode == SSVII_GUI.RESULTS_MODE_PILE or self.current_results_mode == SSVII_GUI.RESULTS_MODE_SPIRAL:
-                results.reverse()
-            for i in range(len(scene.items())):
-                item = scene.items()[len(scene.items()) - 1 - i]
-
-                if item.data(0) is not None:
-                    #item.setData(0, self.res_manager.get_id(result))
-                    result = self.res_manager.get_result_by_id(item.data(0))
-                else:
-                    result = results[i]
-
-                img = self.get_result_img(result)
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-                # Update pixmap
-                label_w = item.pixmap().width()
-                label_h = item.pixmap().height()
-                resized_img = self.resize_img(img, label_w, label_h)
-                qimg = QtGui.QImage(resized_img, resized_img.shape[1], resized_img.shape[0], resized_img.shape[1] * 3,
-                                    QtGui.QImage.Format_RGB888)
-                pixmap = QtGui.QPixmap.fromImage(qimg)
-                item.setPixmap(pixmap)
-
-                # Update tooltip
-                img_width = int(SSVII_GUI.MAIN_WINDOW_WIDTH * 0.5)
-                img_height = int(SSVII_GUI.MAIN_WINDOW_HEIGHT * 0.5)
-                ratio = img.shape[1] / img.shape[0]
-
-                if int(img_width / ratio) < img_height:
-                    img_height = int(img_width / ratio)
-
-                resized_img = self.resize_img(img, img_width, img_height)
-                resized_img = cv2.cvtColor(resized_img, cv2.COLOR_BGR2RGB)
-                path = result.get_original_path()
-                file_format = path.split('.')[-1]
-                _, im_arr = cv2.imencode("." + file_format, resized_img)  # im_arr: image in Numpy one-dim array format.
-                b64 = str(base64.b64encode(im_arr.tobytes()))[2:]
-                img_tag = '<img src="data:image/{1};base64,{2}"></>'.format(path, file_format, b64)
+        if not rebuild and (self.current_results_mode == SSVII_GUI.RESULTS_MODE_GRID_1 or
+                            self.current_results_mode == SSVII_GUI.RESULTS_MODE_GRID_2):
+            # Only which layers the loaded tiles show changes, and the ones they don't have are drawn (the old ones are
+            # shown until then). The rest are loaded with the new display modes
+            visible = self.get_visible_layers()
+            for item in list(self.loaded_tiles):
+                if item.scene() is scene:
+                    item.show_layers(visible)
+                    if not set(visible) <= item.get_drawn_layers() and item.get_state() == ResultTile.STATE_LOADED:
+                        self.request_tile(item)
+            return
 
-                if self.current_method_mode == SSVII_GUI.FEATURE_MATCHING_MODE:
-                    item.setToolTip(str(
-                        '<h3 style="color: #cccccc">Relevance: {0}%</><h3 style="color: #cccccc">Keypoints/Descriptors: {1}</><h3 style="color: #cccccc">Matches: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(
-                        round(self.res_manager.get_relevance(result), 2), len(self.res_manager.get_keypoints(result)),
-                        len(self.res_manager.get_matches(result)), self.res_manager.get_original_path(result), img_tag))
-                elif self.current_method_mode == SSVII_GUI.OBJECT_DETECTION_MODE:
-                    item.setToolTip(str(
-                        '<h3 style="color: #cccccc">Avg. Confidence: {0}%</><h3 style="color: #cccccc">Number of Classes: {1}</><h3 style="color: #cccccc">Number of Detections: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(
-                        round(self.res_manager.get_avg_confidence(result), 2),
-                        self.res_manager.get_num_classes(result),
-                        self.res_manager.get_num_detections(result), self.res_manager.get_original_path(result),
-                        img_tag))
+        if not rebuild:
+            # The images are drawn again with the new display modes, the old ones are shown until then. The placeholders
+            # are loaded with the new display modes when they come into view
+            self.render_pool.cancel(scene)
+            for item in list(self.loaded_tiles):
+                if item.scene() is scene:
+                    self.request_result_image(item, self.get_free_tile_fill(), item.get_detail())
             return
 
         # Get the current results to display them in the grid
         row = 0
         column = 0
+        self.discard_tiles(scene)  # The tiles are deleted with the scene's items
         scene.clear()
         graphics_view.resetTransform()
 
@@ -1309,11 +1575,14 @@ class SSVII_GUI(object):
             # Get the old position
             old_pos = graphics_view.mapToScene(event.pos())
 
-            # Scale
+            # Scale. It can be zoomed out until the whole spiral is in view
+            scene_rect = scene.sceneRect()
+            zoomed_out = graphics_view.transform().m11() * max(scene_rect.width() / graphics_view.width(),
+                                                                scene_rect.height() / graphics_view.height()) <= 1
             if event.angleDelta().y() > 0 and self.current_graphics_view_scale_step < 6:
                 scale_factor = 1.1
                 self.current_graphics_view_scale_step += 1
-            elif event.angleDelta().y() <= 0 and self.current_graphics_view_scale_step > -46:
+            elif event.angleDelta().y() <= 0 and not zoomed_out:
                 scale_factor = 1/1.1
                 self.current_graphics_view_scale_step -= 1
             else:
@@ -1329,55 +1598,21 @@ class SSVII_GUI(object):
             graphics_view.translate(delta.x(), delta.y())
             event.accept()
 
+            # The tiles are drawn again at the new resolution
+            self.load_visible_tiles(graphics_view)
+
         graphics_view.wheelEvent = wheel_moved
         graphics_view.verticalScrollBar().setSliderPosition(1)
         self.current_graphics_view_scale_step = 0
 
         if self.current_results_mode == SSVII_GUI.RESULTS_MODE_GRID_1:
+            # The tiles start as placeholders, their images are loaded as they come into view
             margin = 5
             label_w = int((graphics_view.width() - (margin * (num_columns + 1))) / num_columns)
             label_h = int(label_w * 0.77)
             for result in results:
-                img = self.get_result_img(result)
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-                # Update pixmap
-                resized_img = self.resize_img(img, label_w, label_h)
-                qimg = QtGui.QImage(resized_img, resized_img.shape[1], resized_img.shape[0], resized_img.shape[1] * 3,
-                                    QtGui.QImage.Format_RGB888)
-                pixmap = QtGui.QPixmap.fromImage(qimg)
-                item = QtWidgets.QGraphicsPixmapItem()
+                item = ResultTile(self.res_manager.get_id(result), label_w, label_h, self.get_result_tooltip)
                 item.setPos(QtCore.QPointF(column * label_w + column * margin + margin, row * label_h + row * margin + margin))
-                item.setPixmap(pixmap)
-
-                # Update tooltip
-                img_width = int(SSVII_GUI.MAIN_WINDOW_WIDTH * 0.5)
-                img_height = int(SSVII_GUI.MAIN_WINDOW_HEIGHT * 0.5)
-                ratio = img.shape[1] / img.shape[0]
-
-                if int(img_width / ratio) < img_height:
-                    img_height = int(img_width / ratio)
-
-                resized_img = self.resize_img(img, img_width, img_height)
-                resized_img = cv2.cvtColor(resized_img, cv2.COLOR_BGR2RGB)
-                path = result.get_original_path()
-                file_format = path.split('.')[-1]
-                _, im_arr = cv2.imencode("." + file_format, resized_img)  # im_arr: image in Numpy one-dim array format.
-                b64 = str(base64.b64encode(im_arr.tobytes()))[2:]
-                img_tag = '<img src="data:image/{1};base64,{2}"></>'.format(path, file_format, b64)
-
-                if self.current_method_mode == SSVII_GUI.FEATURE_MATCHING_MODE:
-                    item.setToolTip(str(
-                        '<h3 style="color: #cccccc">Relevance: {0}%</><h3 style="color: #cccccc">Keypoints/Descriptors: {1}</><h3 style="color: #cccccc">Matches: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(
-                        round(self.res_manager.get_relevance(result), 2), len(self.res_manager.get_keypoints(result)),
-                        len(self.res_manager.get_matches(result)), self.res_manager.get_original_path(result), img_tag))
-                elif self.current_method_mode == SSVII_GUI.OBJECT_DETECTION_MODE:
-                    item.setToolTip(str(
-                        '<h3 style="color: #cccccc">Avg. Confidence: {0}%</><h3 style="color: #cccccc">Number of Classes: {1}</><h3 style="color: #cccccc">Number of Detections: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(
-                        round(self.res_manager.get_avg_confidence(result), 2),
-                        self.res_manager.get_num_classes(result),
-                        self.res_manager.get_num_detections(result), self.res_manager.get_original_path(result),
-                        img_tag))
 
                 # Add item
                 scene.addItem(item)
@@ -1389,6 +1624,7 @@ class SSVII_GUI(object):
                 else:
                     column += 1
             scene.setSceneRect(scene.itemsBoundingRect())
+            self.load_visible_tiles(graphics_view)
         elif self.current_results_mode == SSVII_GUI.RESULTS_MODE_GRID_2:
             num_columns = 2
             margin = 5
@@ -1396,42 +1632,8 @@ class SSVII_GUI(object):
             label_h = label_w
             yoffset = 0
             for result in results:
-                img = self.get_result_img(result)
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-                # Update pixmap
-                resized_img = self.resize_img(img, label_w, label_h)
-                qimg = QtGui.QImage(resized_img, resized_img.shape[1], resized_img.shape[0], resized_img.shape[1] * 3, QtGui.QImage.Format_RGB888)
-                pixmap = QtGui.QPixmap.fromImage(qimg)
-                item = QtWidgets.QGraphicsPixmapItem()
+                item = ResultTile(self.res_manager.get_id(result), label_w, label_h, self.get_result_tooltip)
                 item.setPos(QtCore.QPointF(column * label_w + column * margin + margin, yoffset + row * margin + margin))
-                item.setPixmap(pixmap)
-
-                # Update tooltip
-                img_width = int(SSVII_GUI.MAIN_WINDOW_WIDTH * 0.5)
-                img_height = int(SSVII_GUI.MAIN_WINDOW_HEIGHT * 0.5)
-                ratio = img.shape[1] / img.shape[0]
-
-                if int(img_width / ratio) < img_height:
-                    img_height = int(img_width / ratio)
-
-                resized_img = self.resize_img(img, img_width, img_height)
-                resized_img = cv2.cvtColor(resized_img, cv2.COLOR_BGR2RGB)
-                path = result.get_original_path()
-                file_format = path.split('.')[-1]
-                _, im_arr = cv2.imencode("." + file_format, resized_img)  # im_arr: image in Numpy one-dim array format.
-                b64 = str(base64.b64encode(im_arr.tobytes()))[2:]
-                img_tag = '<img src="data:image/{1};base64,{2}"></>'.format(path, file_format, b64)
-
-                if self.current_method_mode == SSVII_GUI.FEATURE_MATCHING_MODE:
-                    item.setToolTip(str('<h3 style="color: #cccccc">Relevance: {0}%</><h3 style="color: #cccccc">Keypoints/Descriptors: {1}</><h3 style="color: #cccccc">Matches: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(round(self.res_manager.get_relevance(result), 2), len(self.res_manager.get_keypoints(result)), len(self.res_manager.get_matches(result)), self.res_manager.get_original_path(result), img_tag))
-                elif self.current_method_mode == SSVII_GUI.OBJECT_DETECTION_MODE:
-                    item.setToolTip(str(
-                        '<h3 style="color: #cccccc">Avg. Confidence: {0}%</><h3 style="color: #cccccc">Number of Classes: {1}</><h3 style="color: #cccccc">Number of Detections: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(
-                        round(self.res_manager.get_avg_confidence(result), 2),
-                        self.res_manager.get_num_classes(result),
-                        self.res_manager.get_num_detections(result), self.res_manager.get_original_path(result),
-                        img_tag))
 
                 # Add item
                 scene.addItem(item)
@@ -1448,171 +1650,96 @@ class SSVII_GUI(object):
                 else:
                     column += 1
             scene.setSceneRect(scene.itemsBoundingRect())
+            self.load_visible_tiles(graphics_view)
         elif self.current_results_mode == SSVII_GUI.RESULTS_MODE_PILE:
-            for result in reversed(results):
-                img = self.get_result_img(result)
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
+            top_z = 0  # The pressed tile goes on top of the others without going through all of them
+
+            def mouse_pressed(event):
+                nonlocal top_z
+                item_pressed = scene.itemAt(event.scenePos(), graphics_view.transform())
+                top_z += 1
+                item_pressed.setZValue(top_z)
+                scene.update()
+
+            def wheel_moved(event):
+                item_under = scene.itemAt(event.scenePos(), graphics_view.transform())
+                if item_under is None:
+                    return
+                scale = item_under.data(1)
+                delta = event.delta()
+                delta = round(np.interp(delta, [-360, 360], [-1, 1]), 2)
+                if (delta < 0 and scale + delta <= 0.3) or (delta > 0 and scale + delta) >= 10:
+                    return
+                scale += delta
+                item_under.setData(1, scale)
                 # Update pixmap
+                width = int(graphics_view.width() / 4 * scale)
+                height = int(width * 0.77)
+                item_under.set_size(width, height)
+                self.request_result_image(item_under, -1, self.get_tile_detail(graphics_view), True)
+
+            for result in reversed(results):
                 label_w = int(graphics_view.width() / 4)
                 label_h = int(label_w * 0.77)
-                resized_img = self.resize_img(img, label_w, label_h, -1)
-                qimg = QtGui.QImage(resized_img, resized_img.shape[1], resized_img.shape[0], resized_img.shape[1] * 3, QtGui.QImage.Format_RGB888)
-                pixmap = QtGui.QPixmap.fromImage(qimg)
-                item = QtWidgets.QGraphicsPixmapItem()
+                item = ResultTile(result.get_id(), label_w, label_h, self.get_result_tooltip,
+                                  SSVII_GUI.FREE_TILE_PLACEHOLDER_DETAIL)
                 pos_x = random.randint(0, graphics_view.width() - 10 - label_w)
                 pos_y = random.randint(0, graphics_view.height() - 10 - label_h)
                 item.setPos(QtCore.QPointF(pos_x, pos_y))
-                item.setPixmap(pixmap)
                 item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable)
-                item.setData(0, result.get_id())
                 item.setData(1, 1.0)
-                def mouse_pressed(event):
-                    max_z = 0
-                    for i in scene.items():
-                        max_z = max(max_z, i.zValue())
-                    item_pressed = scene.itemAt(event.scenePos(), graphics_view.transform())
-                    item_pressed.setZValue(max_z + 1)
-                    scene.update()
-                def wheel_moved(event):
-                    item_under = scene.itemAt(event.scenePos(), graphics_view.transform())
-                    if item_under is None:
-                        return
-                    scale = item_under.data(1)
-                    delta = event.delta()
-                    delta = round(np.interp(delta, [-360, 360], [-1, 1]), 2)
-                    if (delta < 0 and scale + delta <= 0.3) or (delta > 0 and scale + delta) >= 10:
-                        return
-                    scale += delta
-                    item_under.setData(1, scale)
-                    result = self.res_manager.get_result_by_id(item_under.data(0))
-                    img = self.get_result_img(result)
-                    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-                    # Update pixmap
-                    width = int(graphics_view.width() / 4 * scale)
-                    height = int(width * 0.77)
-                    resized_img = self.resize_img(img, width, height, -1)
-                    qimg = QtGui.QImage(resized_img, resized_img.shape[1], resized_img.shape[0],
-                                        resized_img.shape[1] * 3, QtGui.QImage.Format_RGB888)
-                    pixmap = QtGui.QPixmap.fromImage(qimg)
-                    offsetx = pixmap.width() - item_under.pixmap().width()
-                    offsety = pixmap.height() - item_under.pixmap().height()
-                    x = item_under.x() - offsetx / 2
-                    y = item_under.y() - offsety / 2
-                    item_under.setPos(x, y)
-                    item_under.setPixmap(pixmap)
-                    scene.update()
                 item.mousePressEvent = mouse_pressed
                 item.wheelEvent = wheel_moved
 
-                # Update tooltip
-                img_width = int(SSVII_GUI.MAIN_WINDOW_WIDTH * 0.5)
-                img_height = int(SSVII_GUI.MAIN_WINDOW_HEIGHT * 0.5)
-                ratio = img.shape[1] / img.shape[0]
-
-                if int(img_width / ratio) < img_height:
-                    img_height = int(img_width / ratio)
-
-                resized_img = self.resize_img(img, img_width, img_height)
-                resized_img = cv2.cvtColor(resized_img, cv2.COLOR_BGR2RGB)
-                path = result.get_original_path()
-                file_format = path.split('.')[-1]
-                _, im_arr = cv2.imencode("." + file_format, resized_img)  # im_arr: image in Numpy one-dim array format.
-                b64 = str(base64.b64encode(im_arr.tobytes()))[2:]
-                img_tag = '<img src="data:image/{1};base64,{2}"></>'.format(path, file_format, b64)
-
-                if self.current_method_mode == SSVII_GUI.FEATURE_MATCHING_MODE:
-                    item.setToolTip(str(
-                        '<h3 style="color: #cccccc">Relevance: {0}%</><h3 style="color: #cccccc">Keypoints/Descriptors: {1}</><h3 style="color: #cccccc">Matches: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(
-                        round(self.res_manager.get_relevance(result), 2), len(self.res_manager.get_keypoints(result)),
-                        len(self.res_manager.get_matches(result)), self.res_manager.get_original_path(result), img_tag))
-                elif self.current_method_mode == SSVII_GUI.OBJECT_DETECTION_MODE:
-                    item.setToolTip(str(
-                        '<h3 style="color: #cccccc">Avg. Confidence: {0}%</><h3 style="color: #cccccc">Number of Classes: {1}</><h3 style="color: #cccccc">Number of Detections: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(
-                        round(self.res_manager.get_avg_confidence(result), 2),
-                        self.res_manager.get_num_classes(result),
-                        self.res_manager.get_num_detections(result), self.res_manager.get_original_path(result),
-                        img_tag))
 
                 # Add item
                 scene.addItem(item)
             scene.setSceneRect(scene.itemsBoundingRect())
+            self.load_visible_tiles(graphics_view)
         elif self.current_results_mode == SSVII_GUI.RESULTS_MODE_SPIRAL:
-            scene.setSceneRect(0, 0, 80000, 80000)
-            graphics_view.centerOn(40000, 40000)
-
             # Spiral variables
             # https://en.wikipedia.org/wiki/Archimedean_spiral
             c = 1
             v = 35
             w = 70
             t = 0
-            num_results = 85  # Number of results to display
             width_increase = 64
             height_increase = 48
-            label_w = int(graphics_view.width() / 4)  # Starting width
-            label_h = int(graphics_view.width() / 4)  # Starting height
-
-            for result in reversed(results[:num_results]):
-                img = self.get_result_img(result)
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-                # Update pixmap
-                resized_img = self.resize_img(img, label_w, label_h)
-                qimg = QtGui.QImage(resized_img, resized_img.shape[1], resized_img.shape[0], resized_img.shape[1] * 3,
-                                    QtGui.QImage.Format_RGB888)
-                pixmap = QtGui.QPixmap.fromImage(qimg)
-                item = QtWidgets.QGraphicsPixmapItem()
-                scene_rect = scene.sceneRect()
-                pos_x = (v * t + c) * np.cos(w * t) - label_w / 2 + scene_rect.width() / 2
-                pos_y = (v * t + c) * np.sin(w * t) - label_h / 2 + scene_rect.height() / 2
+            start_w = int(graphics_view.width() / 4)  # Starting width
+            start_h = int(graphics_view.width() / 4)  # Starting height
+            # The most relevant results grow from the starting size, the rest are shown at it
+            num_growing = min(len(results), SSVII_GUI.SPIRAL_GROWING_TILES)
+
+            # The least relevant results are at the center of the spiral, below the more relevant ones. The tiles start
+            # as placeholders, their images are loaded as they come into view
+            center_item = None
+            for rank in reversed(range(len(results))):
+                growth = max(num_growing - 1 - rank, 0)
+                label_w = start_w + growth * width_increase
+                label_h = start_h + growth * height_increase
+                item = ResultTile(results[rank].get_id(), label_w, label_h, self.get_result_tooltip,
+                                  SSVII_GUI.FREE_TILE_PLACEHOLDER_DETAIL)
+                pos_x = (v * t + c) * np.cos(w * t) - label_w / 2
+                pos_y = (v * t + c) * np.sin(w * t) - label_h / 2
                 item.setPos(QtCore.QPointF(pos_x, pos_y))
-                item.setPixmap(pixmap)
                 item.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable)
-                #item.setData(0, result.get_id())
-                #item.setData(1, 1.0)
+                if center_item is None:
+                    center_item = item
 
-                # Update tooltip
-                img_width = int(SSVII_GUI.MAIN_WINDOW_WIDTH * 0.5)
-                img_height = int(SSVII_GUI.MAIN_WINDOW_HEIGHT * 0.5)
-                ratio = img.shape[1] / img.shape[0]
-
-                if int(img_width / ratio) < img_height:
-                    img_height = int(img_width / ratio)
-
-                resized_img = self.resize_img(img, img_width, img_height)
-                resized_img = cv2.cvtColor(resized_img, cv2.COLOR_BGR2RGB)
-                path = result.get_original_path()
-                file_format = path.split('.')[-1]
-                _, im_arr = cv2.imencode("." + file_format, resized_img)  # im_arr: image in Numpy one-dim array format.
-                b64 = str(base64.b64encode(im_arr.tobytes()))[2:]
-                img_tag = '<img src="data:image/{1};base64,{2}"></>'.format(path, file_format, b64)
-
-                if self.current_method_mode == SSVII_GUI.FEATURE_MATCHING_MODE:
-                    item.setToolTip(str(
-                        '<h3 style="color: #cccccc">Relevance: {0}%</><h3 style="color: #cccccc">Keypoints/Descriptors: {1}</><h3 style="color: #cccccc">Matches: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(
-                        round(self.res_manager.get_relevance(result), 2), len(self.res_manager.get_keypoints(result)),
-                        len(self.res_manager.get_matches(result)), self.res_manager.get_original_path(result), img_tag))
-                elif self.current_method_mode == SSVII_GUI.OBJECT_DETECTION_MODE:
-                    item.setToolTip(str(
-                        '<h3 style="color: #cccccc">Avg. Confidence: {0}%</><h3 style="color: #cccccc">Number of Classes: {1}</><h3 style="color: #cccccc">Number of Detections: {2}</><h3 style="color: #cccccc">Path: {3}</><br><br>{4}').format(
-                        round(self.res_manager.get_avg_confidence(result), 2),
-                        self.res_manager.get_num_classes(result),
-                        self.res_manager.get_num_detections(result), self.res_manager.get_original_path(result),
-                        img_tag))
 
                 # Add item
                 scene.addItem(item)
 
                 # Update values for next result
-                label_w += width_increase
-                label_h += height_increase
                 t += 3.14 * 2
 
+            # The tiles can be moved a bit past the ends of the spiral
+            margin = max(graphics_view.width(), graphics_view.height())
+            scene.setSceneRect(scene.itemsBoundingRect().adjusted(-margin, -margin, margin, margin))
+
             # Center the qgraphicsview in the center of the the spiral
-            center_item = scene.items()[-1]
-            graphics_view.centerOn(QtCore.QPoint(center_item.pos().x() + center_item.pixmap().width() / 2, center_item.pos().y() + center_item.pixmap().height() / 2))
+            graphics_view.centerOn(center_item.sceneBoundingRect().center())
+            self.load_visible_tiles(graphics_view)
 
     def update_progress_bar(self, current):
         """
@@ -1900,10 +2027,14 @@ class SSVII_GUI(object):
                 self.button_od_speed_up.setDisabled(True)
 
 
-    def get_result_img(self, result=None):
+    def get_result_img(self, result=None, width=None, height=None, visible=None):
         """
-        Gets the image that corresponds to the current display mode from a result and returns it
+        Gets the image that corresponds to the current display mode from a result and returns it. The overlays are drawn
+        at the resolution the image is displayed at, so the image is only as large as the frame it is fitted into
         :param result: result to return the image from
+        :param width: width of the frame the image will be displayed in. If None, the image is kept at its original size
+        :param height: height of the frame the image will be displayed in
+        :param visible: Names of the layers to draw. If None, the ones of the current display modes
         :return img: image from a result that corresponds to the current display mode
         """
 
@@ -1911,40 +2042,64 @@ class SSVII_GUI(object):
         if result is None:
             result = self.res_manager.get_result_at_index(self.current_result_index)
 
-        img = self.res_manager.get_img_original(result).copy()
+        size = self.get_result_size(result)
+        if size is None:
+            return None
+
+        if visible is None:
+            visible = self.get_visible_layers()
+        overlays = [getattr(self.res_manager, name)(result) for name in visible]
+        overlays = [overlay for overlay in overlays if overlay is not None and not overlay.is_empty()]
+
+        # Scale the image and the overlays so that all of them together fit in the frame
+        scale = 1
+        if width is not None and height is not None:
+            canvas_w = max([size[0]] + [overlay.get_size()[0] for overlay in overlays])
+            canvas_h = max([size[1]] + [overlay.get_size()[1] for overlay in overlays])
+            scale = min(width / canvas_w, height / canvas_h)
+        img = self.get_scaled_original(result, scale)
+        if img is None:
+            return None
+        layers = [overlay.render(scale) for overlay in overlays]
+        # The scaled image is a copy, so the overlays are drawn right over it unless one of them is larger
+        out = img if all(layer.shape[0] <= img.shape[0] and layer.shape[1] <= img.shape[1] for layer in layers) \
+            else None
+        return self.compositor.compose(img, layers, out)
+
+    def get_result_size(self, result):
+        """
+        :param result: Result
+        :return: Returns the size (width, height) of the original image of a result, or None if it can't be decoded
+        """
+        thumbnails = self.res_manager.get_img_thumbnails(result)
+        if thumbnails is not None:
+            return thumbnails.get_original_size()
+        img = self.res_manager.get_img_original(result)
+        if img is None:
+            return None
+        return img.shape[1], img.shape[0]
 
-        if self.current_method_mode == SSVII_GUI.FEATURE_MATCHING_MODE:
-            if SSVII_GUI.DISPLAY_FM_MATCHES:
-                img = self.apply_overlay(img, self.res_manager.get_img_fm_matches(result))
-            if SSVII_GUI.DISPLAY_FM_KEYPOINTS:
-                img = self.apply_overlay(img, self.res_manager.get_img_fm_keypoints(result))
-            if SSVII_GUI.DISPLAY_FM_CIRCLE_PREDICTION:
-                img = self.apply_overlay(img, self.res_manager.get_img_fm_circle_prediction(result))
-            if SSVII_GUI.DISPLAY_FM_BOUNDING_BOX:
-                img = self.apply_overlay(img, self.res_manager.get_img_fm_bounding_box(result))
-        elif self.current_method_mode == SSVII_GUI.OBJECT_DETECTION_MODE:
-            a = SSVII_GUI.DISPLAY_OD_MASKS
-            if SSVII_GUI.DISPLAY_OD_MASKS:
-                img = self.apply_overlay(img, self.res_manager.get_img_od_masks(result))
-            if SSVII_GUI.DISPLAY_OD_BOUNDING_BOXES:
-                img = self.apply_overlay(img, self.res_manager.get_img_od_bounding_boxes(result))
-            if SSVII_GUI.DISPLAY_OD_CLASSES:
-                img = self.apply_overlay(img, self.res_manager.get_img_od_class_labels(result))
-
-        return img
-
-    def apply_overlay(self, original, overlay):
-        if overlay is None:
-            return original
-        original = cv2.cvtColor(original, cv2.COLOR_BGR2BGRA)
-        if original.shape[0] > overlay.shape[0] or original.shape[1] > overlay.shape[1]:
-            overlay = cv2.copyMakeBorder(src=overlay, top=0, bottom=original.shape[0] - overlay.shape[0], left=original.shape[1] - overlay.shape[1], right=0, borderType=cv2.BORDER_CONSTANT, value=[0, 0, 0, 0])
-        elif original.shape[0] < overlay.shape[0] or original.shape[1] < overlay.shape[1]:
-            original = cv2.copyMakeBorder(src=original, top=0, bottom=overlay.shape[0] - original.shape[0], left=overlay.shape[1] - original.shape[1], right=0, borderType=cv2.BORDER_CONSTANT, value=[0, 0, 0, 0])
-        mask = overlay[:, :, 3] > 0
-
-        original[mask] = overlay[mask]
-        return original
+    def get_scaled_original(self, result, scale):
+        """
+        Resizes the original image of a result. Small sizes (e.g. in the grids, pile and spiral) are resized from the
+        nearest level of the result's thumbnail pyramid instead of the original image
+        :param result: Result
+        :param scale: Scale of the image, e.g. 0.25 for a quarter of its size
+        :return: Returns a copy of the resized image, or None if the image of the result can't be decoded
+        """
+        size = self.get_result_size(result)
+        if size is None:
+            return None
+        dim = (max(int(round(size[0] * scale)), 1), max(int(round(size[1] * scale)), 1))
+        thumbnails = self.res_manager.get_img_thumbnails(result)
+        img = thumbnails.get_level(dim[0], dim[1]) if thumbnails is not None else None
+        if img is None:
+            img = self.res_manager.get_img_original(result)
+            if img is None:
+                return None  # e.g. the file was moved after the pyramid was made
+        if (img.shape[1], img.shape[0]) == dim:
+            return img.copy()
+        return cv2.resize(img, dim, interpolation=cv2.INTER_AREA if dim[0] <= img.shape[1] else cv2.INTER_LINEAR)
 
     def resize_img(self, img, width, height, fill=30):
         """
@@ -1977,7 +2132,10 @@ class SSVII_GUI(object):
 
         # Resize the image to the new dimensions
         dim = (resized_width, resized_height)
-        resized_img = cv2.resize(img, dim, interpolation=cv2.INTER_AREA)
+        if dim == (img.shape[1], img.shape[0]):
+            resized_img = img  # e.g. results drawn at the size of the frame by get_result_img
+        else:
+            resized_img = cv2.resize(img, dim, interpolation=cv2.INTER_AREA)
 
         if fill == -1:
             return resized_img
@@ -2123,6 +2281,7 @@ class SSVII_GUI(object):
             self.label_gpu_availability.setGeometry(QtCore.QRect(80, 185, 80, 16))
             self.label_title_disk.setGeometry(QtCore.QRect(170, 185, 60, 16))
             self.checkbox_disk.setGeometry(QtCore.QRect(210, 187, 16, 16))
+            self.label_disk_migration.setGeometry(QtCore.QRect(230, 185, 50, 16))
             self.groupbox_od_options.setVisible(False)
             self.groupbox_od_results.setVisible(False)
 
@@ -2146,6 +2305,7 @@ class SSVII_GUI(object):
             self.label_gpu_availability.setGeometry(QtCore.QRect(80, 135, 80, 16))
             self.label_title_disk.setGeometry(QtCore.QRect(170, 135, 60, 16))
             self.checkbox_disk.setGeometry(QtCore.QRect(210, 137, 16, 16))
+            self.label_disk_migration.setGeometry(QtCore.QRect(230, 135, 50, 16))
             self.label_title_reference_img_path.setVisible(False)
             self.label_reference_img_path.setVisible(False)
             self.button_browse_reference_img.setVisible(False)
@@ -2172,17 +2332,24 @@ class SSVII_GUI(object):
             SSVII_GUI.running_thread.join()
 
         class Worker(QtCore.QObject):
+            sig_update_progress = pyqtSignal(int)
             sig_done = pyqtSignal(bool)
 
             def run(self, target, use_disk):
-                self.sig_done.emit(target(use_disk))
+                # Returns right away, the images and results keep moving to the new storage in the background
+                self.sig_done.emit(target(use_disk, self.sig_update_progress))
+
+        def update_progress(percentage):
+            self.label_disk_migration.setText("" if percentage >= 100 else "{}%".format(percentage))
 
         def finished(success):
             self.change_all_clickables_state(True)
             SSVII_GUI.running_thread = None
 
         worker = Worker()
+        worker.sig_update_progress.connect(update_progress)
         worker.sig_done.connect(finished)
+        self.storage_worker = worker  # Kept alive while it reports the progress of the migration
         thread = threading.Thread(target=worker.run, args=(self.res_manager.change_storage_mode, self.checkbox_disk.isChecked()))
         thread.daemon = True
         thread.stop = False
@@ -2233,14 +2400,8 @@ class SSVII_GUI(object):
         # and display it in place of the reference image
         region = self.resize_img(numpy.copy(region), self.label_reference_img.width(),
                                  self.label_reference_img.height())
-        region = cv2.cvtColor(region, cv2.COLOR_BGR2RGB)
-        # Create QImage from cv2 img
-        qimg = QtGui.QImage(region.data,
-                            region.shape[1],
-                            region.shape[0],
-                            QtGui.QImage.Format_RGB888)
-        # Create pixmap from QImage
-        pixmap = QtGui.QPixmap.fromImage(qimg)
+        # Create pixmap from cv2 img
+        pixmap = QImageBridge.to_pixmap(region)
         # Update image QLabel
         self.label_reference_img.setPixmap(pixmap)
         # Update reference's information labels
@@ -2297,6 +2458,9 @@ class SSVII_GUI(object):
             progress_bar.setValue(0)
             progress_bar.setFormat("")
 
+            # The ids of the results are reused by every run, so the tooltips of the previous results are dropped
+            self.tooltip_cache.invalidate("tooltip")
+
             if not success:
                 msg = QtWidgets.QMessageBox()
                 msg.setStyleSheet("QLabel{min-height: 30px;}")
@@ -2560,9 +2724,9 @@ class SSVII_GUI(object):
                 str(result.get_id()),
                 self.res_manager.get_original_path(result),
                 str(round(result.get_relevance(), 2)),
-                str(len(result.get_keypoints())),
-                str(len(result.get_descriptors())),
-                str(len(result.get_matches())))
+                str(result.get_num_keypoints()),
+                str(result.get_num_descriptors()),
+                str(result.get_num_matches()))
         elif self.current_method_mode == SSVII_GUI.OBJECT_DETECTION_MODE:
             window_name = "Result {0}:   {1}   Avg. Confidence {2}%   # Classes {3}   # Detections {4}".format(
                 str(result.get_id()),
@@ -2577,7 +2741,7 @@ class SSVII_GUI(object):
         # weren't found relevant matches for this result, display an appropriate placeholder image mentioning it
         # If there were found enough matches for this result or we are in another display mode, display the result image
         # as normal
-        img = self.get_result_img()
+        img = self.get_result_img(None, SSVII_GUI.MAIN_WINDOW_WIDTH, SSVII_GUI.MAIN_WINDOW_HEIGHT)
         if img is None:
             img = cv2.imread("./resources/image_no_matches.png", 1)
 
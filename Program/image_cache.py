@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+
+
+class ImageCache:
+    """
+    This class is responsible for keeping recently used images (and overlays) in memory, up to a number of bytes, so
+    that showing the same result again doesn't decode it again. When the cache is full, the least recently used entries
+    are evicted first
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: Maximum number of bytes taken by the cached entries. 0 to cache nothing
+        """
+        self.__max_bytes = max_bytes
+        self.__entries = OrderedDict()  # Key -> (value, bytes), from least to most recently used
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        self.reset_stats()
+
+    def get(self, key):
+        """
+        :param key: Tuple whose first item is the namespace of the entry (see invalidate)
+        :return: Returns the cached value, or None if it isn't cached
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.__misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        """
+        Caches a value, evicting the least recently used entries to make room for it. Values larger than the whole cache
+        aren't cached
+        :param key: Tuple whose first item is the namespace of the entry (see invalidate)
+        :param value: Value to cache. It shouldn't be changed while it is cached
+        :param nbytes: Number of bytes the value takes
+        """
+        if nbytes > self.__max_bytes:
+            return
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.__bytes -= old[1]
+            while self.__bytes + nbytes > self.__max_bytes:
+                self.__bytes -= self.__entries.popitem(last=False)[1][1]
+                self.__evictions += 1
+            self.__entries[key] = (value, nbytes)
+            self.__bytes += nbytes
+
+    def invalidate(self, namespace):
+        """
+        Removes every entry of a namespace (e.g. the overlays read from a pack file that was closed)
+        :param namespace: First item of the keys of the entries
+        """
+        with self.__lock:
+            for key in [key for key in self.__entries if key[0] == namespace]:
+                self.__bytes -= self.__entries.pop(key)[1]
+
+    def clear(self):
+        """
+        Removes every entry
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def get_stats(self):
+        """:return: Returns the number of hits, misses and evictions, and the number of entries and bytes cached"""
+        with self.__lock:
+            return {"hits": self.__hits, "misses": self.__misses, "evictions": self.__evictions,
+                    "entries": len(self.__entries), "bytes": self.__bytes, "max_bytes": self.__max_bytes}
+
+    def reset_stats(self):
+        """
+        Resets the number of hits, misses and evictions
+        """
+        with self.__lock:
+            self.__hits = 0
+            self.__misses = 0
+            self.__evictions = 0
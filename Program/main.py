@@ -1,28 +1,64 @@
 from PyQt5 import QtWidgets, QtGui
-import sys, shutil
+import sys, shutil, os
 import gui
 from file_manager import FileManager
 from reference_manager import ReferenceManager
 from results_manager import ResultsManager
 from processing_manager import ProcessingManager
 from feature_matcher import FeatureMatcher
+from descriptor_cache import DescriptorCache
+from visual_index import VisualIndex
+from feature_matching_pool import FeatureMatchingPool
 from object_detector import ObjectDetector
 
 
 if __name__ == "__main__":
     # List of image formats accepted
     formats_accepted = ["png", "jpg", "jpeg", "mp4", "mkv"]
+    # Number of threads used to decode images for analysis
+    decode_workers = os.cpu_count()
+    # Frames of the videos that are analysed (all, one every n frames, one every n seconds or only the key frames)
+    video_sampling = FileManager.VIDEO_SAMPLING_ALL
+    video_sampling_step = 1
 
     # Initialize managers
-    file_manager = FileManager(accepted_formats=formats_accepted)
+    file_manager = FileManager(accepted_formats=formats_accepted, decode_workers=decode_workers,
+                               video_sampling=video_sampling, video_sampling_step=video_sampling_step)
     ref_manager = ReferenceManager(file_manager=file_manager)
-    res_manager = ResultsManager(file_manager=file_manager)
-    feature_matcher = FeatureMatcher()
+    # Maximum number of result overlays waiting to be written to disk in the background, in disk mode
+    write_backlog = 16
+    # Bytes of original images and result overlays kept in memory to be shown again (0 to decode them every time)
+    image_cache_bytes = 512 * 1024 ** 2
+    res_manager = ResultsManager(file_manager=file_manager, write_backlog=write_backlog,
+                                 image_cache_bytes=image_cache_bytes)
+    descriptor_cache = DescriptorCache(directory="./cache/descriptors")
+    # Exact brute force matching, or faster approximate matching (FLANN) that may miss a few matches
+    matcher = FeatureMatcher.MATCHER_BRUTE_FORCE
+    feature_matcher = FeatureMatcher(descriptor_cache=descriptor_cache, matcher=matcher)
     object_detector = ObjectDetector()
+    # Bag of visual words index used to shortlist the images for analysis that are matched against the reference, e.g.
+    # VisualIndex(directory="./cache/visual_index", vocabulary_size=1000, use_tf_idf=True). None to match every image
+    visual_index = None
+    shortlist_size = 200
+    # Number of images for analysis that go through the object detection networks in a single forward pass
+    od_batch_size = 4
+    # Threads matching features and drawing the results while other images are decoded (the networks use one thread)
+    match_workers = 2
+    draw_workers = 2
+    # Match features in several processes instead of threads (without cuda), e.g.
+    # FeatureMatchingPool(num_processes=min(os.cpu_count(), 4), shard_size=8, descriptor_cache=descriptor_cache,
+    # matcher=matcher). None to match in threads
+    matching_pool = None
     proc_manager = ProcessingManager(reference_manager=ref_manager,
                                      results_manager=res_manager,
                                      feature_matcher=feature_matcher,
-                                     object_detector=object_detector)
+                                     object_detector=object_detector,
+                                     visual_index=visual_index,
+                                     shortlist_size=shortlist_size,
+                                     od_batch_size=od_batch_size,
+                                     match_workers=match_workers,
+                                     draw_workers=draw_workers,
+                                     matching_pool=matching_pool)
 
     # Create window and setup GUI
     app = QtWidgets.QApplication(sys.argv)
@@ -2,6 +2,8 @@ import cv2
 import numpy as np
 
 from detection import Detection
+from overlay import Overlay
+from prepared_net import PreparedNet
 
 
 class MaskRCNN:
@@ -33,6 +35,7 @@ class MaskRCNN:
         self.__weights_path = "./resources/models/mask_rcnn_model/frozen_inference_graph.pb"
         self.__config_path = "./resources/models/mask_rcnn_model/mask_rcnn_inception_v2_coco_2018_01_28.pbtxt"
         self.__net = cv2.dnn.readNetFromTensorflow(self.__weights_path, self.__config_path)
+        self.__prepared_net = PreparedNet(self.__net, (1, 3, 480, 640), ["detection_out_final", "detection_masks"])
         self.__confidence_threshold = 0.5
         self.__mask_threshold = 0.7
 
@@ -40,31 +43,73 @@ class MaskRCNN:
         return self.__class_labels
 
     def detect(self, image, object_classes, use_cuda):
-        # Enable/Disable gpu processing
-        if use_cuda:
-            self.__net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-            self.__net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
-        else:
-            self.__net.setPreferableBackend(cv2.dnn.DNN_BACKEND_DEFAULT)
-            self.__net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
-
+        return self.detect_batch([image], object_classes, use_cuda)[0]
+
+    def detect_batch(self, images, object_classes, use_cuda):
+        """
+        Detects the objects in several images, with a single forward pass of the network for the images of the same size
+        :param images: Images to process
+        :param object_classes: Labels of the classes to detect
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns a list with a tuple (information, images) for each image, like detect
+        """
+        outputs = self.forward_batch(images, use_cuda)
+        return [self.draw(image, output, object_classes) for image, output in zip(images, outputs)]
+
+    def prepare(self, use_cuda):
+        """
+        Sets up and warms up the network for the given backend, so that processing the first images isn't slower
+        :param use_cuda: True to use cuda, False otherwise
+        """
+        self.__prepared_net.prepare(use_cuda)
+
+    def forward_batch(self, images, use_cuda):
+        """
+        Runs several images through the network, with a single forward pass for the images of the same size
+        (the network takes the images at their original size, so images of different sizes can't go together)
+        :param images: Images to process
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns the output of the network for each image, to be drawn with draw
+        """
+        # Group the images by size
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(i)
+
+        results = [None] * len(images)
+        for indexes in groups.values():
+            blob = cv2.dnn.blobFromImages([images[i] for i in indexes], swapRB=True, crop=False)
+            (boxes, masks) = self.__prepared_net.forward(blob, use_cuda)
+
+            # The detections of every image come together, the first column tells which image each one belongs to
+            for b, i in enumerate(indexes):
+                rows = boxes[0, 0, :, 0] == b
+                results[i] = (boxes[0, 0][rows], masks[rows])
+        return results
+
+    def draw(self, image, output, object_classes):
+        """
+        Draws the objects detected in an image
+        :param image: Image that was processed
+        :param output: Tuple (detections, one per row, and their segmentation masks) output by the network for this image
+        :param object_classes: Labels of the classes to detect
+        :return: Returns the information regarding the image, and a set of overlays that depict the objects found
+        """
+        (boxes, masks) = output
         detections = []
         classes = []
-        img_od_bounding_boxes = np.zeros((image.shape[0], image.shape[1], 4), dtype="uint8")
-        img_od_class_labels = np.zeros((image.shape[0], image.shape[1], 4), dtype="uint8")
-        img_od_masks = np.zeros((image.shape[0], image.shape[1], 4), dtype="uint8")
-        blob = cv2.dnn.blobFromImage(image, swapRB=True, crop=False)
-        self.__net.setInput(blob)
-        (boxes, masks) = self.__net.forward(["detection_out_final", "detection_masks"])
+        img_od_bounding_boxes = Overlay(image.shape[1], image.shape[0])
+        img_od_class_labels = Overlay(image.shape[1], image.shape[0])
+        img_od_masks = Overlay(image.shape[1], image.shape[0])
 
         # Loop over the detections
-        for i in range(0, boxes.shape[2]):
-            confidence = boxes[0, 0, i, 2]  # Get the confidence
+        for i in range(0, boxes.shape[0]):
+            confidence = boxes[i, 2]  # Get the confidence
 
             # If this detection's confidence is higher than our set confidence
             # threshold then we consider it relevant and process it
             if confidence > self.__confidence_threshold:
-                class_id = int(boxes[0, 0, i, 1])  # Get the id
+                class_id = int(boxes[i, 1])  # Get the id
                 class_name = self.__class_labels[class_id]  # Get the label
                 if class_name not in object_classes:
                     continue
@@ -75,7 +120,7 @@ class MaskRCNN:
                 # Scale the bounding box coordinates back, relative to the size
                 # of the frame, and calculate the dimensions of the bounding box
                 (H, W) = image.shape[:2]
-                box = boxes[0, 0, i, 3:7] * np.array([W, H, W, H])
+                box = boxes[i, 3:7] * np.array([W, H, W, H])
                 (startX, startY, endX, endY) = box.astype("int")
                 boxW = endX - startX
                 boxH = endY - startY
@@ -88,26 +133,21 @@ class MaskRCNN:
                 # Create a binary mask considering our set threshold
                 mask = (mask > self.__mask_threshold)
 
-                # Get the region of the image that corresponds to the mask
-                region = image[startY:endY, startX:endX][mask]
-
-                # Blend this class's color with the region under the mask
+                # Blend this class's color with the region under the mask. Only the mask of the bounding box is kept,
+                # the color is a single pixel stretched over it
                 color = self.__colors[class_id]
-                blended = ((0.4 * color) + (0.6 * region)).astype("uint8")
-                blended = np.c_[blended, np.full((blended.shape[0], 1), 255)]
-                # Put the blended region over the original frame
-                img_od_masks[startY:endY, startX:endX, :][mask] = blended
+                img_od_masks.add_image(color.reshape(1, 1, 3), (startX, startY), (boxW, boxH), mask, 0.4)
 
                 # Draw the bounding box
                 color = [int(c) for c in color]
                 color.append(255)
                 value = image.shape[1] * image.shape[0]
                 thickness = int(round(np.interp(value, [40000, 4000000], [1, 10])))
-                cv2.rectangle(img_od_bounding_boxes, (startX, startY), (endX, endY), color, thickness)
+                img_od_bounding_boxes.add_rectangle((startX, startY), (endX, endY), color, thickness)
 
                 # Draw the class label and confidence
                 text = "{0}: {1}%".format(class_name, round(confidence * 100, 1))
-                desired_text_height = img_od_bounding_boxes.shape[0] * 0.02
+                desired_text_height = image.shape[0] * 0.02
                 font_scale = 0.1
                 while cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, max(int(font_scale * 3), 1))[0][
                     1] < desired_text_height:
@@ -124,8 +164,8 @@ class MaskRCNN:
                     text_y = text_h
                 else:
                     text_y = int(startY - 5)
-                cv2.rectangle(img_od_class_labels, (text_x, text_y - text_h), (text_x + text_w, text_y + int(text_h / 2)), color, -1)
-                cv2.putText(img_od_class_labels, text, (text_x, text_y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0, 255), thickness, cv2.LINE_AA)
+                img_od_class_labels.add_rectangle((text_x, text_y - text_h), (text_x + text_w, text_y + int(text_h / 2)), color, -1)
+                img_od_class_labels.add_text(text, (text_x, text_y), font_scale, (0, 0, 0, 255), thickness, cv2.LINE_AA)
 
                 # Create detection object
                 detections.append(Detection(confidence, class_name))
@@ -56,3 +56,56 @@ class ObjectDetector:
             return self.mask_rcnn.detect(image, self.active_classes, use_cuda)
         elif method == "ENet + Mask R-CNN":
             return self.enet_maskrcnn.detect(image, self.active_classes, use_cuda)
+
+    def detect_batch(self, images, method, use_cuda):
+        """
+        Processes several images at once with the given method
+        :param images: Images to process
+        :param method: Object detection method
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns a list with a tuple (information, images) for each image, like detect
+        """
+        return self.__get_model(method).detect_batch(images, self.active_classes, use_cuda)
+
+    def prepare(self, method, use_cuda):
+        """
+        Sets up and warms up the networks of the given method for the given backend. Also done on the first forward
+        pass if this isn't called
+        :param method: Object detection method
+        :param use_cuda: True to use cuda, False otherwise
+        """
+        self.__get_model(method).prepare(use_cuda)
+
+    def forward_batch(self, images, method, use_cuda):
+        """
+        Runs several images through the networks of the given method, without drawing what was found.
+        The networks can only process one batch at a time
+        :param images: Images to process
+        :param method: Object detection method
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns the output of the networks for each image, to be drawn with draw
+        """
+        return self.__get_model(method).forward_batch(images, use_cuda)
+
+    def draw(self, image, output, method):
+        """
+        Draws what the networks of the given method found in an image
+        :param image: Image that was processed
+        :param output: Output of the networks for the image (see forward_batch)
+        :param method: Object detection method
+        :return: Returns the information regarding the image, and a set of overlays that depict what was found
+        """
+        return self.__get_model(method).draw(image, output, self.active_classes)
+
+    def __get_model(self, method):
+        method = method.get_name()
+        if method == "YOLOv3":
+            return self.yolov3
+        elif method == "SSD":
+            return self.ssd
+        elif method == "ENet":
+            return self.enet
+        elif method == "Mask R-CNN":
+            return self.mask_rcnn
+        elif method == "ENet + Mask R-CNN":
+            return self.enet_maskrcnn
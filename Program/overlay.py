@@ -0,0 +1,283 @@
+import cv2
+import numpy as np
+
+
+class Overlay:
+    """
+    This class keeps what is drawn over an image (polygons, circles, rectangles, text, keypoints, match lines and small
+    image tiles) as a list of primitives, instead of as a transparent image as large as the one it is drawn over, and
+    draws them at the resolution they are displayed at.
+    Coordinates and sizes are in pixels of the overlay. The overlay may be larger than the image it is drawn over (e.g.
+    when the reference is shown on its left side), in which case the image is at the top right corner of the overlay
+    """
+
+    LINE_SAMPLES = 2 ** 21  # Pixels of the match lines worked out at once, so that long lines don't take much memory
+
+    def __init__(self, width, height):
+        """
+        :param width: Width of the overlay
+        :param height: Height of the overlay
+        """
+        self.__width = int(width)
+        self.__height = int(height)
+        self.__primitives = []  # Tuples (type, parameters), drawn in order
+
+    def get_size(self):
+        """:return: Returns the size (width, height) of the overlay"""
+        return self.__width, self.__height
+
+    def get_nbytes(self):
+        """:return: Returns the number of bytes taken by the arrays (points, tiles, maps) of the primitives"""
+        return sum(value.nbytes for kind, parameters in self.__primitives for value in parameters
+                   if isinstance(value, np.ndarray))
+
+    def is_empty(self):
+        """:return: Returns True if nothing is drawn on the overlay, False otherwise"""
+        return len(self.__primitives) == 0
+
+    def add_polygon(self, points, color, thickness, closed=True):
+        """
+        :param points: Array of points (x, y), one per row
+        :param color: BGRA color
+        :param thickness: Thickness of the lines
+        :param closed: True to join the last point to the first, False otherwise
+        """
+        points = np.asarray(points, dtype="float32").reshape(-1, 2)
+        self.__primitives.append(("polygon", (points, tuple(color), thickness, closed)))
+
+    def add_circle(self, center, radius, color, thickness=-1):
+        """
+        :param center: Point (x, y)
+        :param radius: Radius of the circle
+        :param color: BGRA color
+        :param thickness: Thickness of the outline, -1 to fill the circle
+        """
+        self.__primitives.append(("circle", (tuple(center), radius, tuple(color), thickness)))
+
+    def add_rectangle(self, top_left, bottom_right, color, thickness=-1):
+        """
+        :param top_left: Point (x, y)
+        :param bottom_right: Point (x, y)
+        :param color: BGRA color
+        :param thickness: Thickness of the outline, -1 to fill the rectangle
+        """
+        self.__primitives.append(("rectangle", (tuple(top_left), tuple(bottom_right), tuple(color), thickness)))
+
+    def add_text(self, text, origin, font_scale, color, thickness, line_type=cv2.LINE_8):
+        """
+        :param text: Text to write, in the cv2.FONT_HERSHEY_SIMPLEX font
+        :param origin: Bottom left point (x, y) of the text
+        :param font_scale: Scale of the font (see cv2.putText)
+        :param color: BGRA color
+        :param thickness: Thickness of the strokes
+        :param line_type: Line type of the strokes (see cv2.putText)
+        """
+        self.__primitives.append(("text", (text, tuple(origin), font_scale, tuple(color), thickness, line_type)))
+
+    def add_keypoints(self, points, color, radius=3):
+        """
+        Draws each keypoint as a small circle, like cv2.drawKeypoints
+        :param points: Array of points (x, y), one per row
+        :param color: BGRA color
+        :param radius: Radius of the circles
+        """
+        points = np.asarray(points, dtype="float32").reshape(-1, 2)
+        self.__primitives.append(("keypoints", (points, tuple(color), radius)))
+
+    def add_lines(self, start_points, end_points, colors, radius=3):
+        """
+        Draws a line between each pair of points, with a small circle at each end, like cv2.drawMatches
+        :param start_points: Array of points (x, y), one per row
+        :param end_points: Array of points (x, y), one per row
+        :param colors: Array of BGRA colors, one per row
+        :param radius: Radius of the circles
+        """
+        start_points = np.asarray(start_points, dtype="float32").reshape(-1, 2)
+        end_points = np.asarray(end_points, dtype="float32").reshape(-1, 2)
+        colors = np.asarray(colors, dtype="uint8").reshape(-1, 4)
+        self.__primitives.append(("lines", (start_points, end_points, colors, radius)))
+
+    def add_image(self, image, top_left, size=None, mask=None, opacity=1.0):
+        """
+        Draws an image tile. The tile is kept as it is given (it isn't copied) and it is resized when drawn
+        :param image: BGR or BGRA image
+        :param top_left: Point (x, y) where the tile is drawn
+        :param size: Size (width, height) the tile is drawn with. If None, the size of the image is used
+        :param mask: Optional boolean array with the shape of the image, only the pixels where it is True are drawn
+        :param opacity: Opacity of the tile, from 0 to 1
+        """
+        if size is None:
+            size = (image.shape[1], image.shape[0])
+        self.__primitives.append(("image", (image, tuple(top_left), tuple(size), mask, opacity)))
+
+    def add_label_map(self, label_map, palette, top_left, size, opacity=1.0):
+        """
+        Draws a map of labels (e.g. a segmentation), each label with its color from a palette. The map is kept at its
+        own resolution and resized when drawn
+        :param label_map: 2D array of labels
+        :param palette: Array of BGR colors, one per label
+        :param top_left: Point (x, y) where the map is drawn
+        :param size: Size (width, height) the map is drawn with
+        :param opacity: Opacity of the map, from 0 to 1
+        """
+        label_map = np.asarray(label_map, dtype="uint8" if len(palette) <= 256 else "int32")
+        self.__primitives.append(("label_map", (label_map, np.asarray(palette, dtype="uint8"), tuple(top_left),
+                                                tuple(size), opacity)))
+
+    def render(self, scale=1.0):
+        """
+        Draws the primitives on a transparent image
+        :param scale: Scale to draw the overlay at, e.g. 0.25 to draw it at a quarter of its size
+        :return: Returns a BGRA image of size (width * scale, height * scale)
+        """
+        canvas = np.zeros((max(int(round(self.__height * scale)), 1), max(int(round(self.__width * scale)), 1), 4),
+                          dtype="uint8")
+
+        def point(p):
+            return int(round(p[0] * scale)), int(round(p[1] * scale))
+
+        def length(value):
+            # Lines stay at least one pixel thick, -1 (filled) is kept as it is
+            return value if value < 0 else max(int(round(value * scale)), 1)
+
+        for kind, parameters in self.__primitives:
+            if kind == "polygon":
+                points, color, thickness, closed = parameters
+                points = np.round(points * scale).astype("int32").reshape(-1, 1, 2)
+                cv2.polylines(canvas, [points], closed, color, length(thickness), cv2.LINE_AA)
+            elif kind == "circle":
+                center, radius, color, thickness = parameters
+                cv2.circle(canvas, point(center), length(radius), color, length(thickness))
+            elif kind == "rectangle":
+                top_left, bottom_right, color, thickness = parameters
+                cv2.rectangle(canvas, point(top_left), point(bottom_right), color, length(thickness))
+            elif kind == "text":
+                text, origin, font_scale, color, thickness, line_type = parameters
+                cv2.putText(canvas, text, point(origin), cv2.FONT_HERSHEY_SIMPLEX, font_scale * scale, color,
+                            length(thickness), line_type)
+            elif kind == "keypoints":
+                points, color, radius = parameters
+                points = np.round(points * scale).astype("int64")
+                colors = np.tile(np.array(color, dtype="uint8"), (len(points), 1))
+                layer = np.zeros(canvas.shape, dtype="uint8")
+                self.__draw_markers(layer, points, colors, length(radius))
+                self.__draw_tile(canvas, layer, None, 1.0, (0, 0), (canvas.shape[1], canvas.shape[0]))
+            elif kind == "lines":
+                start_points, end_points, colors, radius = parameters
+                start_points = np.round(start_points * scale).astype("int64")
+                end_points = np.round(end_points * scale).astype("int64")
+                # Lines that fall on the same pixels are only drawn once, the last one (which is on top)
+                pairs = np.hstack([start_points, end_points])[::-1]
+                if len(pairs) > 0:
+                    keep = np.sort(len(pairs) - 1 - np.unique(pairs, axis=0, return_index=True)[1])
+                    start_points, end_points, colors = start_points[keep], end_points[keep], colors[keep]
+                layer = np.zeros(canvas.shape, dtype="uint8")
+                self.__draw_segments(layer, start_points, end_points, colors)
+                self.__draw_markers(layer, np.vstack([start_points, end_points]), np.vstack([colors, colors]),
+                                    length(radius))
+                self.__draw_tile(canvas, layer, None, 1.0, (0, 0), (canvas.shape[1], canvas.shape[0]))
+            elif kind == "image":
+                image, top_left, size, mask, opacity = parameters
+                self.__draw_tile(canvas, image, mask, opacity, point(top_left), point(size))
+            elif kind == "label_map":
+                label_map, palette, top_left, size, opacity = parameters
+                x, y = point(top_left)
+                w, h = point(size)
+                if w > 0 and h > 0:
+                    # Only the labels of the visible part of the map are colored
+                    label_map = cv2.resize(label_map, (w, h), interpolation=cv2.INTER_NEAREST)
+                    self.__draw_tile(canvas, palette[label_map], None, opacity, (x, y), (w, h))
+        return canvas
+
+    def __draw_markers(self, layer, points, colors, radius):
+        """
+        Draws a small circle at each point, at most one per pixel (the last one drawn there), by stamping a circle drawn
+        once instead of drawing each of them
+        :param layer: Transparent BGRA image to draw on
+        :param points: Array of integer points (x, y), one per row
+        :param colors: Array of BGRA colors, one per row
+        :param radius: Radius of the circles
+        """
+        if len(points) == 0:
+            return
+        keep = np.sort(len(points) - 1 - np.unique(points[::-1], axis=0, return_index=True)[1])
+        points, colors = points[keep], colors[keep]
+
+        marker = np.zeros((2 * radius + 3, 2 * radius + 3), dtype="uint8")
+        cv2.circle(marker, (radius + 1, radius + 1), radius, 255, 1, cv2.LINE_AA)
+        dy, dx = np.nonzero(marker)
+        ys = (points[:, 1:2] + dy - radius - 1).ravel()
+        xs = (points[:, 0:1] + dx - radius - 1).ravel()
+        alpha = (marker[dy, dx][None, :].astype("uint16") * colors[:, 3:4] // 255).ravel()
+        self.__stamp(layer, ys, xs, np.repeat(colors[:, :3], len(dy), axis=0), alpha)
+
+    def __draw_segments(self, layer, start_points, end_points, colors):
+        """
+        Draws a one pixel thick line between each pair of points, working out the pixels of every line at once
+        :param layer: Transparent BGRA image to draw on
+        :param start_points: Array of integer points (x, y), one per row
+        :param end_points: Array of integer points (x, y), one per row
+        :param colors: Array of BGRA colors, one per row
+        """
+        if len(start_points) == 0:
+            return
+        steps = np.abs(end_points - start_points).max(axis=1) + 1  # Pixels of each line
+        chunk = max(Overlay.LINE_SAMPLES // int(steps.max()), 1)
+        for i in range(0, len(steps), chunk):
+            n = steps[i:i + chunk]
+            line = np.repeat(np.arange(i, i + len(n)), n)
+            t = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+            t = t / np.repeat(np.maximum(n - 1, 1), n)
+            xs = np.round(start_points[line, 0] + (end_points[line, 0] - start_points[line, 0]) * t).astype("int64")
+            ys = np.round(start_points[line, 1] + (end_points[line, 1] - start_points[line, 1]) * t).astype("int64")
+            self.__stamp(layer, ys, xs, colors[line, :3], colors[line, 3])
+
+    @staticmethod
+    def __stamp(layer, ys, xs, colors, alpha):
+        """
+        Sets pixels of a layer, cut to the ones inside it. Where a pixel is set more than once, the most opaque one is
+        kept
+        """
+        inside = (ys >= 0) & (ys < layer.shape[0]) & (xs >= 0) & (xs < layer.shape[1])
+        ys, xs, colors, alpha = ys[inside], xs[inside], colors[inside], alpha[inside]
+        # Assignments to repeated pixels keep the last value, the most opaque one once sorted
+        order = np.argsort(alpha, kind="stable")
+        ys, xs, colors, alpha = ys[order], xs[order], colors[order], alpha[order]
+        layer[ys, xs, 3] = np.maximum(layer[ys, xs, 3], alpha)
+        layer[ys, xs, :3] = colors
+
+    def __draw_tile(self, canvas, image, mask, opacity, top_left, size):
+        """
+        Blends a tile over the canvas, resized to the given size and cut to the part that falls inside the canvas
+        """
+        (x, y), (w, h) = top_left, size
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, canvas.shape[1]), min(y + h, canvas.shape[0])
+        if w <= 0 or h <= 0 or x0 >= x1 or y0 >= y1:
+            return
+
+        shrinking = w < image.shape[1] or h < image.shape[0]
+        tile = image if (w, h) == (image.shape[1], image.shape[0]) else \
+            cv2.resize(image, (w, h), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+        tile = tile[y0 - y:y1 - y, x0 - x:x1 - x]
+        if tile.ndim == 2:
+            tile = cv2.cvtColor(tile, cv2.COLOR_GRAY2BGR)
+        if tile.shape[2] == 4:
+            alpha = tile[:, :, 3].astype("float32") / 255
+            tile = tile[:, :, :3]
+        else:
+            alpha = np.ones(tile.shape[:2], dtype="float32")
+        alpha *= opacity
+        if mask is not None:
+            mask = cv2.resize(mask.astype("uint8"), (w, h), interpolation=cv2.INTER_NEAREST)
+            mask = mask[y0 - y:y1 - y, x0 - x:x1 - x]
+            alpha[mask == 0] = 0
+
+        # Draw the tile over what is already on the canvas
+        region = canvas[y0:y1, x0:x1]
+        below = region[:, :, 3].astype("float32") / 255 * (1 - alpha)
+        out_alpha = alpha + below
+        color = tile * alpha[:, :, None] + region[:, :, :3] * below[:, :, None]
+        color /= np.maximum(out_alpha, 1e-6)[:, :, None]
+        region[:, :, :3] = np.clip(color, 0, 255).astype("uint8")
+        region[:, :, 3] = np.clip(out_alpha * 255, 0, 255).astype("uint8")
@@ -0,0 +1,148 @@
+import mmap
+import pickle
+import queue
+import threading
+
+
+class PackFile:
+    """
+    This class is responsible for keeping objects (e.g. the overlays of the results) in a single file, one after the
+    other, with an index of where each one is, instead of in a file each.
+    Objects are pickled with their numpy arrays out of band, so the arrays are written as they are in memory and, when an
+    object is read, its arrays are views of the memory mapped file instead of copies.
+    Objects can also be written by a background thread (write-behind), so that whoever appends them doesn't wait for
+    them to be pickled and written. Until an object is written, it is read from memory
+    """
+
+    def __init__(self, path, backlog=0):
+        """
+        :param path: Path of the file. If it exists, it is emptied
+        :param backlog: Maximum number of objects waiting to be written by the background thread (appending waits while
+        there are as many). If 0, objects are written as they are appended
+        """
+        self.__path = path
+        self.__file = open(path, "w+b")
+        self.__size = 0  # Bytes written
+        self.__index = {}  # Key -> (offset of the object, length of the pickle, offset and length of each array)
+        self.__map = None  # Memory map of the file, made again when the file grows past it
+        self.__alignment = 64  # Arrays start at multiples of this, so that the views are aligned
+        self.__lock = threading.Lock()
+        self.__pending = {}  # Key -> object appended that wasn't written yet
+        self.__queue = queue.Queue(backlog) if backlog > 0 else None  # Objects waiting to be written
+        self.__error = None  # Exception raised while writing in the background, raised again by flush
+        self.__writer = None
+        if self.__queue is not None:
+            self.__writer = threading.Thread(target=self.__write_pending)
+            self.__writer.daemon = True
+            self.__writer.start()
+
+    def get_path(self):
+        """:return: Returns the path of the file"""
+        return self.__path
+
+    def __contains__(self, key):
+        return key in self.__index or key in self.__pending
+
+    def append(self, key, obj):
+        """
+        Writes an object at the end of the file. If an object with the same key was written before, it is replaced
+        (the space it took isn't reused)
+        :param key: Key to read the object with
+        :param obj: Object to write. With a background thread, it shouldn't be changed after it is appended
+        :return: Returns the key
+        """
+        if self.__queue is None:
+            self.__write(key, obj)
+            return key
+        with self.__lock:
+            self.__pending[key] = obj
+        self.__queue.put((key, obj))
+        return key
+
+    def flush(self):
+        """
+        Waits until every object appended so far is written
+        """
+        if self.__queue is not None:
+            self.__queue.join()
+        if self.__error is not None:
+            error, self.__error = self.__error, None
+            raise error
+
+    def __write_pending(self):
+        while True:
+            item = self.__queue.get()
+            try:
+                if item is None:
+                    return
+                key, obj = item
+                try:
+                    self.__write(key, obj)
+                except Exception as e:
+                    # The object is still read from memory
+                    self.__error = e
+                    continue
+                with self.__lock:
+                    if self.__pending.get(key) is obj:
+                        del self.__pending[key]
+            finally:
+                self.__queue.task_done()
+
+    def __write(self, key, obj):
+        buffers = []
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        arrays = [buffer.raw() for buffer in buffers]
+
+        with self.__lock:
+            if self.__file.closed:
+                return
+            self.__file.seek(self.__size)
+            offset = self.__size
+            self.__file.write(data)
+            position = offset + len(data)
+            locations = []
+            for array in arrays:
+                padding = -position % self.__alignment
+                self.__file.write(bytes(padding))
+                position += padding
+                self.__file.write(array)
+                locations.append((position, array.nbytes))
+                position += array.nbytes
+            self.__file.flush()
+            self.__size = position
+            self.__index[key] = (offset, len(data), locations)
+
+    def read(self, key, copy=False):
+        """
+        Reads an object written with append
+        :param key: Key of the object
+        :param copy: If False, the arrays of the object are read-only views of the file, valid until it is closed. If
+        True, the arrays are copied to memory
+        :return: Returns the object
+        """
+        with self.__lock:
+            if key in self.__pending:
+                return self.__pending[key]
+            offset, length, locations = self.__index[key]
+            if self.__map is None or len(self.__map) < self.__size:
+                # The previous map stays valid for the views of it that are still in use
+                self.__map = mmap.mmap(self.__file.fileno(), self.__size, access=mmap.ACCESS_READ)
+            view = memoryview(self.__map)
+        buffers = [view[start:start + size] for start, size in locations]
+        if copy:
+            buffers = [bytearray(buffer) for buffer in buffers]
+        return pickle.loads(view[offset:offset + length], buffers=buffers)
+
+    def close(self):
+        """
+        Writes the objects that are waiting to be written and closes the file. The views of it that are still in use
+        keep the memory map open until they are released
+        """
+        if self.__writer is not None:
+            self.__queue.put(None)
+            self.__writer.join()
+            self.__writer = None
+        with self.__lock:
+            self.__map = None
+            self.__index = {}
+            self.__file.close()
@@ -0,0 +1,121 @@
+import queue
+import threading
+
+
+class Pipeline:
+    """
+    This class is responsible for running items through a sequence of stages, so that the stages work at the same time
+    on different items (e.g. one image is decoded while another goes through a network and another is drawn).
+    Each stage has its own worker threads and the stages are connected by bounded queues, so only a few items are in
+    flight at any time. The items come out in the same order they went in
+    """
+
+    def __init__(self, stages, queue_size=8):
+        """
+        :param stages: List of tuples (function, number of worker threads). Each function takes the output of the
+        previous stage (or an input item) and returns the input of the next one
+        :param queue_size: Maximum number of items waiting between two stages
+        """
+        self.__stages = stages
+        self.__queue_size = queue_size
+        self.__poll_interval = 0.1  # Seconds between checks of the stop flags while waiting for an item
+
+    def run(self, items):
+        """
+        Runs the items through the stages. Stops early if the calling thread's stop flag is set.
+        If a stage raises an exception, the pipeline stops and the exception is raised here
+        :param items: Iterable of input items. It is consumed by a separate thread
+        :return: Yields the outputs of the last stage, in the same order as the items
+        """
+        caller = threading.currentThread()
+        stop = threading.Event()
+        queues = [queue.Queue(self.__queue_size) for i in range(len(self.__stages) + 1)]
+        finished = object()  # Put in a queue by a stage when it has no more items
+        threads = []
+
+        def put(q, value):
+            while not stop.is_set():
+                try:
+                    q.put(value, timeout=self.__poll_interval)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=self.__poll_interval)
+                except queue.Empty:
+                    pass
+            return finished
+
+        def feed():
+            # The stop flag of this thread is set when the pipeline stops, e.g. to stop decoding
+            try:
+                for i, item in enumerate(items):
+                    if stop.is_set() or not put(queues[0], (i, item, None)):
+                        return
+            except Exception as e:
+                put(queues[-1], (-1, None, e))
+            put(queues[0], finished)
+
+        def work(function, q_in, q_out, num_workers, workers_done):
+            while True:
+                value = get(q_in)
+                if value is finished:
+                    # Pass the end on to the next stage once every worker of this stage is done
+                    put(q_in, finished)
+                    with workers_done[1]:
+                        workers_done[0] += 1
+                        last = workers_done[0] == num_workers
+                    if last:
+                        put(q_out, finished)
+                    return
+                i, item, error = value
+                try:
+                    put(q_out, (i, function(item), None))
+                except Exception as e:
+                    put(queues[-1], (i, None, e))
+
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.stop = False
+        threads.append(feeder)
+        for s, (function, num_workers) in enumerate(self.__stages):
+            num_workers = max(int(num_workers), 1)
+            workers_done = [0, threading.Lock()]
+            for w in range(num_workers):
+                thread = threading.Thread(target=work, args=(function, queues[s], queues[s + 1], num_workers,
+                                                             workers_done))
+                thread.daemon = True
+                threads.append(thread)
+        for thread in threads:
+            thread.start()
+
+        # Put the outputs back in order as they come out of the last stage
+        pending = {}
+        next_index = 0
+        try:
+            while True:
+                if getattr(caller, "stop", False):
+                    return
+                try:
+                    value = queues[-1].get(timeout=self.__poll_interval)
+                except queue.Empty:
+                    continue
+                if value is finished:
+                    return
+                i, output, error = value
+                if error is not None:
+                    raise error
+                pending[i] = output
+                while next_index in pending:
+                    yield pending.pop(next_index)
+                    next_index += 1
+        finally:
+            stop.set()
+            feeder.stop = True
+            for thread in threads:
+                if thread is not threading.currentThread():
+                    thread.join()
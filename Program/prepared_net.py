@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+
+
+class PreparedNet:
+    """
+    This class keeps an opencv dnn network ready to run: the names of its output layers are looked up once, and the
+    backend is only changed when switching between cuda and cpu, so that the network isn't set up again for every image
+    """
+
+    def __init__(self, net, input_shape, output_names=None):
+        """
+        :param net: Network read with cv2.dnn
+        :param input_shape: Shape (batch, channels, height, width) of the blob the network is warmed up with
+        :param output_names: Names of the layers to output. If None, the unconnected output layers are used
+        """
+        self.__net = net
+        self.__input_shape = input_shape
+        if output_names is None:
+            output_names = list(net.getUnconnectedOutLayersNames())
+        self.__output_names = output_names
+        self.__use_cuda = None  # Backend the network is set up for (None if it wasn't set up yet)
+        self.__warm = False
+
+    def get_output_names(self):
+        """:return: Returns the names of the output layers"""
+        return self.__output_names
+
+    def is_prepared(self, use_cuda):
+        """:return: Returns True if the network is set up and warmed up for the given backend, False otherwise"""
+        return self.__use_cuda == use_cuda and self.__warm
+
+    def prepare(self, use_cuda):
+        """
+        Sets up the network for the given backend, if it isn't already, and warms it up with a blank input so that the
+        memory allocations and initialization of the first forward pass don't happen while processing the images
+        :param use_cuda: True to use cuda, False otherwise
+        """
+        self.__set_backend(use_cuda)
+        if not self.__warm:
+            self.__net.setInput(np.zeros(self.__input_shape, dtype="float32"))
+            self.__net.forward(self.__output_names)
+            self.__warm = True
+
+    def forward(self, blob, use_cuda):
+        """
+        Runs a blob through the network
+        :param blob: Input blob
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns the outputs of the output layers, in the same order as their names
+        """
+        self.__set_backend(use_cuda)
+        self.__net.setInput(blob)
+        return self.__net.forward(self.__output_names)
+
+    def __set_backend(self, use_cuda):
+        if self.__use_cuda == use_cuda:
+            return
+        # Enable/Disable gpu processing
+        if use_cuda:
+            self.__net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+            self.__net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+        else:
+            self.__net.setPreferableBackend(cv2.dnn.DNN_BACKEND_DEFAULT)
+            self.__net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.__use_cuda = use_cuda
+        self.__warm = False  # The network is set up again on the next forward pass
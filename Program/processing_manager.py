@@ -1,16 +1,30 @@
+import threading
+
 from method import Method
+from pipeline import Pipeline
+from thumbnail_pyramid import ThumbnailPyramid
 
 class ProcessingManager:
     """
     Manages the processing of reference and analysis images
     """
 
-    def __init__(self, reference_manager, results_manager, feature_matcher, object_detector):
+    def __init__(self, reference_manager, results_manager, feature_matcher, object_detector, visual_index=None,
+                 shortlist_size=200, od_batch_size=4, match_workers=1, draw_workers=1, pipeline_queue_size=8,
+                 matching_pool=None):
         # Managers to delegate to
         self.__ref_manager = reference_manager
         self.res_manager = results_manager
         self.__feature_matcher = feature_matcher
         self.object_detector = object_detector
+        self.__visual_index = visual_index  # Shortlists the images for analysis before matching, if given
+        self.__shortlist_size = shortlist_size  # Number of images for analysis matched against the reference
+        self.__od_batch_size = od_batch_size  # Number of images for analysis that go through the networks together
+        # Images are decoded, matched (or go through the networks) and drawn at the same time, on separate threads
+        self.__match_workers = match_workers  # Threads matching features. The networks always run on a single thread
+        self.__draw_workers = draw_workers  # Threads drawing what was found
+        self.__pipeline_queue_size = pipeline_queue_size  # Maximum number of images waiting between two steps
+        self.__matching_pool = matching_pool  # Matches features in several processes instead of threads, if given
         self.methods_available = (Method("SIFT", "Feature Matching:  SIFT", "Feature Matching", False),
                                   Method("SURF", "Feature Matching:  SURF", "Feature Matching", True),
                                   Method("ORB", "Feature Matching:  ORB", "Feature Matching", True),
@@ -40,6 +54,12 @@ class ProcessingManager:
     def get_methods_available(self):
         return self.methods_available
 
+    def get_descriptor_cache_stats(self):
+        return self.__feature_matcher.get_cache_stats()
+
+    def get_matcher_stats(self):
+        return self.__feature_matcher.get_matcher_stats()
+
     def get_active_method(self):
         return self.active_method
 
@@ -73,6 +93,8 @@ class ProcessingManager:
         if keypoints is None or descriptors is None:
             return False
 
+        self.__feature_matcher.reset_matcher_stats()
+
         # Update the reference information
         reference.set_keypoints(keypoints)
         reference.set_descriptors(descriptors)
@@ -84,35 +106,135 @@ class ProcessingManager:
         index = 0
         sig_progress.emit(index)
 
-        for result in analysis:
+        # Only match the reference against the most promising images for analysis
+        if self.__visual_index is not None and not use_cuda and len(analysis) > self.__shortlist_size:
             try:
-                if use_cuda:
-                    desc = descriptors_cuda
-                else:
-                    desc = descriptors
-                info, images = self.__feature_matcher.process_result(ref_img, keypoints, desc, self.res_manager.get_img_original(result), self.active_method, use_cuda)
+                analysis, index = self.__shortlist_analysis(analysis, descriptors, sig_progress)
             except:
+                self.__feature_matcher.save_cache()
                 return False
+            if analysis is None:
+                self.__feature_matcher.save_cache()
+                return False
+
+        # The overlays are written to disk in the background as the results come out
+        if not self.res_manager.start_results_storage(use_disk):
+            self.__feature_matcher.save_cache()
+            return False
+
+        # Progress of the matching goes up to 2/3 of the progress bar
+        start_index = index
+        end_index = len(self.res_manager.get_analysis()) * 2
+        processed = 0
+
+        desc = descriptors_cuda if use_cuda else descriptors
+
+        def match(item):
+            result, img_original = item
+            source = (self.res_manager.get_original_path(result), self.res_manager.get_frame_index(result))
+            found = self.__feature_matcher.match_result(desc, img_original, self.active_method, use_cuda, source)
+            # The thumbnails are made while the image is decoded, so that the views don't decode it again
+            return result, img_original.shape, found, ThumbnailPyramid(img_original)
+
+        def draw(item):
+            result, img_shape, (kp_analysis, desc_analysis, matches), thumbnails = item
+            info, images = self.__feature_matcher.draw_result(ref_img, keypoints, img_shape, kp_analysis,
+                                                              desc_analysis, matches)
+            images["img_thumbnails"] = thumbnails
+            return result, (info, images)
+
+        if self.__matching_pool is not None and not use_cuda:
+            # The images are decoded and matched by the processes of the pool, only drawing happens here
+            sources = [(self.res_manager.get_original_path(r), self.res_manager.get_frame_index(r),
+                        self.res_manager.get_img_original(r, False)) for r in analysis]
+            matched = ((analysis[i], img_shape, found, thumbnails) for i, img_shape, found, thumbnails
+                       in self.__matching_pool.run(self.active_method, descriptors, sources))
+            stages = [(draw, self.__draw_workers)]
+        else:
+            # The cuda detectors and matchers can't be shared between threads
+            matched = self.res_manager.iter_analysis(analysis)
+            stages = [(match, 1 if use_cuda else self.__match_workers), (draw, self.__draw_workers)]
+        pipeline = Pipeline(stages, self.__pipeline_queue_size)
+        try:
+            for result, (info, images) in pipeline.run(matched):
+                info["id"] = self.res_manager.get_id(result)
+                info["frame_index"] = self.res_manager.get_frame_index(result)
+                info["timestamp"] = self.res_manager.get_timestamp(result)
+                info["original_path"] = self.res_manager.get_original_path(result)
+                images["img_original"] = self.res_manager.get_img_original(result, False)
+                self.res_manager.store_fm_overlays(info["id"], images)
+                new_results.append({"info": info, "images": images})
+                if len(info["matches"]) > max_num_matches:
+                    max_num_matches = len(info["matches"])
+                sum_matches += len(info["matches"])
+                processed += 1
+                index = start_index + processed * (end_index - start_index) // len(analysis)
+                sig_progress.emit(index)
+        except:
+            self.__feature_matcher.save_cache()
+            return False
+
+        if getattr(threading.currentThread(), "stop", False):
+            self.__feature_matcher.save_cache()
+            return False
 
-            info["id"] = self.res_manager.get_id(result)
-            info["original_path"] = self.res_manager.get_original_path(result)
-            images["img_original"] = self.res_manager.get_img_original(result, False)
-            new_results.append({"info": info, "images": images})
-            if len(info["matches"]) > max_num_matches:
-                max_num_matches = len(info["matches"])
-            sum_matches += len(info["matches"])
-            index += 1
-            sig_progress.emit(index)
+        # Keep the descriptors computed for the images for analysis for the next references
+        self.__feature_matcher.save_cache()
 
         for item in new_results:
             if len(descriptors) <= 0:#sum_matches <= 0:
                 item["info"]["relevance"] = 0
             else:
                 item["info"]["relevance"] = len(item["info"]["matches"]) / len(descriptors) * 100#len(item["info"]["matches"]) / max_num_matches * 100#len(item["info"]["matches"]) / len(item["info"]["keypoints"]) * 100#num_matches / sum_matches  # self.calc_fm_relevance()
-            index += 1
 
+        # Saving the results fills the rest of the progress bar
+        index = len(self.res_manager.get_analysis()) * 3 - len(new_results)
         return self.res_manager.set_fm_results(new_results, use_disk, sig_progress, index)
 
+    def __shortlist_analysis(self, analysis, descriptors, sig_progress):
+        """
+        Chooses the images for analysis that share the most visual words with the reference, using the visual index.
+        The index is built (over the descriptors in the descriptor cache, or computed) if it doesn't exist yet for
+        these images and this method, which takes up to the first third of the progress bar
+        :param analysis: Images for analysis
+        :param descriptors: Descriptors of the reference
+        :param sig_progress: Signal to emit the progress with
+        :return: Returns a tuple (shortlisted images for analysis, progress index), or (None, index) if the processing
+        was stopped. Every image is kept if the index doesn't find a full shortlist (e.g. a reference with few
+        descriptors), so that images aren't left out only because they share no visual words with it
+        """
+        sources = [(self.res_manager.get_original_path(r), self.res_manager.get_frame_index(r)) for r in analysis]
+        key = self.__visual_index.get_key(self.__feature_matcher.get_method_key(self.active_method), sources)
+        index = 0
+        if not self.__visual_index.load(key):
+
+            def compute_descriptors(result):
+                source = (self.res_manager.get_original_path(result), self.res_manager.get_frame_index(result))
+                computed = self.__feature_matcher.compute_analysis_descriptors(
+                    self.active_method, source, lambda: self.res_manager.get_img_original(result, use_cache=False))
+                return computed[1] if computed is not None else None
+
+            def iter_descriptors():
+                for desc, result in self.res_manager.map_analysis(compute_descriptors, analysis):
+                    yield self.res_manager.get_id(result), desc
+
+            def progress(step):
+                sig_progress.emit(step // 2)
+
+            built = self.__visual_index.build(key, [self.res_manager.get_id(r) for r in analysis], iter_descriptors,
+                                              progress)
+            self.__feature_matcher.save_cache()
+            if not built:
+                if getattr(threading.currentThread(), "stop", False):
+                    return None, index
+                return analysis, index  # No descriptors to index, match against every image
+            index = len(analysis)
+
+        shortlist = set(self.__visual_index.query(descriptors, self.__shortlist_size))
+        if len(shortlist) < self.__shortlist_size:
+            return analysis, index
+        return [r for r in analysis if self.res_manager.get_id(r) in shortlist], index
+
     def process_results_od(self, use_cuda, use_disk, sig_progress):
 
         analysis = self.res_manager.get_analysis()
@@ -125,26 +247,65 @@ class ProcessingManager:
         index = 0
         sig_progress.emit(index)
 
-        for result in analysis:
-            #try:
-            info, images = self.object_detector.detect(self.res_manager.get_img_original(result), self.active_method, use_cuda)
-            #except:
-            #    return False
+        # Set up the networks before the images start coming in
+        self.object_detector.prepare(self.active_method, use_cuda)
 
-            if not info["detections"] or len(info["detections"]) == 0:
-                info["avg_confidence"] = 0
-            else:
-                sum_confidence = 0
-                for detection in info["detections"]:
-                    sum_confidence += detection.get_confidence()
-                info["avg_confidence"] = sum_confidence / len(info["detections"]) * 100
-
-            info["id"] = self.res_manager.get_id(result)
-            info["original_path"] = self.res_manager.get_original_path(result)
-            images["img_original"] = self.res_manager.get_img_original(result, False)
-            new_results.append({"info": info, "images": images})
-            index += 1
-            sig_progress.emit(index)
+        # The overlays are written to disk in the background as the results come out
+        if not self.res_manager.start_results_storage(use_disk):
+            return False
+
+        def forward(batch):
+            outputs = self.object_detector.forward_batch([img for result, img in batch], self.active_method, use_cuda)
+            return batch, outputs
+
+        def draw(item):
+            batch, outputs = item
+            drawn = []
+            for (result, img), output in zip(batch, outputs):
+                info, images = self.object_detector.draw(img, output, self.active_method)
+                images["img_thumbnails"] = ThumbnailPyramid(img)
+                drawn.append((result, (info, images)))
+            return drawn
+
+        # Feed the images to the networks a few at a time
+        pipeline = Pipeline([(forward, 1), (draw, self.__draw_workers)], self.__pipeline_queue_size)
+        batches = self.__iter_batches(self.res_manager.iter_analysis(), self.__od_batch_size)
+        for drawn in pipeline.run(batches):
+            for result, (info, images) in drawn:
+                if not info["detections"] or len(info["detections"]) == 0:
+                    info["avg_confidence"] = 0
+                else:
+                    sum_confidence = 0
+                    for detection in info["detections"]:
+                        sum_confidence += detection.get_confidence()
+                    info["avg_confidence"] = sum_confidence / len(info["detections"]) * 100
+
+                info["id"] = self.res_manager.get_id(result)
+                info["frame_index"] = self.res_manager.get_frame_index(result)
+                info["timestamp"] = self.res_manager.get_timestamp(result)
+                info["original_path"] = self.res_manager.get_original_path(result)
+                images["img_original"] = self.res_manager.get_img_original(result, False)
+                self.res_manager.store_od_overlays(info["id"], images)
+                new_results.append({"info": info, "images": images})
+                index += 1
+                sig_progress.emit(index)
+
+        if getattr(threading.currentThread(), "stop", False):
+            return False
 
         #new_results = sorted(new_results, key=lambda r: r["info"]["avg_confidence"], reverse=True)
         return self.res_manager.set_od_results(new_results, use_disk, sig_progress, index)
+
+    def __iter_batches(self, items, batch_size):
+        """
+        Groups items into lists of up to batch_size items
+        :return: Yields the lists, in order
+        """
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
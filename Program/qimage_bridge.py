@@ -0,0 +1,48 @@
+import sys
+
+import cv2
+import numpy as np
+from PyQt5 import QtGui
+
+
+class QImageBridge:
+    """
+    This class is responsible for showing the images of opencv/numpy in Qt. The arrays are wrapped by a QImage of the
+    format their channels are already in (BGR888 for BGR images, ARGB32 for BGRA images, whose bytes are B, G, R, A on
+    little-endian machines), instead of being converted to RGB first, so the only copy made is the one Qt makes when the
+    QImage is turned into a pixmap. Qt older than 5.14 has no BGR888 format, and BGR images are converted to RGB there
+    """
+
+    @staticmethod
+    def to_qimage(array):
+        """
+        Wraps an image without copying it. The QImage keeps a reference to the array, so the array stays alive while the
+        QImage does (the array shouldn't be changed meanwhile)
+        :param array: Grayscale, BGR or BGRA uint8 image
+        :return: Returns the QImage
+        """
+        if array.ndim == 2:
+            image_format = QtGui.QImage.Format_Grayscale8
+        elif array.shape[2] == 3 and hasattr(QtGui.QImage, "Format_BGR888"):
+            image_format = QtGui.QImage.Format_BGR888
+        elif array.shape[2] == 3:
+            array = cv2.cvtColor(array, cv2.COLOR_BGR2RGB)
+            image_format = QtGui.QImage.Format_RGB888
+        elif sys.byteorder == "little":
+            image_format = QtGui.QImage.Format_ARGB32
+        else:
+            array = cv2.cvtColor(array, cv2.COLOR_BGRA2RGBA)
+            image_format = QtGui.QImage.Format_RGBA8888
+        if not array.flags.c_contiguous:
+            array = np.ascontiguousarray(array)  # e.g. a crop of a larger image
+        qimg = QtGui.QImage(array.data, array.shape[1], array.shape[0], array.strides[0], image_format)
+        qimg.array = array
+        return qimg
+
+    @staticmethod
+    def to_pixmap(array):
+        """
+        :param array: Grayscale, BGR or BGRA uint8 image
+        :return: Returns a pixmap with a copy of the image
+        """
+        return QtGui.QPixmap.fromImage(QImageBridge.to_qimage(array))
@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import deque
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import pyqtSignal
+
+
+class RenderPool(QtCore.QObject):
+    """
+    This class is responsible for drawing the images of the results views in background threads, so that the GUI thread
+    only shows them. Each request has a key (e.g. the tile it is drawn for) and a group (e.g. the scene of the tile):
+    a newer request for the same key replaces the older one, and cancelling a key or a group (e.g. a tile that went out
+    of view, or a scene before it is rebuilt) drops its requests that aren't done yet. Requests that were replaced or
+    cancelled are skipped by the threads instead of being drawn. The newest requests are drawn first.
+    The images drawn are shown by callbacks in the GUI thread, for a limited time before letting the GUI handle its other
+    events, so that showing many of them at once doesn't freeze it
+    """
+
+    __sig_done = pyqtSignal(object, int, object)  # Key, ticket of the request, value returned
+
+    def __init__(self, num_threads=2, frame_budget=0.03):
+        """
+        :param num_threads: Number of threads drawing the images
+        :param frame_budget: Seconds spent calling the callbacks of the images drawn before letting the GUI handle its
+        other events
+        """
+        super().__init__()
+        self.__frame_budget = frame_budget
+        self.__requests = deque()  # Tuples (group, key, ticket, function), from the newest
+        self.__live = set()  # Tickets of the requests that weren't replaced, cancelled or shown yet
+        self.__condition = threading.Condition()
+        self.__closed = False
+        # Only used in the GUI thread
+        self.__tickets = {}  # Key -> (group, ticket, callback) of its latest request that wasn't shown yet
+        self.__next_ticket = 0
+        self.__done = deque()  # Tuples (key, ticket, value) of the images drawn, waiting for their callbacks
+        self.__showing = False  # True while showing the images drawn is scheduled
+        self.__sig_done.connect(self.__on_done)  # Queued, since it is emitted by the threads
+        self.__threads = []
+        for i in range(num_threads):
+            thread = threading.Thread(target=self.__render_requests)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def submit(self, group, key, function, callback):
+        """
+        Requests an image. Must be called from the GUI thread
+        :param group: Group of the request (see cancel)
+        :param key: Key of the request. An older request with the same key is dropped
+        :param function: Function without parameters called in a background thread, which draws the image (e.g. a
+        QImage, not a QPixmap). It shouldn't use the GUI's widgets
+        :param callback: Function called in the GUI thread with what function returned, or None if it raised an exception
+        """
+        ticket = self.__next_ticket
+        self.__next_ticket += 1
+        old = self.__tickets.get(key)
+        self.__tickets[key] = (group, ticket, callback)
+        with self.__condition:
+            if old is not None:
+                self.__live.discard(old[1])
+            self.__live.add(ticket)
+            self.__requests.appendleft((group, key, ticket, function))
+            self.__condition.notify()
+
+    def cancel(self, group, key=None):
+        """
+        Drops the requests of a group that weren't shown yet. Must be called from the GUI thread
+        :param group: Group of the requests
+        :param key: Key of the request to drop (e.g. a tile that went out of view), or None to drop every request of the
+        group
+        """
+        if key is not None:
+            request = self.__tickets.get(key)
+            if request is not None and request[0] is group:
+                del self.__tickets[key]
+                with self.__condition:
+                    self.__live.discard(request[1])
+            return
+        with self.__condition:
+            self.__requests = deque(request for request in self.__requests if request[0] is not group)
+        for key, (request_group, ticket, callback) in list(self.__tickets.items()):
+            if request_group is group:
+                del self.__tickets[key]
+                with self.__condition:
+                    self.__live.discard(ticket)
+
+    def __render_requests(self):
+        while True:
+            with self.__condition:
+                while len(self.__requests) == 0 and not self.__closed:
+                    self.__condition.wait()
+                if self.__closed:
+                    return
+                group, key, ticket, function = self.__requests.popleft()
+                if ticket not in self.__live:
+                    continue  # Replaced or cancelled
+            try:
+                value = function()
+            except Exception:
+                value = None  # e.g. the result was removed meanwhile
+            if self.__closed:
+                return
+            self.__sig_done.emit(key, ticket, value)
+
+    def __on_done(self, key, ticket, value):
+        self.__done.append((key, ticket, value))
+        if not self.__showing:
+            self.__showing = True
+            QtCore.QTimer.singleShot(0, self.__show_done)
+
+    def __show_done(self):
+        start = time.perf_counter()
+        while len(self.__done) > 0 and time.perf_counter() - start < self.__frame_budget:
+            key, ticket, value = self.__done.popleft()
+            request = self.__tickets.get(key)
+            # Requests that were replaced or cancelled are dropped
+            if request is None or request[1] != ticket:
+                continue
+            del self.__tickets[key]
+            with self.__condition:
+                self.__live.discard(ticket)
+            request[2](value)
+        if len(self.__done) > 0:
+            QtCore.QTimer.singleShot(0, self.__show_done)
+        else:
+            self.__showing = False
+
+    def close(self):
+        """
+        Drops the requests left and stops the threads, after they finish drawing the images they are drawing (they
+        shouldn't be stopped in the middle of it when the application exits)
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__requests.clear()
+            self.__live.clear()
+            self.__condition.notify_all()
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+
+    def get_num_pending(self):
+        """:return: Returns the number of requests that weren't shown yet"""
+        return len(self.__tickets)
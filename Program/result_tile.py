@@ -0,0 +1,178 @@
+from PyQt5 import QtGui, QtWidgets
+
+
+class ResultTile(QtWidgets.QGraphicsPixmapItem):
+    """
+    Item of the results views that shows a result. It starts as a placeholder as large as the tile, and the image of
+    the result is only loaded when the tile comes into view, so that views with thousands of results are built at once.
+    Its tooltip is only built while the tile is hovered.
+    The image can be drawn at a lower resolution than the tile (its detail) and scaled up to the tile's size, e.g. in a
+    zoomed out spiral, where the tiles are shown much smaller than they are.
+    The image can be loaded as a stack of layers (the original image and one child item per overlay), so that showing or
+    hiding an overlay that was drawn doesn't draw the image again
+    """
+
+    STATE_PLACEHOLDER = 0  # The image of the result isn't loaded (or is out of date)
+    STATE_QUEUED = 1  # The image of the result is waiting to be loaded
+    STATE_LOADED = 2
+
+    PLACEHOLDER_COLOR = (30, 30, 30)  # Same as the bars added by SSVII_GUI.resize_img
+
+    __placeholders = {}  # Size (width, height) -> placeholder pixmap, shared by every tile of that size
+
+    def __init__(self, result_id, width, height, tooltip_provider=None, placeholder_detail=1.0):
+        """
+        :param result_id: Id of the result shown by the tile
+        :param width: Width of the tile
+        :param height: Height of the tile
+        :param tooltip_provider: Optional function result id -> tooltip, called when the tile is hovered
+        :param placeholder_detail: Resolution of the placeholder relative to the tile's size (e.g. 0.25 for a quarter of
+        it), so that large tiles don't keep large placeholders
+        """
+        super().__init__()
+        self.__result_id = result_id
+        self.__size = (int(width), int(height))
+        self.__state = ResultTile.STATE_PLACEHOLDER
+        self.__tooltip_provider = tooltip_provider
+        self.__stacks = []  # Tuples (pixmap of the original image, {layer name: child item}), see set_layers
+        self.__drawn_layers = frozenset()  # Names of the layers drawn for the stacks, see set_layers
+        self.__placeholder_detail = placeholder_detail
+        self.__detail = 1.0  # Resolution of the image shown, or waiting to be loaded, relative to the tile's size
+        self.setData(0, result_id)
+        self.__show_placeholder()
+        self.setAcceptHoverEvents(tooltip_provider is not None)
+
+    @staticmethod
+    def get_placeholder(width, height):
+        """:return: Returns a pixmap of the given size filled with the placeholder color"""
+        size = (int(width), int(height))
+        if size not in ResultTile.__placeholders:
+            pixmap = QtGui.QPixmap(size[0], size[1])
+            pixmap.fill(QtGui.QColor(*ResultTile.PLACEHOLDER_COLOR))
+            ResultTile.__placeholders[size] = pixmap
+        return ResultTile.__placeholders[size]
+
+    def get_result_id(self):
+        return self.__result_id
+
+    def get_size(self):
+        """:return: Returns the size (width, height) of the tile"""
+        return self.__size
+
+    def set_size(self, width, height):
+        """
+        Resizes the tile. The image shown is kept until a new one is set
+        """
+        self.__size = (int(width), int(height))
+        if self.__state == ResultTile.STATE_PLACEHOLDER:
+            self.__show_placeholder()
+
+    def get_state(self):
+        return self.__state
+
+    def get_detail(self):
+        """:return: Returns the resolution of the image shown, or waiting to be loaded, relative to the tile's size"""
+        return self.__detail
+
+    def set_queued(self, detail=1.0):
+        """
+        :param detail: Resolution of the image that will be loaded, relative to the tile's size
+        """
+        self.__state = ResultTile.STATE_QUEUED
+        self.__detail = detail
+
+    def set_image(self, pixmap, detail=1.0):
+        """
+        Shows the image of the result
+        :param pixmap: Image of the result, as large as the tile times its detail
+        :param detail: Resolution of the image relative to the tile's size. The image is scaled up by its inverse
+        """
+        self.__remove_layers()
+        self.setPixmap(pixmap)
+        self.setTransform(QtGui.QTransform.fromScale(1 / detail, 1 / detail))
+        self.__detail = detail
+        self.__state = ResultTile.STATE_LOADED
+
+    def get_drawn_layers(self):
+        """:return: Returns the names of the layers drawn for the stacks set with set_layers"""
+        return self.__drawn_layers
+
+    def set_layers(self, stacks, visible, drawn):
+        """
+        Shows the image of the result as a stack of layers. An overlay may be larger than the original image (e.g. when
+        it shows the reference next to it), and then the original image is smaller while it is shown, so there can be a
+        stack for each arrangement of the layers
+        :param stacks: List of tuples (pixmap of the original image, as large as the tile, list of tuples (layer name,
+        transparent pixmap, position (x, y) in the tile)). The layers are drawn in order. The first stack that has every
+        visible layer is shown
+        :param visible: Names of the layers to show
+        :param drawn: Names of the layers that were drawn, including the ones the result doesn't have (which aren't in
+        the stacks)
+        """
+        self.__remove_layers()
+        self.setTransform(QtGui.QTransform())
+        self.__detail = 1.0
+        self.__drawn_layers = frozenset(drawn)
+        for base, layers in stacks:
+            children = {}
+            for name, pixmap, (x, y) in layers:
+                child = QtWidgets.QGraphicsPixmapItem(pixmap, self)
+                child.setPos(x, y)
+                child.setVisible(False)
+                children[name] = child
+            self.__stacks.append((base, children))
+        self.__state = ResultTile.STATE_LOADED
+        self.show_layers(visible)
+
+    def show_layers(self, visible):
+        """
+        Shows only the given layers of the stacks set with set_layers
+        :param visible: Names of the layers to show. Layers the result doesn't have, or that weren't drawn, are left out
+        """
+        if len(self.__stacks) == 0:
+            return
+        available = set()
+        for base, children in self.__stacks:
+            available.update(children)
+        visible = set(visible) & available
+        shown = next((i for i, (base, children) in enumerate(self.__stacks) if visible <= set(children)),
+                     len(self.__stacks) - 1)
+        self.setPixmap(self.__stacks[shown][0])
+        for i, (base, children) in enumerate(self.__stacks):
+            for name, child in children.items():
+                child.setVisible(i == shown and name in visible)
+
+    def unload(self):
+        """
+        Goes back to being a placeholder, releasing the image of the result (e.g. when the tile is far out of view)
+        """
+        self.__remove_layers()
+        self.__show_placeholder()
+        self.__state = ResultTile.STATE_PLACEHOLDER
+
+    def __show_placeholder(self):
+        # The placeholder is drawn at its detail and scaled up to exactly the tile's size
+        width = max(int(round(self.__size[0] * self.__placeholder_detail)), 1)
+        height = max(int(round(self.__size[1] * self.__placeholder_detail)), 1)
+        self.setPixmap(ResultTile.get_placeholder(width, height))
+        self.setTransform(QtGui.QTransform.fromScale(self.__size[0] / width, self.__size[1] / height))
+
+    def __remove_layers(self):
+        for base, children in self.__stacks:
+            for child in children.values():
+                if self.scene() is not None:
+                    self.scene().removeItem(child)
+                else:
+                    child.setParentItem(None)
+        self.__stacks = []
+        self.__drawn_layers = frozenset()
+
+    def hoverEnterEvent(self, event):
+        # The tooltip is shown after the pointer rests on the tile for a while, so it is ready by then
+        self.setToolTip(self.__tooltip_provider(self.__result_id))
+        super().hoverEnterEvent(event)
+
+    def hoverLeaveEvent(self, event):
+        # The tooltip is kept by whoever provides it, not by every tile
+        self.setToolTip("")
+        super().hoverLeaveEvent(event)
@@ -1,8 +1,14 @@
 class Result:
-    def __init__(self, id, original_path, img_original):
+    # Results don't have a __dict__, so that thousands of them take little memory
+    __slots__ = ("id", "original_path", "img_original", "img_thumbnails", "frame_index", "timestamp")
+
+    def __init__(self, id, original_path, img_original, frame_index=None, timestamp=None):
         self.id = id
         self.original_path = original_path
-        self.img_original = img_original
+        self.img_original = img_original  # None if the image is to be decoded from the original path when needed
+        self.img_thumbnails = None  # Thumbnail pyramid of the original image, made when it is processed
+        self.frame_index = frame_index
+        self.timestamp = timestamp
 
     def get_id(self):
         return self.id
@@ -10,19 +16,41 @@ class Result:
     def get_original_path(self):
         return self.original_path
 
+    def get_frame_index(self):
+        return self.frame_index
+
+    def get_timestamp(self):
+        return self.timestamp
+
     def get_img_original(self):
         return self.img_original
 
     def set_img_original(self, img_original):
         self.img_original = img_original
 
+    def get_img_thumbnails(self):
+        return self.img_thumbnails
+
+    def set_img_thumbnails(self, img_thumbnails):
+        self.img_thumbnails = img_thumbnails
+
 
 class FMResult(Result):
+    """
+    The keypoints and matches are kept as arrays (see FeatureMatcher.draw_result) and the descriptors only as their
+    number, instead of as lists of cv2.KeyPoint and cv2.DMatch and the descriptors matrix
+    """
+    __slots__ = ("keypoints", "keypoint_sizes", "num_descriptors", "matches", "match_distances", "relevance",
+                 "img_fm_circle_prediction", "img_fm_bounding_box", "img_fm_keypoints", "img_fm_matches")
+
     def __init__(self, info, images):
-        super().__init__(info["id"], info["original_path"], images["img_original"])
-        self.keypoints = info["keypoints"]
-        self.descriptors = info["descriptors"]
-        self.matches = info["matches"]
+        super().__init__(info["id"], info["original_path"], images["img_original"], info["frame_index"], info["timestamp"])
+        self.img_thumbnails = images.get("img_thumbnails")
+        self.keypoints = info["keypoints"]  # Coordinates (x, y) of the keypoints, one per row
+        self.keypoint_sizes = info["keypoint_sizes"]
+        self.num_descriptors = info["num_descriptors"]
+        self.matches = info["matches"]  # Indexes (reference keypoint, keypoint) of the matches, one per row
+        self.match_distances = info["match_distances"]
         self.relevance = info["relevance"]
         self.img_fm_circle_prediction = images['img_fm_circle_prediction']
         self.img_fm_bounding_box = images["img_fm_bounding_box"]
@@ -32,6 +60,12 @@ class FMResult(Result):
     def get_matches(self):
         return self.matches
 
+    def get_match_distances(self):
+        return self.match_distances
+
+    def get_num_matches(self):
+        return len(self.matches)
+
     def get_relevance(self):
         return self.relevance
 
@@ -65,13 +99,23 @@ class FMResult(Result):
     def get_keypoints(self):
         return self.keypoints
 
-    def get_descriptors(self):
-        return self.descriptors
+    def get_keypoint_sizes(self):
+        return self.keypoint_sizes
+
+    def get_num_keypoints(self):
+        return len(self.keypoints)
+
+    def get_num_descriptors(self):
+        return self.num_descriptors
 
 
 class ODResult(Result):
+    __slots__ = ("detections", "avg_confidence", "num_classes", "num_detections", "img_od_bounding_boxes",
+                 "img_od_class_labels", "img_od_masks")
+
     def __init__(self, info, images):
-        super().__init__(info["id"], info["original_path"], images["img_original"])
+        super().__init__(info["id"], info["original_path"], images["img_original"], info["frame_index"], info["timestamp"])
+        self.img_thumbnails = images.get("img_thumbnails")
         self.detections = info["detections"]
         self.avg_confidence = info["avg_confidence"]
         self.num_classes = info["num_classes"]
@@ -1,9 +1,12 @@
 import threading
 
+from image_cache import ImageCache
+from pack_file import PackFile
 from results import Result, FMResult, ODResult
 import os
 import shutil
 import cv2
+import numpy as np
 
 
 class ResultsManager:
@@ -11,9 +14,34 @@ class ResultsManager:
     This class is responsible for managing the results and controlling access to them
     """
 
-    def __init__(self, file_manager):
+    # Overlays (and thumbnail pyramid) of each type of result and the keys they are kept with in the pack file ({0} is
+    # the id of the result)
+    FM_OVERLAYS = (("img_fm_circle_prediction", "{0}_1_0_0_0"), ("img_fm_bounding_box", "{0}_0_1_0_0"),
+                   ("img_fm_keypoints", "{0}_0_0_1_0"), ("img_fm_matches", "{0}_0_0_0_1"),
+                   ("img_thumbnails", "{0}_thumbnails"))
+    OD_OVERLAYS = (("img_od_bounding_boxes", "{0}_1_0_0"), ("img_od_class_labels", "{0}_0_1_0"),
+                   ("img_od_masks", "{0}_0_0_1"), ("img_thumbnails", "{0}_thumbnails"))
+
+    def __init__(self, file_manager, write_backlog=16, image_cache_bytes=256 * 1024 ** 2):
+        """
+        :param file_manager: File manager used to decode the images
+        :param write_backlog: Maximum number of overlays waiting to be written to disk in the background, in disk mode
+        :param image_cache_bytes: Maximum number of bytes taken by the original images and the overlays read from disk
+        that are kept in memory to be shown again. 0 to always decode/read them again
+        """
         self.analysis = []
         self.results = []
+        self.__results_by_id = {}
+        self.__columns = {}  # Summaries of the results, one array per criteria, in the same order as the results
+        self.__pack = None  # File the overlays of the results are kept in, in disk mode
+        self.__new_pack = None  # File the overlays of the results being processed are written to, in disk mode
+        self.__num_packs = 0  # Number of pack files made, so that each one has its own name
+        self.__write_backlog = write_backlog
+        self.__use_disk = False  # Where the images for analysis and the overlays of the results are kept
+        self.__unmigrated = set()  # Images for analysis and results not yet moved to where the storage mode keeps them
+        self.__migration = 0  # Incremented on every change of storage mode, so that older migrations stop
+        self.__storage_lock = threading.RLock()
+        self.__image_cache = ImageCache(image_cache_bytes)
         self.__file_manager = file_manager
 
     def get_analysis(self):
@@ -25,7 +53,8 @@ class ResultsManager:
 
     def open_analysis(self, path, use_disk=False):
         """
-        Sets up the images in the given path to be ready for processing later
+        Sets up the images in the given path to be ready for processing later.
+        Only the paths are kept in memory, the images are decoded when needed
         :param path: Path that points to the directory where the images for analysis are
         """
 
@@ -44,132 +73,210 @@ class ResultsManager:
                 except OSError:
                     return False
 
-            self.analysis = []
-
-            for i in range(len(files)):
+            with self.__storage_lock:
+                # The images being replaced don't need to be moved anymore
+                self.__unmigrated.difference_update(self.analysis)
+                self.analysis = []
+
+            if not use_disk:
+                for i in range(len(files)):
+                    if getattr(thread, "stop", False):
+                        return False
+                    self.analysis.append(Result(i + 1, files[i].get_path(), None, files[i].get_frame_index(),
+                                               files[i].get_timestamp()))
+                return True
+
+            positions = {file: i + 1 for i, file in enumerate(files)}
+
+            def save(img_original, file):
+                if img_original is None:
+                    return None
+                path = dir + "/{0}.jpg".format(positions[file])
+                cv2.imwrite(path, img_original, [int(cv2.IMWRITE_JPEG_QUALITY), 50])
+                return path
+
+            # Decode and save the images in parallel, keeping the order of the files
+            for path, file in self.__file_manager.iter_analysis_images(files, save):
                 if getattr(thread, "stop", False):
-                    if use_disk:
-                        dir = "./temp/analysis"
-                        try:
-                            shutil.rmtree(dir, ignore_errors=True)
-                        except:
-                            pass
-                    return False
-                img_original = files[i][0]#cv2.imread(files[i][1], cv2.IMREAD_COLOR)
-                if use_disk:
-                    path = dir + "/{0}.jpg".format(i + 1)
-                    cv2.imwrite(path, img_original, [int(cv2.IMWRITE_JPEG_QUALITY), 50])
-                    img_original = path
-                self.analysis.append(Result(i + 1, files[i][1], img_original))
-            return True
-        return False
+                    break
+                if path is None:
+                    continue
+                self.analysis.append(Result(len(self.analysis) + 1, file.get_path(), path, file.get_frame_index(),
+                                           file.get_timestamp()))
 
-    def change_storage_mode(self, use_disk):
-        if len(self.analysis) == 0 and len(self.results) == 0:
-            #callback(True)
-            return True
-        if use_disk:
-            # Prepare directories
-            base_dir = "./temp"
-            try:
-                shutil.rmtree(base_dir, ignore_errors=True)
-            except:
-                pass
-            try:
-                os.makedirs(base_dir, exist_ok=True)
-                os.makedirs(base_dir + "/analysis", exist_ok=True)
-                os.makedirs(base_dir + "/processed", exist_ok=True)
-            except OSError:
-                #callback(True)
+            if getattr(thread, "stop", False):
+                try:
+                    shutil.rmtree(dir, ignore_errors=True)
+                except:
+                    pass
                 return False
+            return len(self.analysis) > 0
+        return False
+
+    def iter_analysis(self, analysis=None):
+        """
+        Decodes the images for analysis as they are needed for processing, a few at a time in parallel
+        :param analysis: Images for analysis to decode, all of them if None
+        :return: Yields tuples (result, image), in order, for every image for analysis that could be decoded
+        """
+        # Each image is only needed once, so it doesn't go through the image cache
+        for img, result in self.map_analysis(self.__open_original, analysis):
+            if img is None:
+                continue
+            yield result, img
 
-            # Save unprocessed results' images in disk
-            for item in self.analysis:
-                path = base_dir + "/analysis/{0}.jpg".format(item.get_id())
-                cv2.imwrite(path, item.get_img_original(), [int(cv2.IMWRITE_JPEG_QUALITY), 50])
-                item.set_img_original(path)
+    def map_analysis(self, function, analysis=None):
+        """
+        Applies a function to the images for analysis, a few at a time in parallel
+        :param function: Function result -> value, called in the decoding threads
+        :param analysis: Images for analysis to apply the function to, all of them if None
+        :return: Yields tuples (value, result), in order
+        """
+
+        def video_key(result):
+            if result.get_img_original() is None and result.get_frame_index() is not None:
+                return result.get_original_path()
+            return None
+
+        if analysis is None:
+            analysis = self.analysis
+        return self.__file_manager.decode_in_order(analysis, function, video_key)
 
-            # Save processed results' images in disk
-            for result in self.results:
-                id = result.get_id()
-                result_dir = base_dir + "/processed/{0}".format(id)
+    def change_storage_mode(self, use_disk, sig_progress=None):
+        """
+        Changes where the images for analysis and the overlays of the results are kept. The change is immediate: each
+        image/result is moved to where the new mode keeps it the first time it is accessed, and the rest are moved one
+        at a time by a background thread
+        :param use_disk: True to keep them in disk, False to keep them in memory
+        :param sig_progress: Optional signal emitted with the percentage of images/results moved, as they are moved
+        :return: Returns True if the mode was changed, False otherwise
+        """
+        with self.__storage_lock:
+            if use_disk:
                 try:
-                    os.makedirs(result_dir, exist_ok=True)
+                    os.makedirs("./temp/analysis", exist_ok=True)
+                    os.makedirs("./temp/processed", exist_ok=True)
                 except OSError:
-                    #callback(True)
                     return False
-
-                # Original image
-                #path = result_dir + "/{0}_0_0_0_0.png".format(id)
-                #cv2.imwrite(path, result.get_img_original(), [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-                #result.set_img_original(path)
-
-                if type(result) is FMResult:
-                    # Circle
-                    path = result_dir + "/{0}_1_0_0_0.png".format(id)
-                    cv2.imwrite(path, result.get_img_fm_circle_prediction(), [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-                    result.set_img_fm_circle_prediction(path)
-
-                    # Bounding box
-                    path = result_dir + "/{0}_0_1_0_0.png".format(id)
-                    cv2.imwrite(path, result.get_img_fm_bounding_box(), [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-                    result.set_img_fm_bounding_box(path)
-
-                    # Keypoints
-                    path = result_dir + "/{0}_0_0_1_0.png".format(id)
-                    cv2.imwrite(path, result.get_img_fm_keypoints(), [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-                    result.set_img_fm_keypoints(path)
-
-                    # Matches
-                    path = result_dir + "/{0}_0_0_0_1.png".format(id)
-                    cv2.imwrite(path, result.get_img_fm_matches(), [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-                    result.set_img_fm_matches(path)
-                elif type(result) is ODResult:
-                    # Bounding boxes
-                    if result.get_img_od_bounding_boxes() is not None:
-                        path = result_dir + "/{0}_1_0_0.png".format(id)
-                        cv2.imwrite(path, result.get_img_od_bounding_boxes(), [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-                        result.set_img_od_bounding_boxes(path)
-
-                    # Class labels
-                    if result.get_img_od_class_labels() is not None:
-                        path = result_dir + "/{0}_0_1_0.png".format(id)
-                        cv2.imwrite(path, result.get_img_od_class_labels(), [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-                        result.set_img_od_class_labels(path)
-
-                    # Masks
-                    if result.get_img_od_masks() is not None:
-                        path = result_dir + "/{0}_0_0_1.png".format(id)
-                        cv2.imwrite(path, result.get_img_od_masks(), [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-                        result.set_img_od_masks(path)
-        else:
-            base_dir = "./temp"
-            # Read images and store in memory
-            for item in self.analysis:
-                item.set_img_original(cv2.imread(item.get_img_original(), cv2.IMREAD_COLOR))
-
-            for result in self.results:
-                if type(result.get_img_original()) is str:
-                    result.set_img_original(cv2.imread(result.get_img_original(), cv2.IMREAD_COLOR))
-                if type(result) is FMResult:
-                    result.set_img_fm_bounding_box(cv2.imread(result.get_img_fm_bounding_box(), cv2.IMREAD_UNCHANGED))
-                    result.set_img_fm_circle_prediction(cv2.imread(result.get_img_fm_circle_prediction(), cv2.IMREAD_UNCHANGED))
-                    result.set_img_fm_keypoints(cv2.imread(result.get_img_fm_keypoints(), cv2.IMREAD_UNCHANGED))
-                    result.set_img_fm_matches(cv2.imread(result.get_img_fm_matches(), cv2.IMREAD_UNCHANGED))
-                elif type(result) is ODResult:
-                    result.set_img_od_bounding_boxes(cv2.imread(result.get_img_od_bounding_boxes(), cv2.IMREAD_UNCHANGED))
-                    result.set_img_od_class_labels(cv2.imread(result.get_img_od_class_labels(), cv2.IMREAD_UNCHANGED))
-                    result.set_img_od_masks(cv2.imread(result.get_img_od_masks(), cv2.IMREAD_UNCHANGED))
-            try:
-                shutil.rmtree(base_dir, ignore_errors=True)
-            except:
-                pass
-        #callback(True)
+                if self.__pack is None:
+                    self.__pack = self.__make_pack("./temp/processed")
+            self.__use_disk = use_disk
+            self.__migration += 1
+            items = self.analysis + self.results
+            self.__unmigrated = set(items)
+            migration = self.__migration
+
+        thread = threading.Thread(target=self.__migrate_in_background, args=(items, migration, sig_progress))
+        thread.daemon = True
+        thread.start()
         return True
 
+    def __migrate_in_background(self, items, migration, sig_progress):
+        """
+        Moves the images for analysis and results that weren't accessed yet, one at a time. Stops if the storage mode is
+        changed again
+        """
+        percentage = 0
+        for i, item in enumerate(items):
+            with self.__storage_lock:
+                if migration != self.__migration:
+                    return
+                self.__migrate(item)
+            # 100 is emitted once the migration is finished
+            if sig_progress is not None and percentage != min((i + 1) * 100 // len(items), 99):
+                percentage = min((i + 1) * 100 // len(items), 99)
+                sig_progress.emit(percentage)
+
+        with self.__storage_lock:
+            if migration != self.__migration:
+                return
+            if not self.__use_disk:
+                # Nothing is read from disk anymore
+                self.__close_pack()
+                try:
+                    shutil.rmtree("./temp", ignore_errors=True)
+                except:
+                    pass
+        if sig_progress is not None:
+            sig_progress.emit(100)
+
+    def __migrate(self, item):
+        """
+        Moves an image for analysis or a result to where the storage mode keeps it, if it wasn't moved yet.
+        Must be called with the storage lock held
+        :param item: Image for analysis or result
+        """
+        if item not in self.__unmigrated:
+            return
+        self.__unmigrated.discard(item)
+
+        if type(item) is Result:
+            if not self.__use_disk:
+                # Go back to decoding the original image from its source when needed
+                item.set_img_original(None)
+            elif item.get_img_original() is None:
+                img = self.__open_original(item)
+                if img is not None:
+                    path = "./temp/analysis/{0}.jpg".format(item.get_id())
+                    cv2.imwrite(path, img, [int(cv2.IMWRITE_JPEG_QUALITY), 50])
+                    item.set_img_original(path)
+            return
+
+        overlays = self.FM_OVERLAYS if type(item) is FMResult else self.OD_OVERLAYS
+        if not self.__use_disk and type(item.get_img_original()) is str:
+            item.set_img_original(None)
+        for name, key in overlays:
+            overlay = getattr(item, "get_" + name)()
+            if self.__use_disk:
+                overlay = self.__store_overlay(self.__pack, key.format(item.get_id()), overlay)
+            else:
+                overlay = self.__load_overlay(overlay, True)
+            getattr(item, "set_" + name)(overlay)
+
+    def __migrate_on_access(self, item):
+        # Also called by the GUI's render threads while the background migration changes what is left to move
+        with self.__storage_lock:
+            self.__migrate(item)
+
     def get_results(self):
         return self.results
 
+    def start_results_storage(self, use_disk):
+        """
+        Starts a new pack file for the overlays of the results about to be processed, in disk mode, so that they are
+        written in the background while processing goes on. The current results keep their own pack file until they
+        are replaced
+        :param use_disk: True if the results are kept in disk, False otherwise
+        :return: Returns True if the results can be stored, False otherwise
+        """
+        self.__discard_pack(self.__new_pack)
+        self.__new_pack = None
+        if not use_disk:
+            return True
+        try:
+            self.__new_pack = self.__make_pack("./temp/processed")
+        except OSError:
+            return False
+        return True
+
+    def store_fm_overlays(self, id, images):
+        """
+        Queues the overlays of a feature matching result to be written to the new pack file, replacing them with their
+        keys. Does nothing if storage wasn't started in disk mode, or for overlays that were already stored
+        :param id: Id of the result
+        :param images: Dictionary with the images of the result
+        """
+        self.__store_overlays(id, images, self.FM_OVERLAYS)
+
+    def store_od_overlays(self, id, images):
+        """
+        Queues the overlays of an object detection result to be written to the new pack file, replacing them with their
+        keys. Does nothing if storage wasn't started in disk mode, or for overlays that were already stored
+        :param id: Id of the result
+        :param images: Dictionary with the images of the result
+        """
+        self.__store_overlays(id, images, self.OD_OVERLAYS)
+
     def set_fm_results(self, results, use_disk, sig_progress, index):
         new_results = []
 
@@ -178,56 +285,19 @@ class ResultsManager:
                 new_results.append(FMResult(result["info"], result["images"]))
                 index += 1
                 sig_progress.emit(index)
-            self.results = new_results
+            self.set_results(new_results)
             return True
 
-        base_dir = "./temp/processed"
-        try:
-            shutil.rmtree(base_dir, ignore_errors=True)
-        except:
-            pass
-        try:
-            os.makedirs(base_dir, exist_ok=True)
-        except OSError:
+        # Overlays that weren't stored while processing are stored now
+        if self.__new_pack is None and not self.start_results_storage(True):
             return False
-
         for result in results:
-            id = result["info"]["id"]
-            result_dir = base_dir + "/{0}".format(id)
-            try:
-                os.makedirs(result_dir, exist_ok=True)
-            except OSError:
-                return False
-
-            # Circle
-            path_img_circle = result_dir + "/{0}_1_0_0_0.png".format(id)
-            cv2.imwrite(path_img_circle, result["images"]["img_fm_circle_prediction"],
-                        [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-            result["images"]["img_fm_circle_prediction"] = path_img_circle
-
-            # Bounding box
-            path_img_bounding_box = result_dir + "/{0}_0_1_0_0.png".format(id)
-            cv2.imwrite(path_img_bounding_box, result["images"]["img_fm_bounding_box"],
-                        [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-            result["images"]["img_fm_bounding_box"] = path_img_bounding_box
-
-            # Keypoints
-            path_img_keypoints = result_dir + "/{0}_0_0_1_0.png".format(id)
-            cv2.imwrite(path_img_keypoints, result["images"]["img_fm_keypoints"],
-                        [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-            result["images"]["img_fm_keypoints"] = path_img_keypoints
-
-            # Matches
-            path_img_matches = result_dir + "/{0}_0_0_0_1.png".format(id)
-            cv2.imwrite(path_img_matches, result["images"]["img_fm_matches"], [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-            result["images"]["img_fm_matches"] = path_img_matches
-
+            self.store_fm_overlays(result["info"]["id"], result["images"])
             new_results.append(FMResult(result["info"], result["images"]))
             index += 1
             sig_progress.emit(index)
 
-        self.results = new_results
-        return True
+        return self.__finish_results_storage(new_results)
 
     def set_od_results(self, results, use_disk, sig_progress, index):
         new_results = []
@@ -237,79 +307,71 @@ class ResultsManager:
                 new_results.append(ODResult(result["info"], result["images"]))
                 index += 1
                 sig_progress.emit(index)
-            self.results = new_results
+            self.set_results(new_results)
             return True
 
-        base_dir = "./temp/processed"
-        try:
-            shutil.rmtree(base_dir, ignore_errors=True)
-        except:
-            pass
-        try:
-            os.makedirs(base_dir, exist_ok=True)
-        except OSError:
+        # Overlays that weren't stored while processing are stored now
+        if self.__new_pack is None and not self.start_results_storage(True):
             return False
-
         for result in results:
-            id = result["info"]["id"]
-            result_dir = base_dir + "/{0}".format(id)
-            try:
-                os.makedirs(result_dir, exist_ok=True)
-            except OSError:
-                return False
-
-            # Bounding boxes
-            if result["images"]["img_od_bounding_boxes"] is not None:
-                path_img_bounding_boxes = result_dir + "/{0}_1_0_0.png".format(id)
-                cv2.imwrite(path_img_bounding_boxes, result["images"]["img_od_bounding_boxes"], [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-                result["images"]["img_od_bounding_boxes"] = path_img_bounding_boxes
-
-            # Class labels
-            if result["images"]["img_od_class_labels"] is not None:
-                path_img_class_labels = result_dir + "/{0}_0_1_0.png".format(id)
-                cv2.imwrite(path_img_class_labels, result["images"]["img_od_class_labels"], [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-                result["images"]["img_od_class_labels"] = path_img_class_labels
-
-            # Masks
-            if result["images"]["img_od_masks"] is not None:
-                path_img_masks = result_dir + "/{0}_0_0_1.png".format(id)
-                cv2.imwrite(path_img_masks, result["images"]["img_od_masks"], [int(cv2.IMWRITE_PNG_COMPRESSION), 1])
-                result["images"]["img_od_masks"] = path_img_masks
-
+            self.store_od_overlays(result["info"]["id"], result["images"])
             new_results.append(ODResult(result["info"], result["images"]))
             index += 1
             sig_progress.emit(index)
 
-        self.results = new_results
-        return True
+        return self.__finish_results_storage(new_results)
 
     def set_results(self, results):
-        self.results = results
+        with self.__storage_lock:
+            # The results being replaced don't need to be moved anymore
+            self.__unmigrated.difference_update(self.results)
+            self.results = results
+        self.__results_by_id = {result.get_id(): result for result in results}
+        self.__columns = {
+            "relevance": np.array([self.get_relevance(r) for r in results], dtype="float64"),
+            "num_keypoints": np.array([self.get_num_keypoints(r) for r in results], dtype="int64"),
+            "num_matches": np.array([self.get_num_matches(r) for r in results], dtype="int64"),
+            "avg_confidence": np.array([self.get_avg_confidence(r) for r in results], dtype="float64"),
+            "num_detections": np.array([self.get_num_detections(r) for r in results], dtype="int64"),
+            "original_path": np.array([r.get_original_path() for r in results], dtype="str"),
+            "frame_index": np.array([r.get_frame_index() or 0 for r in results], dtype="int64")}
 
     def sort_results(self, criteria):
-        if "relevance" in criteria.lower():
-            self.results = sorted(self.results, key=lambda r: r.get_relevance(), reverse=True)
-        elif "kps/des" in criteria.lower():
-            self.results = sorted(self.results, key=lambda r: len(r.get_keypoints()), reverse=True)
-        elif "matches" in criteria.lower():
-            self.results = sorted(self.results, key=lambda r: len(r.get_matches()), reverse=True)
-        elif "avg. confidence" in criteria.lower():
-            try:
-                self.results = sorted(self.results, key=lambda r: r.get_avg_confidence(), reverse=True)
-            except Exception:
-                pass
-        elif "detections" in criteria.lower():
-            self.results = sorted(self.results, key=lambda r: r.get_num_detections(), reverse=True)
-        elif "filename" in criteria.lower():
-            self.results = sorted(self.results, key=lambda r: r.get_original_path())
+        """
+        Sorts the results by one of their summaries, using the columns kept for them
+        :param criteria: Name of the criteria, as shown in the GUI
+        """
+        criteria = criteria.lower()
+        if "relevance" in criteria:
+            column = "relevance"
+        elif "kps/des" in criteria:
+            column = "num_keypoints"
+        elif "matches" in criteria:
+            column = "num_matches"
+        elif "avg. confidence" in criteria:
+            column = "avg_confidence"
+        elif "detections" in criteria:
+            column = "num_detections"
+        elif "filename" in criteria:
+            column = None
+        else:
+            return
+        if len(self.results) == 0:
+            return
+
+        if column is None:
+            order = np.lexsort((self.__columns["frame_index"], self.__columns["original_path"]))
+        else:
+            # Highest first, results that tie keep their order
+            order = np.argsort(-self.__columns[column], kind="stable")
+        self.results = [self.results[i] for i in order]
+        self.__columns = {name: values[order] for name, values in self.__columns.items()}
 
     def get_result_at_index(self, index):
         return self.results[index]
 
     def get_result_by_id(self, id):
-        for result in self.results:
-            if result.get_id() == id:
-                return result
+        return self.__results_by_id.get(id)
 
     def get_original_path(self, result):
         return result.get_original_path()
@@ -317,6 +379,12 @@ class ResultsManager:
     def get_id(self, result):
         return result.get_id()
 
+    def get_frame_index(self, result):
+        return result.get_frame_index()
+
+    def get_timestamp(self, result):
+        return result.get_timestamp()
+
     def get_relevance(self, result):
         if type(result) is not FMResult:
             return 0
@@ -327,16 +395,26 @@ class ResultsManager:
             return 0
         return result.get_keypoints()
 
-    def get_descriptors(self, result):
+    def get_num_keypoints(self, result):
+        if type(result) is not FMResult:
+            return 0
+        return result.get_num_keypoints()
+
+    def get_num_descriptors(self, result):
         if type(result) is not FMResult:
             return 0
-        return result.get_descriptors()
+        return result.get_num_descriptors()
 
     def get_matches(self, result):
         if type(result) is not FMResult:
             return 0
         return result.get_matches()
 
+    def get_num_matches(self, result):
+        if type(result) is not FMResult:
+            return 0
+        return result.get_num_matches()
+
     def get_avg_confidence(self, result):
         if type(result) is not ODResult:
             return 0
@@ -352,52 +430,197 @@ class ResultsManager:
             return 0
         return result.get_num_detections()
 
-    # region Images
-    def get_img_original(self, result, img_needed=True):
+    def __make_pack(self, directory):
+        """
+        Makes a new pack file for the overlays of the results, in disk mode
+        :param directory: Directory to keep the pack file in
+        :return: Returns the pack file
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.__num_packs += 1
+        return PackFile(directory + "/results_{0}.pack".format(self.__num_packs), self.__write_backlog)
+
+    def __discard_pack(self, pack):
+        """
+        Closes a pack file and deletes it
+        :param pack: Pack file, or None
+        """
+        if pack is None:
+            return
+        self.__image_cache.invalidate(pack.get_path())
+        pack.close()
+        try:
+            os.remove(pack.get_path())
+        except OSError:
+            pass
+
+    def __close_pack(self):
+        self.__discard_pack(self.__pack)
+        self.__pack = None
+
+    def __finish_results_storage(self, results):
+        """
+        Waits for the overlays of the new results to be written and replaces the current results, and their pack file,
+        with the new ones
+        :param results: New results
+        :return: Returns True if every overlay was written, False otherwise
+        """
+        try:
+            self.__new_pack.flush()
+        except OSError:
+            return False
+        # Both are replaced at once, so that the current results are never moved to, or read from, the new pack file
+        with self.__storage_lock:
+            self.__close_pack()
+            self.__pack, self.__new_pack = self.__new_pack, None
+            self.set_results(results)
+        return True
+
+    def __store_overlays(self, id, images, overlays):
+        if self.__new_pack is None:
+            return
+        for name, key in overlays:
+            images[name] = self.__store_overlay(self.__new_pack, key.format(id), images.get(name))
+
+    def __store_overlay(self, pack, key, overlay):
+        """
+        Queues an overlay to be written to a pack file
+        :param pack: Pack file
+        :param key: Key of the overlay in the pack file
+        :param overlay: Overlay, key of an overlay that was already stored, or None
+        :return: Returns the key of the overlay in the pack file, or None if there is no overlay
+        """
+        if overlay is None or type(overlay) is str:
+            return overlay
+        return pack.append(key, overlay)
+
+    def __load_overlay(self, overlay, copy=False):
+        """
+        :param overlay: Overlay, key of an overlay in the pack file, or None
+        :param copy: True to copy the arrays of an overlay read from the pack file to memory, False to read them as
+        views of the file (through the image cache)
+        :return: Returns the overlay, read from the pack file if needed, or None if there is no pack file anymore (e.g.
+        the result was moved back to memory meanwhile)
+        """
+        if type(overlay) is not str:
+            return overlay
+        # Also called by the GUI's render threads. The pack file isn't replaced or closed while the overlay is read from
+        # it, and the overlay is cached for the pack file it was read from
+        with self.__storage_lock:
+            pack = self.__pack
+            if pack is None:
+                return None
+            if copy:
+                return pack.read(overlay, True)
+            key = (pack.get_path(), overlay)
+            loaded = self.__image_cache.get(key)
+            if loaded is None:
+                loaded = pack.read(overlay)
+                self.__image_cache.put(key, loaded, loaded.get_nbytes())
+            return loaded
+
+    def __open_original(self, result):
+        """
+        Decodes the original image of an image for analysis/result, from its source or from the copy kept in disk
+        :return: Returns the image, or None if it couldn't be decoded
+        """
         img = result.get_img_original()
-        if img_needed and type(img) is str:
+        if img is None:
+            return self.__file_manager.open_analysis_image(result.get_original_path(), result.get_frame_index())
+        if type(img) is str:
             return self.__file_manager.open_image_file(img)
         return img
 
+    def get_image_cache_stats(self):
+        """:return: Returns the hits, misses and evictions of the image cache, and the entries and bytes cached"""
+        return self.__image_cache.get_stats()
+
+    def reset_image_cache_stats(self):
+        self.__image_cache.reset_stats()
+
+    # region Images
+    def get_img_original(self, result, img_needed=True, use_cache=True):
+        """
+        :param result: Image for analysis or result
+        :param img_needed: True to decode the image, False to get what the result keeps (the image, the path of a copy
+        of it, or None if it is decoded from its source)
+        :param use_cache: False for images that are only needed once (e.g. while processing), so that they don't push
+        the images being shown out of the image cache
+        :return: Returns the original image
+        """
+        self.__migrate_on_access(result)
+        img = result.get_img_original()
+        if not img_needed or (img is not None and type(img) is not str):
+            return img
+        if not use_cache:
+            return self.__open_original(result)
+        # The image is shared by whoever gets it from the cache, so it is read-only
+        key = ("original", result.get_original_path(), result.get_frame_index(), img)
+        cached = self.__image_cache.get(key)
+        if cached is None:
+            cached = self.__open_original(result)
+            if cached is not None:
+                cached.setflags(write=False)
+                self.__image_cache.put(key, cached, cached.nbytes)
+        return cached
+
+    def get_img_thumbnails(self, result, img_needed=True):
+        """
+        :return: Returns the thumbnail pyramid of the original image, or None if the result has none (e.g. images for
+        analysis that weren't processed)
+        """
+        self.__migrate_on_access(result)
+        img = result.get_img_thumbnails()
+        if img_needed:
+            return self.__load_overlay(img)
+        return img
+
     def get_img_fm_bounding_box(self, result, img_needed=True):
+        self.__migrate_on_access(result)
         img = result.get_img_fm_bounding_box()
-        if img_needed and type(img) is str:
-            return self.__file_manager.open_image_file(img)
+        if img_needed:
+            return self.__load_overlay(img)
         return img
 
     def get_img_fm_circle_prediction(self, result, img_needed=True):
+        self.__migrate_on_access(result)
         img = result.get_img_fm_circle_prediction()
-        if img_needed and type(img) is str:
-            return self.__file_manager.open_image_file(img)
+        if img_needed:
+            return self.__load_overlay(img)
         return img
 
     def get_img_fm_keypoints(self, result, img_needed=True):
+        self.__migrate_on_access(result)
         img = result.get_img_fm_keypoints()
-        if img_needed and type(img) is str:
-            return self.__file_manager.open_image_file(img)
+        if img_needed:
+            return self.__load_overlay(img)
         return img
 
     def get_img_fm_matches(self, result, img_needed=True):
+        self.__migrate_on_access(result)
         img = result.get_img_fm_matches()
-        if img_needed and type(img) is str:
-            return self.__file_manager.open_image_file(img)
+        if img_needed:
+            return self.__load_overlay(img)
         return img
 
     def get_img_od_bounding_boxes(self, result, img_needed=True):
+        self.__migrate_on_access(result)
         img = result.get_img_od_bounding_boxes()
-        if img_needed and type(img) is str:
-            return self.__file_manager.open_image_file(img)
+        if img_needed:
+            return self.__load_overlay(img)
         return img
 
     def get_img_od_class_labels(self, result, img_needed=True):
+        self.__migrate_on_access(result)
         img = result.get_img_od_class_labels()
-        if img_needed and type(img) is str:
-            return self.__file_manager.open_image_file(img)
+        if img_needed:
+            return self.__load_overlay(img)
         return img
 
     def get_img_od_masks(self, result, img_needed=True):
+        self.__migrate_on_access(result)
         img = result.get_img_od_masks()
-        if img_needed and type(img) is str:
-            return self.__file_manager.open_image_file(img)
+        if img_needed:
+            return self.__load_overlay(img)
         return img
     # endregion
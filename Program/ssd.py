@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 from detection import Detection
+from overlay import Overlay
+from prepared_net import PreparedNet
 
 
 class SSD:
@@ -20,36 +22,67 @@ class SSD:
         self.__model_path = "./resources/models/ssd_model/MobileNetSSD_deploy.caffemodel"
         self.__config_path = "./resources/models/ssd_model/MobileNetSSD_deploy.prototxt.txt"
         self.__net = cv2.dnn.readNetFromCaffe(self.__config_path, self.__model_path)
+        self.__prepared_net = PreparedNet(self.__net, (1, 3, 300, 300))
         self.__confidence_threshold = 0.2
 
     def get_class_labels(self):
         return self.__class_labels
 
     def detect(self, image, object_classes, use_cuda):
-        # Enable/Disable gpu processing
-        if use_cuda:
-            self.__net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-            self.__net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
-        else:
-            self.__net.setPreferableBackend(cv2.dnn.DNN_BACKEND_DEFAULT)
-            self.__net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
-
+        return self.detect_batch([image], object_classes, use_cuda)[0]
+
+    def detect_batch(self, images, object_classes, use_cuda):
+        """
+        Detects the objects in several images with a single forward pass of the network
+        :param images: Images to process
+        :param object_classes: Labels of the classes to detect
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns a list with a tuple (information, images) for each image, like detect
+        """
+        outputs = self.forward_batch(images, use_cuda)
+        return [self.draw(image, output, object_classes) for image, output in zip(images, outputs)]
+
+    def prepare(self, use_cuda):
+        """
+        Sets up and warms up the network for the given backend, so that processing the first images isn't slower
+        :param use_cuda: True to use cuda, False otherwise
+        """
+        self.__prepared_net.prepare(use_cuda)
+
+    def forward_batch(self, images, use_cuda):
+        """
+        Runs several images through the network in a single forward pass
+        :param images: Images to process
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns the output of the network for each image, to be drawn with draw
+        """
+        blob = cv2.dnn.blobFromImages([cv2.resize(image, (300, 300)) for image in images], 0.007843, (300, 300), 127.5)
+        boxes = self.__prepared_net.forward(blob, use_cuda)[0]
+
+        # The detections of every image come together, the first column tells which image each one belongs to
+        return [boxes[0, 0][boxes[0, 0, :, 0] == i] for i in range(len(images))]
+
+    def draw(self, image, boxes, object_classes):
+        """
+        Draws the objects detected in an image
+        :param image: Image that was processed
+        :param boxes: Detections of the network for this image, one per row
+        :param object_classes: Labels of the classes to detect
+        :return: Returns the information regarding the image, and a set of overlays that depict the objects found
+        """
         detections = []
         classes = []
-        img_od_bounding_boxes = np.zeros((image.shape[0], image.shape[1], 4), dtype="uint8")
-        img_od_class_labels = np.zeros((image.shape[0], image.shape[1], 4), dtype="uint8")
-        blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 0.007843, (300, 300), 127.5)
-        self.__net.setInput(blob)
-        boxes = self.__net.forward()
+        img_od_bounding_boxes = Overlay(image.shape[1], image.shape[0])
+        img_od_class_labels = Overlay(image.shape[1], image.shape[0])
 
         # Loop over the detections
-        for i in np.arange(0, boxes.shape[2]):
-            confidence = boxes[0, 0, i, 2]  # Get the confidence
+        for i in np.arange(0, boxes.shape[0]):
+            confidence = boxes[i, 2]  # Get the confidence
 
             # If this detection's confidence is higher than our set confidence
             # threshold then we consider it relevant and process it
             if confidence > self.__confidence_threshold:
-                class_id = int(boxes[0, 0, i, 1])  # Get the id
+                class_id = int(boxes[i, 1])  # Get the id
                 class_name = self.__class_labels[class_id]  # Get the label
                 if class_name not in object_classes:
                     continue
@@ -60,7 +93,7 @@ class SSD:
                 # Scale the bounding box coordinates back,
                 # relative to the size of the frame
                 (H, W) = image.shape[:2]
-                box = boxes[0, 0, i, 3:7] * np.array([W, H, W, H])
+                box = boxes[i, 3:7] * np.array([W, H, W, H])
                 (startX, startY, endX, endY) = box.astype("int")
 
                 # Draw the bounding box
@@ -68,11 +101,11 @@ class SSD:
                 color.append(255)
                 value = image.shape[1] * image.shape[0]
                 thickness = int(round(np.interp(value, [40000, 4000000], [1, 10])))
-                cv2.rectangle(img_od_bounding_boxes, (startX, startY), (endX, endY), color, thickness)
+                img_od_bounding_boxes.add_rectangle((startX, startY), (endX, endY), color, thickness)
 
                 # Draw the class label and confidence
                 text = "{0}: {1}%".format(class_name, round(confidence * 100, 1))
-                desired_text_height = img_od_bounding_boxes.shape[0] * 0.02
+                desired_text_height = image.shape[0] * 0.02
                 font_scale = 0.1
                 while cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, max(int(font_scale * 3), 1))[0][
                     1] < desired_text_height:
@@ -90,8 +123,8 @@ class SSD:
                     text_y = text_h
                 else:
                     text_y = int(startY - 5)
-                cv2.rectangle(img_od_class_labels, (text_x, text_y - text_h), (text_x + text_w, text_y + int(text_h / 2)), color, -1)
-                cv2.putText(img_od_class_labels, text, (text_x, text_y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0, 255), thickness)
+                img_od_class_labels.add_rectangle((text_x, text_y - text_h), (text_x + text_w, text_y + int(text_h / 2)), color, -1)
+                img_od_class_labels.add_text(text, (text_x, text_y), font_scale, (0, 0, 0, 255), thickness)
 
                 #cv2.putText(img_od_class_labels, text, (startX, startY - 10), cv2.FONT_HERSHEY_SIMPLEX, font_scale, color,
                 #            thickness)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the program import each other by name, as when it is run from its directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
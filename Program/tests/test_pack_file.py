@@ -0,0 +1,136 @@
+import threading
+
+import numpy as np
+import pytest
+
+from pack_file import PackFile
+
+
+class Gate:
+    """Object that keeps the background thread from writing it until it is opened"""
+
+    def __init__(self, value):
+        self.value = value
+        self.opened = threading.Event()
+
+    def __getstate__(self):
+        self.opened.wait(5)
+        return {"value": self.value}
+
+    def __setstate__(self, state):
+        self.value = state["value"]
+        self.opened = threading.Event()
+        self.opened.set()
+
+
+def make_objects(seed, count=20):
+    rng = np.random.RandomState(seed)
+    return {"{0}_overlay".format(i): {"points": rng.uniform(0, 100, (rng.randint(0, 50), 2)).astype("float32"),
+                                      "colors": rng.randint(0, 255, (rng.randint(1, 50), 4), dtype="uint8"),
+                                      "texts": ["label {0}".format(i)] * 3, "size": (640, 480)}
+            for i in range(count)}
+
+
+def assert_same(obj, expected):
+    assert obj.keys() == expected.keys()
+    for name, value in expected.items():
+        if isinstance(value, np.ndarray):
+            assert obj[name].dtype == value.dtype
+            np.testing.assert_array_equal(obj[name], value)
+        else:
+            assert obj[name] == value
+
+
+@pytest.mark.parametrize("backlog", [0, 4])
+def test_read_what_was_appended(tmp_path, backlog):
+    objects = make_objects(0)
+    pack = PackFile(str(tmp_path / "pack"), backlog=backlog)
+    for key, obj in objects.items():
+        assert pack.append(key, obj) == key
+    pack.flush()
+
+    for key, obj in objects.items():
+        assert key in pack
+        assert_same(pack.read(key), obj)
+        assert_same(pack.read(key, copy=True), obj)
+    assert "missing" not in pack
+    with pytest.raises(KeyError):
+        pack.read("missing")
+    pack.close()
+
+
+def test_views_are_read_only_and_copies_writable(tmp_path):
+    pack = PackFile(str(tmp_path / "pack"))
+    pack.append("a", {"points": np.arange(100, dtype="float32")})
+
+    view = pack.read("a")["points"]
+    assert not view.flags.writeable
+    with pytest.raises(ValueError):
+        view[0] = 1
+
+    copy = pack.read("a", copy=True)["points"]
+    assert copy.flags.writeable
+    copy[0] = 1
+    assert pack.read("a")["points"][0] == 0
+    pack.close()
+
+
+def test_views_stay_valid_as_the_file_grows(tmp_path):
+    pack = PackFile(str(tmp_path / "pack"))
+    pack.append("first", {"points": np.arange(10, dtype="int64")})
+    view = pack.read("first")["points"]
+    for i in range(50):
+        pack.append(str(i), {"points": np.full(1000, i, dtype="int64")})
+        np.testing.assert_array_equal(pack.read(str(i))["points"], np.full(1000, i))
+    np.testing.assert_array_equal(view, np.arange(10))
+    pack.close()
+
+
+def test_arrays_are_aligned(tmp_path):
+    pack = PackFile(str(tmp_path / "pack"))
+    for i in range(10):
+        pack.append(str(i), {"pad": b"x" * i, "points": np.ones(i + 1, dtype="float64")})
+    for i in range(10):
+        assert pack.read(str(i))["points"].ctypes.data % 64 == 0
+    pack.close()
+
+
+@pytest.mark.parametrize("backlog", [0, 4])
+def test_append_replaces_the_key(tmp_path, backlog):
+    pack = PackFile(str(tmp_path / "pack"), backlog=backlog)
+    pack.append("a", {"points": np.zeros(5, dtype="int32")})
+    pack.append("b", {"points": np.ones(3, dtype="int32")})
+    pack.append("a", {"points": np.full(7, 2, dtype="int32")})
+    pack.flush()
+    np.testing.assert_array_equal(pack.read("a")["points"], np.full(7, 2))
+    np.testing.assert_array_equal(pack.read("b")["points"], np.ones(3))
+    pack.close()
+
+
+def test_pending_objects_are_read_from_memory(tmp_path):
+    pack = PackFile(str(tmp_path / "pack"), backlog=4)
+    gate = Gate(np.arange(4))
+    pack.append("gate", gate)
+    pack.append("after", {"points": np.arange(3)})
+
+    # Neither one is written while the first waits
+    assert pack.read("gate") is gate
+    assert "after" in pack
+    np.testing.assert_array_equal(pack.read("after")["points"], np.arange(3))
+
+    gate.opened.set()
+    pack.flush()
+    written = pack.read("gate")
+    assert written is not gate
+    np.testing.assert_array_equal(written.value, np.arange(4))
+    pack.close()
+
+
+def test_close_writes_what_is_pending(tmp_path):
+    path = str(tmp_path / "pack")
+    pack = PackFile(path, backlog=2)
+    assert pack.get_path() == path
+    for key, obj in make_objects(1).items():
+        pack.append(key, obj)
+    pack.close()
+    assert (tmp_path / "pack").stat().st_size > 0
@@ -0,0 +1,274 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from overlay import Overlay
+from results import Result, FMResult, ODResult
+from results_manager import ResultsManager
+
+
+def make_fm_result(id, original_path, frame_index, relevance, num_keypoints, num_matches, images=None):
+    info = {"id": id, "original_path": original_path, "frame_index": frame_index, "timestamp": None,
+            "keypoints": np.zeros((num_keypoints, 2), dtype="float32"),
+            "keypoint_sizes": np.ones(num_keypoints, dtype="float32"), "num_descriptors": num_keypoints,
+            "matches": np.zeros((num_matches, 2), dtype="int32"),
+            "match_distances": np.zeros(num_matches, dtype="float32"), "relevance": relevance}
+    if images is None:
+        images = {"img_original": None, "img_fm_circle_prediction": None, "img_fm_bounding_box": None,
+                  "img_fm_keypoints": None, "img_fm_matches": None}
+    return FMResult(info, images)
+
+
+def make_od_result(id, original_path, frame_index, avg_confidence, num_detections, images=None):
+    info = {"id": id, "original_path": original_path, "frame_index": frame_index, "timestamp": None,
+            "detections": [object()] * num_detections, "avg_confidence": avg_confidence, "num_classes": 1}
+    if images is None:
+        images = {"img_original": None, "img_od_bounding_boxes": None, "img_od_class_labels": None,
+                  "img_od_masks": None}
+    return ODResult(info, images)
+
+
+def make_fm_results(seed, count=60):
+    """:return: Returns results with many ties, frames of the same videos and images in no particular order"""
+    rng = np.random.RandomState(seed)
+    results = []
+    for id in range(count):
+        path = "/images/{0}.{1}".format(rng.choice(["a", "b", "c", "d"]), rng.choice(["mp4", "jpg"]))
+        frame_index = int(rng.randint(0, 5)) if path.endswith("mp4") else None
+        results.append(make_fm_result(id, path, frame_index, float(rng.randint(0, 4)) / 4, int(rng.randint(0, 5)),
+                                      int(rng.randint(0, 5))))
+    return results
+
+
+def make_od_results(seed, count=60):
+    rng = np.random.RandomState(seed)
+    return [make_od_result(id, "/images/{0}.jpg".format(rng.choice(["a", "b", "c"])), None,
+                           float(rng.randint(0, 4)) / 4, int(rng.randint(0, 4))) for id in range(count)]
+
+
+def ids(results):
+    return [result.get_id() for result in results]
+
+
+def sort(results, criteria):
+    manager = ResultsManager(None)
+    manager.set_results(list(results))
+    manager.sort_results(criteria)
+    return manager.get_results()
+
+
+# Keys the results were sorted by with sorted(..., reverse=True), before the summaries were kept in columns
+@pytest.mark.parametrize("criteria, key", [
+    ("Relevance", lambda r: r.get_relevance()),
+    ("Kps/Des", lambda r: len(r.get_keypoints())),
+    ("Matches", lambda r: len(r.get_matches())),
+])
+def test_sort_fm_results_like_sorted(criteria, key):
+    for seed in range(5):
+        results = make_fm_results(seed)
+        assert ids(sort(results, criteria)) == ids(sorted(results, key=key, reverse=True))
+
+
+@pytest.mark.parametrize("criteria, key", [
+    ("Avg. Confidence", lambda r: r.get_avg_confidence()),
+    ("Detections", lambda r: r.get_num_detections()),
+])
+def test_sort_od_results_like_sorted(criteria, key):
+    for seed in range(5):
+        results = make_od_results(seed)
+        assert ids(sort(results, criteria)) == ids(sorted(results, key=key, reverse=True))
+
+
+def test_sort_by_filename_keeps_the_frames_in_order():
+    for seed in range(5):
+        results = make_fm_results(seed)
+        expected = sorted(results, key=lambda r: (r.get_original_path(), r.get_frame_index() or 0))
+        assert ids(sort(results, "Filename")) == ids(expected)
+
+
+def test_sort_keeps_the_summaries_with_their_results():
+    manager = ResultsManager(None)
+    manager.set_results(make_fm_results(0))
+    manager.sort_results("Relevance")
+    manager.sort_results("Matches")
+    results = manager.get_results()
+    assert ids(results) == ids(sorted(results, key=lambda r: len(r.get_matches()), reverse=True))
+    manager.sort_results("Relevance")
+    assert ids(manager.get_results()) == ids(sorted(results, key=lambda r: r.get_relevance(), reverse=True))
+
+
+def test_sort_by_unknown_criteria_or_without_results():
+    results = make_fm_results(0)
+    assert ids(sort(results, "Something else")) == ids(results)
+    assert sort([], "Relevance") == []
+
+
+class FileManager:
+    """Decodes every image for analysis as the same image"""
+
+    def open_analysis_image(self, path, frame_index=None):
+        return np.full((48, 64, 3), 120, dtype="uint8")
+
+    def open_image_file(self, path):
+        return np.full((48, 64, 3), 120, dtype="uint8")
+
+
+class Progress:
+    """Signal the percentages are emitted through, which tells when the migration is finished"""
+
+    def __init__(self):
+        self.values = []
+        self.finished = threading.Event()
+
+    def emit(self, value):
+        self.values.append(value)
+        if value == 100:
+            self.finished.set()
+
+
+def make_overlay(seed):
+    rng = np.random.RandomState(seed)
+    overlay = Overlay(64, 48)
+    overlay.add_keypoints(rng.uniform(0, 64, (20, 2)), (0, 255, 0, 255))
+    overlay.add_rectangle((5, 5), (40, 30), (255, 0, 0, 255), 2)
+    overlay.add_polygon([(1, 1), (60, 2), (30, 40)], (0, 0, 255, 255), 1)
+    return overlay
+
+
+def make_fm_images(seed):
+    return {"img_original": None, "img_fm_circle_prediction": make_overlay(seed),
+            "img_fm_bounding_box": make_overlay(seed + 1), "img_fm_keypoints": make_overlay(seed + 2),
+            "img_fm_matches": None}
+
+
+def make_od_images(seed):
+    return {"img_original": None, "img_od_bounding_boxes": make_overlay(seed),
+            "img_od_class_labels": make_overlay(seed + 1), "img_od_masks": None}
+
+
+FM_GETTERS = ("get_img_fm_circle_prediction", "get_img_fm_bounding_box", "get_img_fm_keypoints", "get_img_fm_matches")
+OD_GETTERS = ("get_img_od_bounding_boxes", "get_img_od_class_labels", "get_img_od_masks")
+
+
+def rendered(manager, results, getters):
+    """:return: Returns the overlays of the results drawn, None for the ones they don't have"""
+    images = []
+    for result in results:
+        for getter in getters:
+            overlay = getattr(manager, getter)(result)
+            images.append(None if overlay is None else overlay.render())
+    return images
+
+
+def assert_same_images(images, expected):
+    assert len(images) == len(expected)
+    for image, expected_image in zip(images, expected):
+        if expected_image is None:
+            assert image is None
+        else:
+            np.testing.assert_array_equal(image, expected_image)
+
+
+def change_storage_mode(manager, use_disk):
+    progress = Progress()
+    assert manager.change_storage_mode(use_disk, progress)
+    assert progress.finished.wait(10)
+    return progress
+
+
+def make_manager(count=8):
+    manager = ResultsManager(FileManager(), write_backlog=4)
+    fm_results = [make_fm_result(i, "/images/{0}.jpg".format(i), None, 0.5, 3, 2, images=make_fm_images(i * 3))
+                  for i in range(count)]
+    od_results = [make_od_result(count + i, "/images/{0}.jpg".format(i), None, 0.5, 1, images=make_od_images(i * 2))
+                  for i in range(count)]
+    manager.set_results(fm_results + od_results)
+    return manager, fm_results, od_results
+
+
+def test_migrate_results_to_disk_and_back(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager, fm_results, od_results = make_manager()
+    expected_fm = rendered(manager, fm_results, FM_GETTERS)
+    expected_od = rendered(manager, od_results, OD_GETTERS)
+
+    progress = change_storage_mode(manager, True)
+    assert progress.values == sorted(progress.values)
+    # The overlays are kept in the pack file, and only their keys in the results
+    for result in fm_results:
+        assert type(manager.get_img_fm_keypoints(result, img_needed=False)) is str
+        assert manager.get_img_fm_matches(result, img_needed=False) is None
+    for result in od_results:
+        assert type(manager.get_img_od_bounding_boxes(result, img_needed=False)) is str
+    assert_same_images(rendered(manager, fm_results, FM_GETTERS), expected_fm)
+    assert_same_images(rendered(manager, od_results, OD_GETTERS), expected_od)
+
+    change_storage_mode(manager, False)
+    for result in fm_results:
+        assert type(manager.get_img_fm_keypoints(result, img_needed=False)) is Overlay
+    assert_same_images(rendered(manager, fm_results, FM_GETTERS), expected_fm)
+    assert_same_images(rendered(manager, od_results, OD_GETTERS), expected_od)
+    assert not os.path.exists("./temp")
+
+
+def test_results_accessed_while_migrating(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager, fm_results, od_results = make_manager(count=40)
+    expected = rendered(manager, fm_results, FM_GETTERS)
+
+    for use_disk in (True, False, True):
+        progress = Progress()
+        assert manager.change_storage_mode(use_disk, progress)
+        # Moved on access, the last ones before the background thread gets to them
+        for i in reversed(range(len(fm_results))):
+            assert_same_images(rendered(manager, [fm_results[i]], FM_GETTERS),
+                               expected[i * len(FM_GETTERS):(i + 1) * len(FM_GETTERS)])
+        assert progress.finished.wait(10)
+    assert_same_images(rendered(manager, fm_results, FM_GETTERS), expected)
+    change_storage_mode(manager, False)
+
+
+def test_migrate_images_for_analysis(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = ResultsManager(FileManager())
+    analysis = [Result(i, "/images/{0}.jpg".format(i), None) for i in range(5)]
+    manager.set_analysis(analysis)
+
+    change_storage_mode(manager, True)
+    for result in analysis:
+        path = manager.get_img_original(result, img_needed=False)
+        assert type(path) is str and os.path.isfile(path)
+        assert manager.get_img_original(result).shape == (48, 64, 3)
+
+    change_storage_mode(manager, False)
+    for result in analysis:
+        assert manager.get_img_original(result, img_needed=False) is None
+        assert manager.get_img_original(result).shape == (48, 64, 3)
+
+
+def test_set_results_in_disk_mode(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = ResultsManager(FileManager(), write_backlog=4)
+    infos = [make_fm_result(i, "/images/{0}.jpg".format(i), None, 0.5, 3, 2) for i in range(6)]
+    results = [{"info": {"id": r.get_id(), "original_path": r.get_original_path(), "frame_index": None,
+                         "timestamp": None, "keypoints": r.get_keypoints(), "keypoint_sizes": r.get_keypoint_sizes(),
+                         "num_descriptors": r.get_num_descriptors(), "matches": r.get_matches(),
+                         "match_distances": r.get_match_distances(), "relevance": r.get_relevance()},
+                "images": make_fm_images(i * 3)} for i, r in enumerate(infos)]
+    expected = [None if image is None else image.render() for result in results
+                for image in (result["images"]["img_fm_circle_prediction"], result["images"]["img_fm_bounding_box"],
+                              result["images"]["img_fm_keypoints"], result["images"]["img_fm_matches"])]
+
+    assert manager.start_results_storage(True)
+    # Some overlays are stored while processing, the rest when the results are set
+    for result in results[:3]:
+        manager.store_fm_overlays(result["info"]["id"], result["images"])
+    assert manager.set_fm_results(results, True, Progress(), 0)
+
+    stored = manager.get_results()
+    assert [r.get_id() for r in stored] == list(range(6))
+    for result in stored:
+        assert type(manager.get_img_fm_keypoints(result, img_needed=False)) is str
+    assert_same_images(rendered(manager, stored, FM_GETTERS), expected)
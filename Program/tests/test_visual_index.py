@@ -0,0 +1,95 @@
+import threading
+
+import numpy as np
+
+from visual_index import VisualIndex
+
+
+def make_images(seed, num_images=6, per_image=60, dims=16):
+    """:return: Returns a dictionary id -> descriptors, each image with its own cluster of descriptors"""
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(0, 100, (num_images, dims)).astype("float32")
+    return {i + 1: (centers[i] + rng.normal(0, 1, (per_image, dims))).astype("float32") for i in range(num_images)}
+
+
+def iter_of(images):
+    return lambda: iter(images.items())
+
+
+def build_in_thread(index, key, images, stop_at_step=None):
+    """
+    Builds an index in a thread, which is stopped once the given number of steps are done
+    :return: Returns what build returned
+    """
+    built = []
+
+    def run():
+        thread = threading.currentThread()
+
+        def progress(step):
+            if stop_at_step is not None and step >= stop_at_step:
+                thread.stop = True
+
+        built.append(index.build(key, list(images), iter_of(images), progress))
+
+    thread = threading.Thread(target=run)
+    thread.stop = False
+    thread.start()
+    thread.join()
+    return built[0]
+
+
+def test_query_finds_the_image_of_the_reference(tmp_path):
+    images = make_images(0)
+    index = VisualIndex(directory=str(tmp_path), vocabulary_size=12, sample_size=1000)
+    assert index.build("a", list(images), iter_of(images))
+
+    for id, descriptors in images.items():
+        assert index.query(descriptors[:20], 3)[0] == id
+
+
+def test_query_without_index_or_descriptors_is_empty(tmp_path):
+    images = make_images(0)
+    index = VisualIndex(directory=str(tmp_path), vocabulary_size=12, sample_size=1000)
+    assert index.query(images[1], 3) == []
+    assert index.build("a", list(images), iter_of(images))
+    assert index.query(None, 3) == []
+    assert index.query(np.zeros((0, 16), dtype="float32"), 3) == []
+
+
+def test_load_reads_the_saved_index(tmp_path):
+    images = make_images(0)
+    built = VisualIndex(directory=str(tmp_path), vocabulary_size=12, sample_size=1000)
+    assert built.build("a", list(images), iter_of(images))
+
+    loaded = VisualIndex(directory=str(tmp_path), vocabulary_size=12, sample_size=1000)
+    assert not loaded.load("b")
+    assert loaded.load("a")
+    for id, descriptors in images.items():
+        assert loaded.query(descriptors, 6) == built.query(descriptors, 6)
+
+
+def test_stopped_build_keeps_the_loaded_index(tmp_path):
+    images = make_images(0)
+    index = VisualIndex(directory=str(tmp_path), vocabulary_size=12, sample_size=1000)
+    assert index.build("a", list(images), iter_of(images))
+    expected = {id: index.query(descriptors, 6) for id, descriptors in images.items()}
+
+    # Stopped while quantizing, after the vocabulary of the other images was clustered
+    other = make_images(1, num_images=4)
+    assert not build_in_thread(index, "b", other, stop_at_step=len(other) + 1)
+
+    assert index.load("a")
+    for id, descriptors in images.items():
+        assert index.query(descriptors, 6) == expected[id]
+
+
+def test_build_without_descriptors_keeps_the_loaded_index(tmp_path):
+    images = make_images(0)
+    index = VisualIndex(directory=str(tmp_path), vocabulary_size=12, sample_size=1000)
+    assert index.build("a", list(images), iter_of(images))
+    expected = index.query(images[2], 6)
+
+    assert not index.build("b", [7, 8], iter_of({7: None, 8: None}))
+    assert index.load("a")
+    assert index.query(images[2], 6) == expected
@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+
+from yolov3 import YOLOv3
+
+CLASS_LABELS = ["person", "bicycle", "car", "dog", "cat"]
+CONFIDENCE_THRESHOLD = 0.5
+THRESHOLD = 0.3
+
+
+def make_yolo():
+    """:return: Returns a YOLOv3 with a few classes, without loading the network"""
+    yolo = YOLOv3.__new__(YOLOv3)
+    yolo._YOLOv3__class_labels = CLASS_LABELS
+    yolo._YOLOv3__colors = np.random.RandomState(5).randint(0, 255, size=(len(CLASS_LABELS), 3), dtype="uint8")
+    yolo._YOLOv3__confidence_threshold = CONFIDENCE_THRESHOLD
+    yolo._YOLOv3__threshold = THRESHOLD
+    return yolo
+
+
+def make_outputs(seed):
+    """:return: Returns outputs like the ones of the network's output layers, with some confident detections"""
+    rng = np.random.RandomState(seed)
+    outputs = []
+    for rows in (300, 1200, 48):
+        output = np.zeros((rows, 5 + len(CLASS_LABELS)), dtype="float32")
+        output[:, 0:2] = rng.uniform(0.1, 0.9, (rows, 2))
+        output[:, 2:4] = rng.uniform(0.02, 0.3, (rows, 2))
+        output[:, 4] = rng.uniform(0, 1, rows)
+        output[:, 5:] = rng.uniform(0, 0.4, (rows, len(CLASS_LABELS)))
+        confident = rng.rand(rows) < 0.05
+        output[confident, 5 + rng.randint(0, len(CLASS_LABELS), confident.sum())] = \
+            rng.uniform(0.5, 1, confident.sum())
+        outputs.append(output)
+    return outputs
+
+
+def loop_decode(image, layerOutputs, object_classes):
+    """
+    Decodes the outputs one detection at a time, as YOLOv3.draw did before it worked on whole arrays
+    :return: Returns a list of tuples (class label, confidence, box) of the detections kept
+    """
+    boxes = []
+    confidences = []
+    class_ids = []
+    for output in layerOutputs:
+        for detection in output:
+            scores = detection[5:]
+            class_id = np.argmax(scores)
+            class_name = CLASS_LABELS[class_id]
+            confidence = scores[class_id]
+            if class_name not in object_classes:
+                continue
+            if confidence > CONFIDENCE_THRESHOLD:
+                (H, W) = image.shape[:2]
+                box = detection[0:4] * np.array([W, H, W, H])
+                (centerX, centerY, width, height) = box.astype("int")
+                startX = int(centerX - (width / 2))
+                startY = int(centerY - (height / 2))
+                boxes.append([startX, startY, int(width), int(height)])
+                confidences.append(float(confidence))
+                class_ids.append(class_id)
+
+    indexes = cv2.dnn.NMSBoxes(boxes, confidences, CONFIDENCE_THRESHOLD, THRESHOLD)
+    if len(indexes) == 0:
+        return []
+    return [(CLASS_LABELS[class_ids[i]], confidences[i], boxes[i]) for i in np.array(indexes).flatten()]
+
+
+def test_draw_keeps_the_detections_of_the_loop():
+    yolo = make_yolo()
+    image = np.zeros((480, 640, 3), dtype="uint8")
+    for seed in range(5):
+        outputs = make_outputs(seed)
+        for object_classes in (CLASS_LABELS, ["dog", "car"], ["cat"]):
+            info, overlays = yolo.draw(image, outputs, object_classes)
+            expected = loop_decode(image, outputs, object_classes)
+
+            detections = [(d.get_class_label(), d.get_confidence()) for d in info["detections"]]
+            assert detections == [(label, confidence) for label, confidence, box in expected]
+            assert info["num_classes"] == len(set(label for label, confidence, box in expected))
+            assert overlays["img_od_bounding_boxes"].is_empty() == (len(expected) == 0)
+
+
+def test_draw_without_detections():
+    yolo = make_yolo()
+    image = np.zeros((100, 100, 3), dtype="uint8")
+    outputs = [np.zeros((10, 5 + len(CLASS_LABELS)), dtype="float32")]
+    info, overlays = yolo.draw(image, outputs, CLASS_LABELS)
+    assert info == {"detections": [], "num_classes": 0}
+    assert overlays["img_od_bounding_boxes"].is_empty()
@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+
+
+class ThumbnailPyramid:
+    """
+    This class keeps an image at a few small sizes (e.g. 128, 256 and 512 pixels on its longest side), so that it can
+    be shown in a grid, pile or spiral without decoding the whole image and shrinking it every time.
+    Each level is kept JPEG encoded, which takes a fraction of the memory/disk of the decoded pixels
+    """
+
+    SIZES = (128, 256, 512)  # Longest side of each level, from the smallest
+
+    def __init__(self, image, sizes=SIZES, quality=90):
+        """
+        :param image: BGR image. Levels that would be larger than it are left out
+        :param sizes: Longest side of each level, from the smallest
+        :param quality: JPEG quality of the levels
+        """
+        self.__original_size = (image.shape[1], image.shape[0])
+        self.__levels = []  # Tuples (size (width, height), JPEG bytes), from the smallest
+        longest = max(image.shape[:2])
+        level = image
+        # Each level is shrunk from the next larger one, which is cheaper than shrinking the image every time
+        for size in sorted((size for size in sizes if size < longest), reverse=True):
+            scale = size / max(level.shape[:2])
+            dim = (max(int(round(level.shape[1] * scale)), 1), max(int(round(level.shape[0] * scale)), 1))
+            level = cv2.resize(level, dim, interpolation=cv2.INTER_AREA)
+            _, encoded = cv2.imencode(".jpg", level, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            self.__levels.insert(0, (dim, encoded.tobytes()))
+
+    def get_original_size(self):
+        """:return: Returns the size (width, height) of the image the pyramid was made from"""
+        return self.__original_size
+
+    def get_nbytes(self):
+        """:return: Returns the number of bytes taken by the encoded levels"""
+        return sum(len(encoded) for size, encoded in self.__levels)
+
+    def get_level(self, width, height):
+        """
+        Decodes the smallest level that is at least as large as the given size
+        :param width: Width the image will be shown with
+        :param height: Height the image will be shown with
+        :return: Returns the BGR image of the level, or None if every level is smaller (the original image should be
+        used instead)
+        """
+        for (w, h), encoded in self.__levels:
+            if w >= width and h >= height:
+                return cv2.imdecode(np.frombuffer(encoded, dtype="uint8"), cv2.IMREAD_COLOR)
+        return None
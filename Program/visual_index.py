@@ -0,0 +1,216 @@
+import hashlib
+import math
+import os
+import threading
+
+import cv2
+import numpy as np
+
+
+class VisualIndex:
+    """
+    This class is responsible for finding the images for analysis that are most likely to contain the reference, without
+    matching the reference against every one of them.
+    The descriptors of the images are quantized into visual words (bag of visual words) and an inverted file maps each
+    word to the images it appears in, so that a query only visits the images that share words with the reference.
+    The index is built once for a set of images and a method, and kept on disk
+    """
+
+    def __init__(self, directory="./cache/visual_index", vocabulary_size=1000, use_tf_idf=True, sample_size=100000):
+        self.__directory = directory
+        self.__vocabulary_size = vocabulary_size  # Number of visual words
+        self.__use_tf_idf = use_tf_idf  # Weight words by how rare they are in the collection, else only by frequency
+        self.__sample_size = sample_size  # Number of descriptors the vocabulary is clustered from
+        self.__kmeans_iterations = 10
+        self.__key = None  # Key of the index that is loaded
+        self.__vocabulary = None  # Visual words, one per row
+        self.__word_matcher = None  # FLANN matcher trained with the vocabulary, to find the closest word of a descriptor
+        self.__ids = None  # Id of each indexed image
+        self.__offsets = None  # Postings of word w are __images[__offsets[w]:__offsets[w + 1]]
+        self.__images = None  # Position (in __ids) of the image of each posting
+        self.__weights = None  # Normalized weight of the word in the image of each posting
+        self.__idf = None  # Inverse document frequency of each word
+
+    def get_key(self, method_key, sources):
+        """
+        Identifies an index by the images it is built over and the method their descriptors are computed with
+        :param method_key: Identifies the method and its parameters (see FeatureMatcher.get_method_key)
+        :param sources: Tuples (path, frame index) of the images for analysis
+        :return: Returns a string that changes whenever the index would have to be built again
+        """
+        sha1 = hashlib.sha1("{0}:{1}:{2}".format(method_key, self.__vocabulary_size, self.__use_tf_idf).encode())
+        for path, frame_index in sources:
+            try:
+                stat = os.stat(path)
+                modified = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                modified = None
+            sha1.update("{0}:{1}:{2}\n".format(path, frame_index, modified).encode())
+        return sha1.hexdigest()
+
+    def load(self, key):
+        """
+        Loads the index with the given key from disk, unless it is already loaded
+        :param key: Key of the index (see get_key)
+        :return: Returns True if the index is loaded, False if it was never built
+        """
+        if self.__key == key:
+            return True
+        try:
+            with np.load(self.__get_path(key)) as data:
+                vocabulary = data["vocabulary"]
+                ids, offsets, images = data["ids"], data["offsets"], data["images"]
+                weights, idf = data["weights"], data["idf"]
+        except (OSError, ValueError, KeyError):
+            return False
+        self.__set_index(key, vocabulary, ids, offsets, images, weights, idf)
+        return True
+
+    def build(self, key, ids, iter_descriptors, progress=None):
+        """
+        Builds the index over a set of images and saves it on disk. The descriptors are read twice, once to cluster the
+        vocabulary from a sample of them and once to quantize them, so they never have to be in memory all at once
+        :param key: Key of the index (see get_key)
+        :param ids: Ids of the images
+        :param iter_descriptors: Function that returns an iterable of tuples (id, descriptors) for the images. The
+        descriptors are None if the image has none
+        :param progress: Optional function called with the number of steps done, out of twice the number of images
+        :return: Returns True if the index was built, False if there are no descriptors or the calling thread was stopped
+        """
+        thread = threading.currentThread()
+        positions = {id: i for i, id in enumerate(ids)}
+        step = 0
+
+        # Take a random sample of the descriptors of each image to cluster the vocabulary from
+        per_image = max(1, int(math.ceil(self.__sample_size / max(len(ids), 1))))
+        rng = np.random.RandomState(0)
+        sample = []
+        for id, descriptors in iter_descriptors():
+            if getattr(thread, "stop", False):
+                return False
+            if descriptors is not None and len(descriptors) > 0:
+                rows = rng.choice(len(descriptors), min(per_image, len(descriptors)), replace=False)
+                sample.append(self.__to_float(descriptors[rows]))
+            step += 1
+            if progress is not None:
+                progress(step)
+        if len(sample) == 0:
+            return False
+        sample = np.concatenate(sample)
+        num_words = min(self.__vocabulary_size, len(sample))
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, self.__kmeans_iterations, 1.0)
+        _, _, vocabulary = cv2.kmeans(sample, num_words, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+        # The loaded index is only replaced once the new one is built, so it stays usable if the build stops
+        word_matcher = self.__make_word_matcher(vocabulary)
+
+        # Quantize the descriptors of every image and count the occurrences of each word
+        posting_words, posting_images, posting_counts = [], [], []
+        num_descriptors = np.zeros(len(ids), dtype="float32")
+        for id, descriptors in iter_descriptors():
+            if getattr(thread, "stop", False):
+                return False
+            if descriptors is not None and len(descriptors) > 0:
+                words, counts = np.unique(self.__quantize(word_matcher, descriptors), return_counts=True)
+                posting_words.append(words)
+                posting_images.append(np.full(len(words), positions[id], dtype="int32"))
+                posting_counts.append(counts)
+                num_descriptors[positions[id]] = len(descriptors)
+            step += 1
+            if progress is not None:
+                progress(step)
+        if len(posting_words) == 0:
+            return False
+        words = np.concatenate(posting_words)
+        images = np.concatenate(posting_images)
+        counts = np.concatenate(posting_counts).astype("float32")
+
+        # Weight each word by its frequency in the image (and its rarity in the collection) and normalize each image
+        if self.__use_tf_idf:
+            document_frequency = np.bincount(words, minlength=num_words)
+            idf = np.log(len(ids) / np.maximum(document_frequency, 1)).astype("float32")
+        else:
+            idf = np.ones(num_words, dtype="float32")
+        weights = counts / num_descriptors[images] * idf[words]
+        norms = np.sqrt(np.bincount(images, weights=weights ** 2, minlength=len(ids)))
+        weights = (weights / np.maximum(norms[images], 1e-12)).astype("float32")
+
+        # Group the postings by word
+        order = np.argsort(words, kind="stable")
+        offsets = np.zeros(num_words + 1, dtype="int64")
+        offsets[1:] = np.cumsum(np.bincount(words, minlength=num_words))
+        ids = np.array(ids)
+        images = images[order]
+        weights = weights[order]
+
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            with open(self.__get_path(key) + ".tmp", "wb") as f:
+                np.savez(f, vocabulary=vocabulary, ids=ids, offsets=offsets, images=images, weights=weights, idf=idf)
+            os.replace(self.__get_path(key) + ".tmp", self.__get_path(key))
+        except OSError:
+            pass
+        self.__set_index(key, vocabulary, ids, offsets, images, weights, idf, word_matcher)
+        return True
+
+    def query(self, descriptors, shortlist_size):
+        """
+        Finds the indexed images that share the most (weighted) visual words with the given descriptors
+        :param descriptors: Descriptors of the reference
+        :param shortlist_size: Maximum number of images to return
+        :return: Returns the ids of the best scoring images, best first. Images that share no words are left out
+        """
+        if self.__key is None or descriptors is None or len(descriptors) == 0:
+            return []
+        words, counts = np.unique(self.__quantize(self.__word_matcher, descriptors), return_counts=True)
+        query_weights = counts / len(descriptors) * self.__idf[words]
+        query_weights /= max(np.linalg.norm(query_weights), 1e-12)
+
+        # Only the postings of the words in the query are visited. An image appears at most once in the postings of a word
+        scores = np.zeros(len(self.__ids), dtype="float32")
+        for word, query_weight in zip(words, query_weights):
+            start, end = self.__offsets[word], self.__offsets[word + 1]
+            scores[self.__images[start:end]] += query_weight * self.__weights[start:end]
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > shortlist_size:
+            candidates = candidates[np.argpartition(-scores[candidates], shortlist_size - 1)[:shortlist_size]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [self.__ids[i].item() for i in candidates]
+
+    def __set_index(self, key, vocabulary, ids, offsets, images, weights, idf, word_matcher=None):
+        self.__vocabulary = vocabulary
+        self.__word_matcher = word_matcher if word_matcher is not None else self.__make_word_matcher(vocabulary)
+        self.__key = key
+        self.__ids = ids
+        self.__offsets = offsets
+        self.__images = images
+        self.__weights = weights
+        self.__idf = idf
+
+    def __make_word_matcher(self, vocabulary):
+        """:return: Returns a FLANN matcher trained with a vocabulary, to find the closest word of a descriptor"""
+        word_matcher = cv2.FlannBasedMatcher(dict(algorithm=1, trees=4), dict(checks=32))
+        word_matcher.add([vocabulary])
+        word_matcher.train()
+        return word_matcher
+
+    def __quantize(self, word_matcher, descriptors):
+        """
+        Finds the closest visual word of each descriptor
+        :param word_matcher: Matcher trained with the vocabulary (see __make_word_matcher)
+        :return: Returns the array of words
+        """
+        matches = word_matcher.match(self.__to_float(descriptors))
+        return np.array([m.trainIdx for m in matches], dtype="int64")
+
+    def __to_float(self, descriptors):
+        """
+        Binary descriptors (ORB, BRISK, AKAZE) are clustered as vectors of bits, whose euclidean distance matches their
+        hamming distance
+        """
+        if descriptors.dtype == np.uint8:
+            return np.unpackbits(descriptors, axis=1).astype("float32")
+        return descriptors.astype("float32")
+
+    def __get_path(self, key):
+        return self.__directory + "/" + key + ".npz"
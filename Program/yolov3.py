@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 from detection import Detection
+from overlay import Overlay
+from prepared_net import PreparedNet
 
 
 class YOLOv3:
@@ -26,6 +28,7 @@ class YOLOv3:
         self.__weights_path = "./resources/models/yolo_model/yolov3.weights"
         self.__config_path = "./resources/models/yolo_model/yolov3.cfg"
         self.__net = cv2.dnn.readNetFromDarknet(self.__config_path, self.__weights_path)
+        self.__prepared_net = PreparedNet(self.__net, (1, 3, 416, 416))
         self.__confidence_threshold = 0.5
         self.__threshold = 0.3
 
@@ -33,61 +36,78 @@ class YOLOv3:
         return self.__class_labels
 
     def detect(self, image, object_classes, use_cuda):
-        # Enable/Disable gpu processing
-        if use_cuda:
-            self.__net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-            self.__net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
-        else:
-            self.__net.setPreferableBackend(cv2.dnn.DNN_BACKEND_DEFAULT)
-            self.__net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
-
+        return self.detect_batch([image], object_classes, use_cuda)[0]
+
+    def detect_batch(self, images, object_classes, use_cuda):
+        """
+        Detects the objects in several images with a single forward pass of the network
+        :param images: Images to process
+        :param object_classes: Labels of the classes to detect
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns a list with a tuple (information, images) for each image, like detect
+        """
+        outputs = self.forward_batch(images, use_cuda)
+        return [self.draw(image, output, object_classes) for image, output in zip(images, outputs)]
+
+    def prepare(self, use_cuda):
+        """
+        Sets up and warms up the network for the given backend, so that processing the first images isn't slower
+        :param use_cuda: True to use cuda, False otherwise
+        """
+        self.__prepared_net.prepare(use_cuda)
+
+    def forward_batch(self, images, use_cuda):
+        """
+        Runs several images through the network in a single forward pass
+        :param images: Images to process
+        :param use_cuda: True to use cuda, False otherwise
+        :return: Returns the output of the network for each image, to be drawn with draw
+        """
+        blob = cv2.dnn.blobFromImages(images, 1 / 255.0, (416, 416), swapRB=True, crop=False)
+        layerOutputs = self.__prepared_net.forward(blob, use_cuda)
+
+        # With more than one image, each output has a set of detections per image
+        return [[output[i] if output.ndim == 3 else output for output in layerOutputs] for i in range(len(images))]
+
+    def draw(self, image, layerOutputs, object_classes):
+        """
+        Draws the objects detected in an image
+        :param image: Image that was processed
+        :param layerOutputs: Outputs of the network for this image
+        :param object_classes: Labels of the classes to detect
+        :return: Returns the information regarding the image, and a set of overlays that depict the objects found
+        """
         detections = []
         classes = []
-        img_od_bounding_boxes = np.zeros((image.shape[0], image.shape[1], 4), dtype="uint8")
-        img_od_class_labels = np.zeros((image.shape[0], image.shape[1], 4), dtype="uint8")
-        layer_names = self.__net.getLayerNames()
-        layer_names = [layer_names[i[0] - 1] for i in self.__net.getUnconnectedOutLayers()]
-        blob = cv2.dnn.blobFromImage(image, 1 / 255.0, (416, 416), swapRB=True, crop=False)
-        self.__net.setInput(blob)
-        layerOutputs = self.__net.forward(layer_names)
-
-        # Lists of detected bounding boxes, confidences, and class IDs
-        boxes = []
-        confidences = []
-        class_ids = []
-
-        # Loop over each of the layer outputs
-        for output in layerOutputs:
-            # Loop over the detections
-            for detection in output:
-                scores = detection[5:]
-                class_id = np.argmax(scores)  # Get the id
-                class_name = self.__class_labels[class_id]  # Get the label
-                confidence = scores[class_id]  # Get the confidence
-
-                if class_name not in object_classes:
-                    continue
-
-                # If this detection's confidence is higher than our set
-                # confidence threshold then we consider it relevant and process it
-                if confidence > self.__confidence_threshold:
-                    # Scale the bounding box coordinates back relative to the
-                    # size of the image, keeping in mind that YOLO actually
-                    # returns the center (x, y)-coordinates of the bounding
-                    # box followed by the boxes' width and height
-                    (H, W) = image.shape[:2]
-                    box = detection[0:4] * np.array([W, H, W, H])
-                    (centerX, centerY, width, height) = box.astype("int")
-
-                    # Get the bounding box top left coordinates
-                    startX = int(centerX - (width / 2))
-                    startY = int(centerY - (height / 2))
-
-                    # Update lists of bounding box coordinates, confidences,
-                    # and class IDs
-                    boxes.append([startX, startY, int(width), int(height)])
-                    confidences.append(float(confidence))
-                    class_ids.append(class_id)
+        img_od_bounding_boxes = Overlay(image.shape[1], image.shape[0])
+        img_od_class_labels = Overlay(image.shape[1], image.shape[0])
+
+        # Put the detections of every output together, one per row
+        output = np.concatenate([o.reshape(-1, o.shape[-1]) for o in layerOutputs])
+        scores = output[:, 5:]
+        class_ids = np.argmax(scores, axis=1)  # Get the ids
+        confidences = scores[np.arange(len(scores)), class_ids]  # Get the confidences
+
+        # Only keep the detections of the classes to detect whose confidence is higher than our set confidence threshold
+        active = np.array([label in object_classes for label in self.__class_labels], dtype=bool)
+        keep = active[class_ids] & (confidences > self.__confidence_threshold)
+        output = output[keep]
+        class_ids = class_ids[keep]
+        confidences = confidences[keep]
+
+        # Scale the bounding box coordinates back relative to the
+        # size of the image, keeping in mind that YOLO actually
+        # returns the center (x, y)-coordinates of the bounding
+        # box followed by the boxes' width and height
+        (H, W) = image.shape[:2]
+        box = (output[:, 0:4] * np.array([W, H, W, H])).astype("int")
+
+        # Get the bounding box top left coordinates
+        startX = (box[:, 0] - box[:, 2] / 2).astype("int")
+        startY = (box[:, 1] - box[:, 3] / 2).astype("int")
+        boxes = np.stack([startX, startY, box[:, 2], box[:, 3]], axis=1).tolist()
+        confidences = confidences.tolist()
+        class_ids = class_ids.tolist()
 
         # Apply non-maxima suppression to suppress weak,
         # overlapping bounding boxes
@@ -112,11 +132,11 @@ class YOLOv3:
                 color.append(255)
                 value = image.shape[1] * image.shape[0]
                 thickness = int(round(np.interp(value, [40000, 4000000], [1, 10])))
-                cv2.rectangle(img_od_bounding_boxes, (startX, startY), (startX + w, startY + h), color, thickness)
+                img_od_bounding_boxes.add_rectangle((startX, startY), (startX + w, startY + h), color, thickness)
 
                 # Draw the class label and confidence
                 text = "{0}: {1}%".format(class_name, round(confidences[i] * 100, 1))
-                desired_text_height = img_od_bounding_boxes.shape[0] * 0.02
+                desired_text_height = image.shape[0] * 0.02
                 font_scale = 0.1
                 while cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, max(int(font_scale * 3), 1))[0][1] < desired_text_height:
                     font_scale += 0.1
@@ -132,8 +152,8 @@ class YOLOv3:
                     text_y = text_h
                 else:
                     text_y = int(startY - 5)
-                cv2.rectangle(img_od_class_labels, (text_x, text_y - text_h), (text_x + text_w, text_y + int(text_h / 2)), color, -1)
-                cv2.putText(img_od_class_labels, text, (text_x, text_y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0, 255), thickness)
+                img_od_class_labels.add_rectangle((text_x, text_y - text_h), (text_x + text_w, text_y + int(text_h / 2)), color, -1)
+                img_od_class_labels.add_text(text, (text_x, text_y), font_scale, (0, 0, 0, 255), thickness)
 
                 # Create detection object
                 detections.append(Detection(confidences[i], class_name))